@@ -0,0 +1,314 @@
+# benchmarks/bench_pipeline.py
+"""
+Per-stage benchmark for the image → tune pipeline.
+
+Runs every stage on images from random_images/ (the enhanced renderer uses
+the dataset_2/ samples; the SoundFont renderer is included when FluidSynth
+and soundfonts/harmonium.sf2 are available) at several durations and reports wall time, CPU time
+and peak memory (RSS high-water mark, or tracemalloc where that is
+unavailable). Results can be saved as a JSON baseline and compared
+against an earlier one to catch regressions.
+
+    python benchmarks/bench_pipeline.py --durations 15 45 300 --save main
+    python benchmarks/bench_pipeline.py --compare main --threshold 0.2
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from image_analysis.color_extractor import extract_dominant_colors
+from image_analysis.feature_analysis import extract_image_features, derive_music_params_from_features
+from music_generation.raga_selector import choose_raga_from_colors, get_raga_swars
+from music_generation.swar_arranger import arrange_swar_sequence, enhance_swar_sequence
+from music_generation.harmonium_synth import synthesize_sequence_to_audio
+from music_generation.wavetable_synth import synthesize_wavetable
+from music_generation.soundfont_synth import soundfont_available, synthesize_soundfont
+from enhance_tune import generate_from_clean_swar_sequence
+
+IMAGE_DIR = os.path.join(ROOT, "random_images")
+BASELINE_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+DEFAULT_DURATIONS = (15, 45, 300)
+
+# Stages that only look at the image are measured once per image
+IMAGE_STAGES = ("extract_dominant_colors", "extract_image_features", "get_raga_swars")
+SEQUENCE_STAGES = ("enhance_swar_sequence", "arrange_swar_sequence")
+RENDER_STAGES = ("synthesize_sequence_to_audio", "synthesize_wavetable", "synthesize_soundfont",
+                 "generate_from_clean_swar_sequence")
+STAGES = IMAGE_STAGES + SEQUENCE_STAGES + RENDER_STAGES
+
+
+def _proc_status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def rss_peak_supported():
+    """
+    True when the kernel lets us reset the RSS high-water mark (Linux ≥ 4.0).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        _proc_status_kb("VmHWM")
+        return True
+    except (OSError, KeyError):
+        return False
+
+
+def measure(fn, seed, memory="rss", quiet=True):
+    """
+    Run fn() and return (result, {"wall_s", "cpu_s", "peak_mb"}).
+
+    memory="rss" resets the process RSS high-water mark before the stage
+    and reports how far above the starting RSS it peaked, at no runtime
+    cost. memory="tracemalloc" re-runs the stage (same seed) under
+    tracemalloc instead, which is portable but much slower for pydub-heavy
+    stages. memory="off" skips the measurement.
+    """
+    sink = io.StringIO() if quiet else sys.stdout
+
+    def run():
+        random.seed(seed)
+        np.random.seed(seed)
+        with contextlib.redirect_stdout(sink):
+            return fn()
+
+    if memory == "rss":
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        rss0 = _proc_status_kb("VmRSS")
+
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    result = run()
+    stats = {
+        "wall_s": time.perf_counter() - wall0,
+        "cpu_s": time.process_time() - cpu0,
+        "peak_mb": None
+    }
+    if memory == "rss":
+        stats["peak_mb"] = max(0, _proc_status_kb("VmHWM") - rss0) / 1024
+    elif memory == "tracemalloc":
+        tracemalloc.start()
+        try:
+            run()
+            stats["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result, stats
+
+
+def pick_images(image_dir, limit):
+    names = sorted(
+        f for f in os.listdir(image_dir)
+        if f.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    return [os.path.join(image_dir, f) for f in names[:limit]]
+
+
+def bench_image(path, durations, tmpdir, seed, memory, quiet, chunked=False):
+    """
+    Yield (stage, duration, stats) for every stage of one image.
+    """
+    colors, s = measure(lambda: extract_dominant_colors(path, 7), seed, memory, quiet)
+    yield "extract_dominant_colors", None, s
+    features, s = measure(lambda: extract_image_features(path), seed, memory, quiet)
+    yield "extract_image_features", None, s
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        raga = choose_raga_from_colors(colors)
+    swar_source, s = measure(lambda: get_raga_swars(raga), seed, memory, quiet)
+    yield "get_raga_swars", None, s
+    music_params = derive_music_params_from_features(features)
+
+    for duration in durations:
+        sequence, s = measure(
+            lambda: enhance_swar_sequence(swar_source, total_duration=duration, music_params=music_params),
+            seed, memory, quiet)
+        yield "enhance_swar_sequence", duration, s
+        _, s = measure(
+            lambda: arrange_swar_sequence(swar_source, total_duration=duration, music_params=music_params),
+            seed, memory, quiet)
+        yield "arrange_swar_sequence", duration, s
+
+        out = os.path.join(tmpdir, "bench.wav")
+        _, s = measure(lambda: synthesize_sequence_to_audio(sequence, out, duration, chunked=chunked),
+                       seed, memory, quiet)
+        yield "synthesize_sequence_to_audio", duration, s
+        _, s = measure(lambda: synthesize_wavetable(sequence, out, duration), seed, memory, quiet)
+        yield "synthesize_wavetable", duration, s
+        if soundfont_available():
+            _, s = measure(lambda: synthesize_soundfont(sequence, out, duration), seed, memory, quiet)
+            yield "synthesize_soundfont", duration, s
+        _, s = measure(
+            lambda: generate_from_clean_swar_sequence(sequence, output_file=out, max_duration=duration,
+                                                      chunked=chunked),
+            seed, memory, quiet)
+        yield "generate_from_clean_swar_sequence", duration, s
+
+
+def summarize(samples):
+    """
+    Collapse per-image samples into median/min/max for each metric.
+    """
+    out = {"runs": len(samples)}
+    for key in ("wall_s", "cpu_s", "peak_mb"):
+        values = [s[key] for s in samples if s[key] is not None]
+        if values:
+            out[key] = {
+                "median": statistics.median(values),
+                "min": min(values),
+                "max": max(values)
+            }
+    return out
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(image_dir, limit, durations, seed, memory, quiet, chunked=False):
+    images = pick_images(image_dir, limit)
+    if not images:
+        raise SystemExit(f"No images found in {image_dir}")
+
+    samples = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n, path in enumerate(images, 1):
+            print(f"[{n}/{len(images)}] {os.path.basename(path)}", file=sys.stderr)
+            for stage, duration, stats in bench_image(path, durations, tmpdir, seed, memory, quiet, chunked):
+                key = "-" if duration is None else str(duration)
+                samples.setdefault(stage, {}).setdefault(key, []).append(stats)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "images": [os.path.basename(p) for p in images],
+            "durations": list(durations),
+            "seed": seed,
+            "memory_method": memory,
+            "chunked": chunked
+        },
+        "results": {
+            stage: {key: summarize(runs) for key, runs in by_duration.items()}
+            for stage, by_duration in samples.items()
+        }
+    }
+
+
+def print_report(report):
+    print(f"\n{'stage':<36}{'dur':>6}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}")
+    print("-" * 72)
+    for stage in STAGES:
+        for key, r in report["results"].get(stage, {}).items():
+            peak = r.get("peak_mb", {}).get("median")
+            print(f"{stage:<36}{key:>6}"
+                  f"{r['wall_s']['median']:>10.3f}{r['cpu_s']['median']:>10.3f}"
+                  f"{peak if peak is not None else float('nan'):>10.1f}")
+
+
+def compare(report, baseline, threshold, min_delta=0.01):
+    """
+    Compare median wall time and peak memory against a baseline.
+
+    Returns:
+        List of human-readable regression lines (empty when none).
+    """
+    regressions = []
+    for stage, by_duration in report["results"].items():
+        for key, r in by_duration.items():
+            base = baseline["results"].get(stage, {}).get(key)
+            if not base:
+                continue
+            metrics = [("wall_s", min_delta)]
+            if report["meta"].get("memory_method") == baseline["meta"].get("memory_method"):
+                metrics.append(("peak_mb", 1.0))
+            for metric, delta in metrics:
+                if metric not in r or metric not in base:
+                    continue
+                new, old = r[metric]["median"], base[metric]["median"]
+                if new > old * (1 + threshold) and new - old > delta:
+                    regressions.append(
+                        f"{stage} [{key}] {metric}: {old:.3f} → {new:.3f} (+{(new / old - 1) * 100:.0f}%)"
+                    )
+    return regressions
+
+
+def baseline_path(name):
+    if name.endswith(".json") or os.sep in name:
+        return name
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=3, help="number of images to benchmark")
+    parser.add_argument("--image-dir", default=IMAGE_DIR)
+    parser.add_argument("--durations", type=float, nargs="+", default=DEFAULT_DURATIONS)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--memory", choices=("auto", "rss", "tracemalloc", "off"), default="auto",
+                        help="peak-memory method (auto: rss where supported, else tracemalloc)")
+    parser.add_argument("--chunked", action="store_true", help="render in float32 chunks (low-memory mode)")
+    parser.add_argument("--verbose", action="store_true", help="show pipeline output")
+    parser.add_argument("--save", metavar="NAME", help="store results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare against a stored baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown ratio (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    durations = [int(d) if float(d).is_integer() else d for d in args.durations]
+    memory = args.memory
+    if memory == "auto":
+        memory = "rss" if rss_peak_supported() else "tracemalloc"
+    report = run_suite(args.image_dir, args.images, durations, args.seed,
+                       memory=memory, quiet=not args.verbose, chunked=args.chunked)
+    print_report(report)
+
+    if args.save:
+        path = baseline_path(args.save)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Baseline saved to {path}")
+
+    if args.compare:
+        with open(baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) vs {args.compare}:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"\n✅ No regressions vs {args.compare} (threshold {args.threshold:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+# benchmarks/load_test.py
+"""
+Local load generator for the two Flask servers.
+
+"generate" mode posts images from random_images/ to server.py's /generate
+with a mix of tune durations. "session" mode plays server2.py's listener
+cycle (/start → poll /status until a tune is ready → download /tune and
+/image). With --sessions N the users are spread over N named sessions,
+which they share as listeners. Each virtual user runs its loop back to
+back for --time seconds.
+The report covers throughput, p50/p95/p99 latency, error and shed
+(429/503) rates per endpoint, and a timeline of request rate and server
+CPU/RSS (summed over the server's process tree, so gunicorn workers count).
+
+    python server.py &   # or: gunicorn -w 4 -b 127.0.0.1:5000 server:app
+    python benchmarks/load_test.py generate --users 4 --time 60 --server-pid $!
+    python benchmarks/load_test.py session --url http://127.0.0.1:5000 --users 20 \\
+        --spawn "gunicorn -w 2 -b 127.0.0.1:5000 server2:app"
+"""
+
+import argparse
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_DIR = os.path.join(ROOT, "random_images")
+DEFAULT_URL = "http://127.0.0.1:5000"
+SHED_STATUSES = (429, 503)
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+# ---------------- HTTP ----------------
+def multipart(fields, files):
+    """
+    Encode form fields and (name, filename, bytes) files as multipart/form-data.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Recorder:
+    """
+    Thread-safe log of (endpoint, start, latency, status) per request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+
+    def request(self, endpoint, url, data=None, headers=None, timeout=600):
+        """
+        Send one request and record it. Returns (status, body); status is 0
+        for connection errors and timeouts.
+        """
+        req = urllib.request.Request(url, data=data, headers=headers or {})
+        start = time.time()
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                status, body = resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            status, body = 0, b""
+        with self.lock:
+            self.records.append((endpoint, start, time.perf_counter() - t0, status))
+        return status, body
+
+    def record(self, endpoint, start, latency, status):
+        with self.lock:
+            self.records.append((endpoint, start, latency, status))
+
+
+# ---------------- virtual users ----------------
+def generate_user(rec, args, images, deadline, rng):
+    while time.time() < deadline:
+        path = rng.choice(images)
+        with open(path, "rb") as f:
+            data = f.read()
+        body, ctype = multipart(
+            {"duration": rng.choice(args.tune_durations), "targets": args.targets},
+            [("image", os.path.basename(path), data)])
+        rec.request("POST /generate", args.url + "/generate", body, {"Content-Type": ctype})
+        time.sleep(args.think)
+
+
+def session_user(rec, args, deadline, rng, session=None):
+    query = f"?session={session}" if session else ""
+    while time.time() < deadline:
+        start, t0 = time.time(), time.perf_counter()
+        duration = rng.choice(args.tune_durations)
+        payload = {"duration": duration, "session": session} if session else {"duration": duration}
+        status, _ = rec.request("POST /start", args.url + "/start", json.dumps(payload).encode(),
+                                {"Content-Type": "application/json"})
+        if status != 200:
+            time.sleep(args.poll)
+            continue
+
+        # Poll until the session is playing, then fetch what a listener would
+        state = {}
+        while time.time() < deadline:
+            status, body = rec.request("GET /status", args.url + "/status" + query)
+            state = json.loads(body) if status == 200 else {}
+            if state.get("tune"):
+                break
+            time.sleep(args.poll)
+        if not state.get("tune"):
+            return
+        rec.record("session ready", start, time.perf_counter() - t0, 200)
+        rec.request("GET /tune", f"{args.url}/tune/{state['tune']}")
+        if state.get("image"):
+            rec.request("GET /image", f"{args.url}/image/{state['image']}")
+        if args.restart:
+            rec.request("POST /stop", args.url + "/stop" + query, b"")
+        time.sleep(args.think)
+
+
+# ---------------- server resource sampling ----------------
+def process_tree(root_pid):
+    """
+    `root_pid` and all its descendants.
+    """
+    parents = {}
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    parents[int(name)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    tree, frontier = {root_pid}, [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        children = [p for p, pp in parents.items() if pp == pid and p not in tree]
+        tree.update(children)
+        frontier += children
+    return tree
+
+
+def tree_usage(root_pid):
+    """
+    (CPU seconds, RSS bytes) summed over a process tree, from /proc.
+    """
+    cpu = rss = 0
+    for pid in process_tree(root_pid):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / CLK_TCK      # utime + stime
+    return cpu, rss
+
+
+def sample_timeline(rec, pid, interval, stop, timeline):
+    last_cpu, _ = tree_usage(pid) if pid else (0.0, 0)
+    last_t, last_n = time.time(), 0
+    while not stop.wait(interval):
+        now = time.time()
+        with rec.lock:
+            done = rec.records[last_n:]
+            last_n = len(rec.records)
+        point = {
+            "t": round(now, 2),
+            "requests_per_s": round(len(done) / (now - last_t), 2),
+            "errors": sum(1 for r in done if r[3] not in (200, 206) and r[3] not in SHED_STATUSES),
+            "shed": sum(1 for r in done if r[3] in SHED_STATUSES)
+        }
+        if pid:
+            cpu, rss = tree_usage(pid)
+            point["cpu_percent"] = round((cpu - last_cpu) / (now - last_t) * 100, 1)
+            point["rss_mb"] = round(rss / 2**20, 1)
+            last_cpu = cpu
+        last_t = now
+        timeline.append(point)
+
+
+# ---------------- report ----------------
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+def summarize(records, elapsed):
+    by_endpoint = {}
+    for endpoint, _, latency, status in records:
+        by_endpoint.setdefault(endpoint, []).append((latency, status))
+    summary = {}
+    for endpoint, rows in sorted(by_endpoint.items()):
+        ok = sorted(lat for lat, status in rows if status in (200, 206))
+        shed = sum(1 for _, status in rows if status in SHED_STATUSES)
+        summary[endpoint] = {
+            "requests": len(rows),
+            "ok": len(ok),
+            "throughput_per_s": round(len(ok) / elapsed, 3),
+            "error_rate": round((len(rows) - len(ok) - shed) / len(rows), 4),
+            "shed_rate": round(shed / len(rows), 4),
+            "p50_s": percentile(ok, 50),
+            "p95_s": percentile(ok, 95),
+            "p99_s": percentile(ok, 99)
+        }
+    return summary
+
+
+def print_report(report):
+    print(f"\n{'endpoint':<18}{'reqs':>7}{'ok/s':>9}{'err %':>8}{'shed %':>8}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}")
+    print("-" * 77)
+    for endpoint, s in report["endpoints"].items():
+        lat = [f"{s[k]:>9.3f}" if s[k] is not None else f"{'-':>9}" for k in ("p50_s", "p95_s", "p99_s")]
+        print(f"{endpoint:<18}{s['requests']:>7}{s['throughput_per_s']:>9.2f}"
+              f"{s['error_rate'] * 100:>8.1f}{s['shed_rate'] * 100:>8.1f}{''.join(lat)}")
+    if report["timeline"] and "cpu_percent" in report["timeline"][0]:
+        cpu = [p["cpu_percent"] for p in report["timeline"]]
+        rss = [p["rss_mb"] for p in report["timeline"]]
+        print(f"\nServer CPU: mean {sum(cpu) / len(cpu):.0f}%, max {max(cpu):.0f}%  "
+              f"RSS: max {max(rss):.0f} MB (last {rss[-1]:.0f} MB)")
+
+
+# ---------------- driver ----------------
+def wait_for(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2).close()
+            return True
+        except urllib.error.HTTPError:
+            return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    return False
+
+
+def run(args):
+    images = sorted(os.path.join(args.image_dir, f) for f in os.listdir(args.image_dir)
+                    if f.lower().endswith((".jpg", ".jpeg", ".png")))
+    if args.mode == "generate" and not images:
+        raise SystemExit(f"No images found in {args.image_dir}")
+
+    server = None
+    pid = args.server_pid
+    if args.spawn:
+        server = subprocess.Popen(shlex.split(args.spawn), cwd=ROOT, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        pid = server.pid
+    try:
+        if not wait_for(args.url + "/metrics", args.startup_timeout):
+            raise SystemExit(f"Server at {args.url} did not come up")
+
+        rec, timeline, stop = Recorder(), [], threading.Event()
+        sampler = threading.Thread(target=sample_timeline, args=(rec, pid, args.interval, stop, timeline),
+                                   daemon=True)
+        start = time.time()
+        deadline = start + args.time
+        users = []
+        for i in range(args.users):
+            rng = random.Random(args.seed + i)
+            if args.mode == "generate":
+                target, user_args = generate_user, (rec, args, images, deadline, rng)
+            else:
+                session = f"load-{i % args.sessions}" if args.sessions else None
+                target, user_args = session_user, (rec, args, deadline, rng, session)
+            users.append(threading.Thread(target=target, args=user_args, daemon=True))
+        print(f"🚦 {args.users} {args.mode} users against {args.url} for {args.time:.0f}s", file=sys.stderr)
+        sampler.start()
+        for u in users:
+            u.start()
+        for u in users:
+            u.join()
+        stop.set()
+        sampler.join()
+        elapsed = time.time() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    return {
+        "meta": {
+            "mode": args.mode,
+            "url": args.url,
+            "users": args.users,
+            "time_s": round(elapsed, 1),
+            "tune_durations": args.tune_durations,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "endpoints": summarize(rec.records, elapsed),
+        "timeline": timeline
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=("generate", "session"),
+                        help="generate: server.py /generate; session: server2.py listener cycle")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--users", type=int, default=4, help="concurrent virtual users")
+    parser.add_argument("--time", type=float, default=60, help="test length in seconds")
+    parser.add_argument("--tune-durations", type=int, nargs="+", default=[7, 15])
+    parser.add_argument("--targets", default="enhanced", help="render targets posted to /generate")
+    parser.add_argument("--image-dir", default=IMAGE_DIR)
+    parser.add_argument("--think", type=float, default=0.0, help="pause between a user's cycles (s)")
+    parser.add_argument("--poll", type=float, default=1.0, help="/status poll interval (s)")
+    parser.add_argument("--restart", action="store_true",
+                        help="session mode: /stop after each cycle so every /start renders anew")
+    parser.add_argument("--sessions", type=int, default=0,
+                        help="session mode: share N named sessions between the users (0: the default session)")
+    parser.add_argument("--server-pid", type=int, help="sample CPU/RSS of this process and its children")
+    parser.add_argument("--spawn", metavar="CMD", help="start the server with CMD (run from the repo root)")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--interval", type=float, default=1.0, help="timeline sample interval (s)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", metavar="FILE", help="write the full report as JSON")
+    args = parser.parse_args(argv)
+    args.url = args.url.rstrip("/")
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report saved to {args.output}")
+    errors = sum(s["requests"] - s["ok"] for s in report["endpoints"].values())
+    return 1 if errors and not any(s["ok"] for s in report["endpoints"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
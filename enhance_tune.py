@@ -1,12 +1,19 @@
 import os
 import re
+import json
 import math
 import random
+import logging
+import threading
 import numpy as np
 import librosa
 from scipy.signal import fftconvolve
 from pydub import AudioSegment
 from pydub.effects import low_pass_filter, high_pass_filter
+from utils.metrics import span
+from utils.audio_utils import pcm_to_float32, float32_to_pcm, soft_limit, WavChunkWriter, StreamingConvolver
+
+logger = logging.getLogger(__name__)
 
 # ======== CONFIGURATION ========
 DATA_DIR = "dataset_2"
@@ -42,10 +49,37 @@ CROSSFADE_BASE_MS        = 120
 INTERVAL_CROSSFADE_FACTOR = 30
 MAX_CROSSFADE_MS          = 450
 
+TRANSPOSE_FACTOR = 0.92  # 0.90–0.95 sounds natural; adjust if needed
+PORTAMENTO_SLIDE_MS = 40
+
 BG_VOLUME_REDUCTION_DB = -20
 RHYTHM_VOLUME_PATTERN  = [1.0,1.05,0.98,1.02,0.97,1.03,0.95,1.0,0.93,0.89]
 SCALE_ORDER = ["Sa", "Re(k)", "Re", "Ga(k)", "Ga", "Ma", "Ma(tivra)", "Pa", "Dha(k)", "Dha", "Ni(k)", "Ni", "Sa"]
 
+# ======== CHUNKED RENDERING ========
+# The melody only ever changes its last MAX_CROSSFADE_MS (crossfades) or a
+# few ms (rubato), so older audio can be handed off in RENDER_CHUNK_MS blocks.
+MELODY_TAIL_MS  = MAX_CROSSFADE_MS + 50
+RENDER_CHUNK_MS = 5000
+LIMITER_THRESHOLD = 0.9
+
+# ======== DURATION BUDGET ========
+# With max_duration the timeline is planned before rendering: intro/outro
+# are kept only if they leave the melody at least MIN_MELODY_SHARE of the
+# tune, only notes that start inside the melody budget are rendered, the
+# last one is held as a phrase ending and the melody fades out over
+# FINAL_FADE_MS at the budget.
+MIN_MELODY_SHARE = 0.5
+FINAL_FADE_MS    = 400
+
+# ======== EXTENSION STATE ========
+# A render made with a state file can later be made longer by rendering
+# only the new notes (extend_enhanced_render). The state records where the
+# melody's final fade begins (the splice point), the last note, the scale,
+# rhythm, background and outro chosen, and, when reverb is on, the dry
+# audio before the splice point so old notes keep ringing into new ones.
+STATE_VERSION = 1
+
 # ======== HUMANIZATION CONFIG ========
 RANDOM_LONG_PRESS_PROB = 0.1   # 10% chance per note
 RANDOM_LONG_PRESS_MULT = 1.5   # 1.5× duration when triggered
@@ -53,26 +87,116 @@ VIBRATO_FREQ_RANGE     = (5.5,7.0)
 VIBRATO_DEPTH_RANGE    = (1.0,1.5)
 
 # ======== LOAD IMPULSE RESPONSE ========
+# The reverb is linear: the impulse response is normalized to unit energy
+# and the wet signal mixed in at REVERB_WET (-6 dB), with the soft limiter
+# catching overshoot. Sections of a tune can then be reverberated apart
+# and summed, their tails ringing into what follows, which is what lets
+# the fixed intro/outro clips be reverberated once (see _prepared_clip).
 IR_SIGNAL = None
+IR_UNIT = None
+REVERB_WET = 0.5
 if os.path.exists(IR_PATH):
     IR_SIGNAL, sr = librosa.load(IR_PATH, sr=44100)
     IR_SIGNAL /= np.max(np.abs(IR_SIGNAL))
+    IR_UNIT = (IR_SIGNAL / np.sqrt(np.sum(IR_SIGNAL ** 2))).astype(np.float32)
 
 # ======== EFFECT UTILITIES ========
-def apply_convolution_reverb(seg: AudioSegment) -> AudioSegment:
-    samples = np.array(seg.get_array_of_samples(), dtype=float)
-    samples = samples.reshape((seg.channels, -1))
-    wet = fftconvolve(samples, IR_SIGNAL[np.newaxis, :], mode='full')[:, :samples.shape[1]]
-    wet = wet / np.max(np.abs(wet)) * (seg.max / 32767)
-    out = AudioSegment(
-        wet.T.astype(np.int16).tobytes(),
-        frame_rate=seg.frame_rate,
-        sample_width=seg.sample_width,
-        channels=seg.channels
-    )
-    return seg.overlay(out - 6)
-
-def portamento(prev_seg: AudioSegment, curr_seg: AudioSegment, slide_ms=40, cents=20) -> AudioSegment:
+def reverb_parts(x):
+    """
+    Reverberate float32 audio (frames × channels).
+
+    Returns:
+        (dry + wet over the length of `x`, the wet tail ringing on after it)
+    """
+    if IR_UNIT is None or len(x) == 0:
+        return x, np.zeros((0, x.shape[1]), dtype=np.float32)
+    wet = fftconvolve(x, IR_UNIT[:, np.newaxis], mode='full', axes=0).astype(np.float32, copy=False)
+    wet *= REVERB_WET
+    head = wet[:len(x)]
+    head += x
+    return head, wet[len(x):]
+
+def _to_float(seg, frame_rate, channels):
+    seg = seg.set_frame_rate(frame_rate).set_channels(channels)
+    return pcm_to_float32(seg.raw_data, seg.sample_width, seg.channels)
+
+def _from_float(x, frame_rate, sample_width):
+    return AudioSegment(float32_to_pcm(x, sample_width).tobytes(), frame_rate=frame_rate,
+                        sample_width=sample_width, channels=x.shape[1])
+
+def mix_with_reverb(sections, frame_rate, channels):
+    """
+    Lay `sections` end to end with reverb: PreparedClips bring their own,
+    AudioSegments (the melody) are convolved here. Each section's tail is
+    added over the start of what follows, as one convolution of the whole
+    would; the tail past the end is cut. Returns limited float32 audio.
+    """
+    parts = [(s.mix, s.tail) if isinstance(s, PreparedClip) else reverb_parts(_to_float(s, frame_rate, channels))
+             for s in sections]
+    total = sum(len(head) for head, _ in parts)
+    out = np.zeros((total, channels), dtype=np.float32)
+    pos = 0
+    for head, tail in parts:
+        out[pos:pos + len(head)] += head
+        pos += len(head)
+        ring = tail[:total - pos]
+        out[pos:pos + len(ring)] += ring
+    soft_limit(out, LIMITER_THRESHOLD)
+    return out
+
+# ======== ASSET CACHE ========
+# Intro/outro clips, samples and backgrounds are decoded once per process
+# (and again only if the file changes). Intro/outro clips are also kept
+# ready to mix: converted to the render's format as float32 and, with
+# reverb on, reverberated with their tails, so a render only convolves
+# the melody it has just made.
+_asset_lock = threading.Lock()
+_decoded = {}
+_prepared = {}
+
+def _decode(path):
+    """
+    The AudioSegment of an audio file, decoded once per file version.
+    """
+    key = (path, os.path.getmtime(path))
+    with _asset_lock:
+        seg = _decoded.get(key)
+    if seg is None:
+        seg = AudioSegment.from_file(path)
+        with _asset_lock:
+            _decoded[key] = seg
+    return seg
+
+class PreparedClip:
+    """
+    A fixed clip ready to mix at one output format: `segment` as decoded,
+    `mix` (dry + wet over the clip, float32) and the reverb `tail` that
+    rings on into whatever follows it.
+    """
+
+    __slots__ = ("segment", "mix", "tail")
+
+    def __init__(self, segment, mix, tail):
+        self.segment = segment
+        self.mix = mix
+        self.tail = tail
+
+    def __len__(self):
+        return len(self.segment)
+
+def _prepared_clip(path, frame_rate, channels):
+    key = (path, os.path.getmtime(path), frame_rate, channels, IR_UNIT is not None)
+    with _asset_lock:
+        clip = _prepared.get(key)
+    if clip is None:
+        seg = _decode(path)
+        mix, tail = reverb_parts(_to_float(seg, frame_rate, channels))
+        clip = PreparedClip(seg, mix, tail)
+        with _asset_lock:
+            _prepared[key] = clip
+    return clip
+
+def portamento(prev_seg: AudioSegment, curr_seg: AudioSegment, slide_ms=PORTAMENTO_SLIDE_MS, cents=20) -> AudioSegment:
     factor = 2 ** (cents / 1200)
     tail = prev_seg[-slide_ms:]._spawn(
         prev_seg[-slide_ms:].raw_data,
@@ -89,85 +213,281 @@ def apply_vibrato(segment: AudioSegment, freq=6, depth_db=1.2) -> AudioSegment:
         modulated = modulated.overlay(segment[i:i+200].apply_gain(gain), position=i)
     return modulated
 
-# ======== MAIN EXPORT FUNCTION ========
-def generate_from_clean_swar_sequence(sequence, output_file=OUTPUT_FILE,max_duration=None):
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-
-    # Decide Intro/Outro Mode
-    mode = random.choice(['none','intro','outro','both','swap'])
-    master = AudioSegment.silent(0)
-    # — RANDOMIZE RHYTHM & SCALE ORDER FOR FRESHNESS —
-    pattern = RHYTHM_VOLUME_PATTERN.copy()
-    random.shuffle(pattern)
-
-    # create a working copy of the scale
-    scale = SCALE_ORDER.copy()
-    # 50% chance to reverse (descending feel)
-    if random.random() < 0.5:
-        scale.reverse()
-    # rotate starting point by a random offset
-    rot = random.randint(0, len(scale)-1)
-    scale = scale[rot:] + scale[:rot]
-
-    # 1) Intro handling
-    if mode in ('intro','both') and os.path.exists(START_TUNE_PATH):
-        master += AudioSegment.from_wav(START_TUNE_PATH)
-    if mode == 'swap' and os.path.exists(END_TUNE_PATH):
-        master += AudioSegment.from_wav(END_TUNE_PATH)
-
-    # 2) Random Background
-    bg = None
-    # collect any .wav file starting with "bg" or "bf"
-    candidates = []
-    for fn in os.listdir(DATA_DIR):
-        if (fn.lower().startswith("bg") or fn.lower().startswith("bf")) and fn.lower().endswith(".wav"):
-            candidates.append(os.path.join(DATA_DIR, fn))
-    if candidates:
-        chosen = random.choice(candidates)
-        bg = AudioSegment.from_file(chosen).apply_gain(BG_VOLUME_REDUCTION_DB)
-
-    # 3) Load Swar Samples
-    swars = {lbl: AudioSegment.from_wav(path)
-             for lbl,path in SWAR_SAMPLE_MAP.items() if os.path.exists(path)}
-    missing = [lbl for lbl in SWAR_SAMPLE_MAP if lbl not in swars]
-    if missing:
-        print(f"⚠️ Warning: Missing audio files for: {missing}")
+# ======== MELODY ASSEMBLY ========
+class MelodyBuffer:
+    """
+    Append-only melody builder that keeps just the tail later notes can
+    still crossfade into or trim. Older audio is passed to `sink`, or kept
+    as parts and joined once by finish().
+    """
+
+    def __init__(self, sink=None, keep_ms=MELODY_TAIL_MS, chunk_ms=RENDER_CHUNK_MS, limit_ms=None,
+                 fade_ms=FINAL_FADE_MS):
+        self.tail = AudioSegment.silent(0)
+        self.flushed_ms = 0
+        self.sink = sink
+        self.parts = []
+        self.keep_ms = keep_ms
+        self.chunk_ms = chunk_ms
+        self.limit_ms = limit_ms
+        self.fade_ms = fade_ms
+
+    def __len__(self):
+        return self.flushed_ms + len(self.tail)
+
+    @property
+    def full(self):
+        """
+        True once the melody has reached `limit_ms`; later notes would be cut.
+        """
+        return self.limit_ms is not None and len(self) >= self.limit_ms
+
+    def append(self, clip, crossfade=0):
+        self.tail = self.tail.append(clip, crossfade=crossfade) if crossfade > 0 else self.tail + clip
+        if len(self.tail) >= self.keep_ms + self.chunk_ms:
+            cut = len(self.tail) - self.keep_ms
+            self._emit(self.tail[:cut])
+            self.tail = self.tail[cut:]
+
+    def pad(self, ms):
+        self.tail += AudioSegment.silent(ms, frame_rate=self.tail.frame_rate)
+
+    def trim(self, ms):
+        if len(self.tail) > ms:
+            self.tail = self.tail[:-ms]
+
+    def _fit(self, seg):
+        """
+        Cut `seg` at limit_ms and fade out the last fade_ms before it. The
+        fade can span several emitted pieces, so each piece gets its share
+        of one dB-linear ramp.
+        """
+        if self.limit_ms is None:
+            return seg
+        start = self.flushed_ms
+        seg = seg[:max(0, self.limit_ms - start)]
+        fade_start = self.limit_ms - self.fade_ms
+        end = start + len(seg)
+        if self.fade_ms > 0 and len(seg) and end > fade_start:
+            a = max(start, fade_start)
+            gain = lambda t: -120.0 * (t - fade_start) / self.fade_ms
+            seg = seg.fade(from_gain=gain(a), to_gain=gain(end), start=a - start, end=end - start)
+        return seg
+
+    def _emit(self, seg):
+        seg = self._fit(seg)
+        self.flushed_ms += len(seg)
+        if self.sink is not None:
+            self.sink(seg)
+        else:
+            self.parts.append(seg)
+
+    def finish(self):
+        """
+        Flush the tail; without a sink, return the whole melody.
+        """
+        if len(self.tail):
+            self._emit(self.tail)
+            self.tail = AudioSegment.silent(0)
+        if self.sink is not None:
+            return None
+        if not self.parts:
+            return AudioSegment.silent(0)
+        # Parts can differ in format if a later clip upgraded the tail
+        ref = self.parts[-1]
+        parts = [p.set_frame_rate(ref.frame_rate).set_channels(ref.channels).set_sample_width(ref.sample_width)
+                 for p in self.parts]
+        return ref._spawn(b"".join(p.raw_data for p in parts))
+
+class ChunkedOutput:
+    """
+    Float32 mixing chain for chunked renders: background loop → reverb →
+    soft limiter → 16-bit WAV, one block at a time. Prepared intro/outro
+    clips skip the convolution; their cached reverb takes its place.
+    """
+
+    def __init__(self, output_file, frame_rate, channels, bg=None, max_ms=None):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.writer = WavChunkWriter(output_file, frame_rate, channels)
+        self.bg = self._to_float(bg) if bg is not None else None
+        self.bg_pos = 0
+        self.reverb = None
+        if IR_UNIT is not None:
+            self.reverb = StreamingConvolver(IR_UNIT * REVERB_WET, channels)
+        self.remaining = None if max_ms is None else int(max_ms * frame_rate / 1000)
+
+    @property
+    def done(self):
+        return self.remaining == 0
+
+    def _to_float(self, seg):
+        return _to_float(seg, self.frame_rate, self.channels)
+
+    def add(self, seg, with_background=False):
+        if self.done or len(seg) == 0:
+            return
+        x = self._to_float(seg)
+        if with_background and self.bg is not None and len(self.bg):
+            idx = (self.bg_pos + np.arange(len(x))) % len(self.bg)
+            x += self.bg[idx]
+            self.bg_pos = (self.bg_pos + len(x)) % len(self.bg)
+        if self.reverb is not None:
+            x += self.reverb.process(x)
+        self._write(x)
+
+    def add_prepared(self, clip):
+        """
+        Add a PreparedClip: the reverb still ringing from before is mixed
+        over it and its cached tail carries on into what follows.
+        """
+        if self.done or len(clip.mix) == 0:
+            return
+        x = clip.mix.copy()
+        if self.reverb is not None:
+            x += self.reverb.splice(len(x), clip.tail)
+        self._write(x)
+
+    def _write(self, x):
+        soft_limit(x, LIMITER_THRESHOLD)
+        if self.remaining is not None:
+            x = x[:self.remaining]
+            self.remaining -= len(x)
+        self.writer.write(x)
+
+    def close(self):
+        self.writer.close()
+
+# ======== TIMELINE PLANNING ========
+def _plan_notes(sequence, swars, rng=random, start_index=1):
+    """
+    Draw each note's random choices (long press, rubato, vibrato) in the
+    order _build_melody used to, before any audio exists, so the timeline
+    can be measured and cut to a budget first.
+
+    `start_index` is the 1-based position of the first note in the whole
+    tune, so phrase holds and accents land where they would in a full run.
+    """
+    plan = []
+    for i, note in enumerate(sequence, start_index):
+        lbl = note['swar'].strip()
+        if lbl not in swars: continue
+        plan.append({
+            'index': i,
+            'swar': lbl,
+            'duration': note['duration'],
+            'volume': note['volume'],
+            'phrase_end': i % NOTES_PER_PHRASE == 0,
+            'long_press': rng.random() < RANDOM_LONG_PRESS_PROB,
+            'rubato': rng.randint(-RUBATO_MAX_OFFSET_MS, RUBATO_MAX_OFFSET_MS),
+            'vibrato': (rng.uniform(*VIBRATO_FREQ_RANGE), rng.uniform(*VIBRATO_DEPTH_RANGE))
+        })
+    return plan
+
+def _note_ms(p):
+    d = max(10, int(p['duration']*1000))
+    if PHRASE_END_HOLD and p['phrase_end']:
+        d = int(d * LONG_PRESS_MULTIPLIER)
+    if p['long_press']:
+        d = int(d * RANDOM_LONG_PRESS_MULT)
+    return d
+
+def _crossfade_ms(prev_lbl, lbl, scale, melody_ms, clip_ms):
+    steps = abs((scale.index(lbl) - scale.index(prev_lbl)) % len(SCALE_ORDER))
+    return min(
+        MAX_CROSSFADE_MS,
+        CROSSFADE_BASE_MS + steps*INTERVAL_CROSSFADE_FACTOR,
+        melody_ms,
+        clip_ms//2
+    )
 
+def _timeline(plan, swars, scale):
+    """
+    Yield the melody length (ms) after each planned note, following the
+    same rules as _build_melody: sample-length cap, transposition stretch,
+    rubato, crossfades, and portamento leading in with the previous clip.
+    """
+    length, prev_lbl, prev_ms = 0, None, 0
+    for p in plan:
+        lbl = p['swar']
+        clip_ms = int(min(_note_ms(p), len(swars[lbl])) / TRANSPOSE_FACTOR)
+        j = p['rubato']
+        if j > 0 or length > -j:
+            length += j
+        cf = _crossfade_ms(prev_lbl, lbl, scale, length, clip_ms) if prev_lbl else 0
+        if prev_lbl and abs(scale.index(prev_lbl)-scale.index(lbl))<=2:
+            clip_ms += prev_ms - PORTAMENTO_SLIDE_MS
+        length += clip_ms - cf
+        prev_lbl, prev_ms = lbl, clip_ms
+        yield length
+
+def _fit_plan(plan, swars, scale, budget_ms):
+    """
+    Keep the notes that start inside `budget_ms` and hold the last one as
+    a phrase ending.
+    """
+    for k, end in enumerate(_timeline(plan, swars, scale)):
+        if end >= budget_ms:
+            plan = plan[:k + 1]
+            break
+    if plan and not plan[-1]['phrase_end']:
+        plan[-1] = dict(plan[-1], phrase_end=True)
+    return plan
+
+def _planned_ms(plan, swars, scale):
+    end = 0
+    for end in _timeline(plan, swars, scale):
+        pass
+    return end
+
+def _fit_intro_outro(intro, outro, max_ms):
+    """
+    Drop the outro, then the intro, while they would leave the melody less
+    than MIN_MELODY_SHARE of the tune.
+    """
+    for clips in (outro, intro):
+        if clips and max_ms - sum(map(len, intro + outro)) < max_ms * MIN_MELODY_SHARE:
+            clips.clear()
+    return intro, outro
 
-    # 4) Build Melody
-    main, prev_seg, prev_lbl = AudioSegment.silent(0), None, None
+# ======== MAIN EXPORT FUNCTION ========
+def _build_melody(plan, swars, pattern, scale, melody):
+    """
+    Assemble the planned note clips (see _plan_notes) into `melody` (a
+    MelodyBuffer), stopping once it is full.
+
+    Returns:
+        (first_lbl, first_clip, last_lbl, last_clip) for joining phrases.
+    """
+    prev_seg, prev_lbl = None, None
+    first_lbl = first_clip = None
     pat = len(RHYTHM_VOLUME_PATTERN)
-    for i, note in enumerate(sequence, 1):
-        lbl = note['swar'].strip()
-        if lbl not in swars: continue
+    for p in plan:
+        if melody.full:
+            break
+        i, lbl = p['index'], p['swar']
 
         # Duration
-        d = max(10, int(note['duration']*1000))
-        if PHRASE_END_HOLD and i%NOTES_PER_PHRASE==0:
-            d = int(d * LONG_PRESS_MULTIPLIER)
-        if random.random() < RANDOM_LONG_PRESS_PROB:
-            d = int(d * RANDOM_LONG_PRESS_MULT)
+        d = _note_ms(p)
 
         # Rubato
-        j = random.randint(-RUBATO_MAX_OFFSET_MS, RUBATO_MAX_OFFSET_MS)
+        j = p['rubato']
         if j>0:
-            main += AudioSegment.silent(j)
-        elif j<0 and len(main)>abs(j):
-            main = main[:-abs(j)]
+            melody.pad(j)
+        elif j<0 and len(melody)>abs(j):
+            melody.trim(abs(j))
 
         # Gain and filters
         breath = pattern[(i-1)%pat]
-        accent = 4 if i%NOTES_PER_PHRASE==0 else 0
-        g = (note['volume']*breath - 0.5)*20 + accent
-        transpose_factor = 0.92  # 0.90–0.95 sounds natural; adjust if needed
+        accent = 4 if p['phrase_end'] else 0
+        g = (p['volume']*breath - 0.5)*20 + accent
         orig_seg = swars[lbl][:d]
-        clip = orig_seg._spawn(orig_seg.raw_data, overrides={'frame_rate': int(orig_seg.frame_rate * transpose_factor)}).set_frame_rate(orig_seg.frame_rate).apply_gain(g)
+        clip = orig_seg._spawn(orig_seg.raw_data, overrides={'frame_rate': int(orig_seg.frame_rate * TRANSPOSE_FACTOR)}).set_frame_rate(orig_seg.frame_rate).apply_gain(g)
         clip = low_pass_filter(clip,4000)
         clip = high_pass_filter(clip,150)
 
         # Dynamic vibrato
-        vf = random.uniform(*VIBRATO_FREQ_RANGE)
-        vd = random.uniform(*VIBRATO_DEPTH_RANGE)
+        vf, vd = p['vibrato']
         clip = apply_vibrato(clip, freq=vf, depth_db=vd)
 
         # Fades
@@ -177,47 +497,406 @@ def generate_from_clean_swar_sequence(sequence, output_file=OUTPUT_FILE,max_dura
         # Crossfade based on scale distance
         cf = 0
         if prev_lbl:
-            idx1 = scale.index(prev_lbl)
-            idx2 = scale.index(lbl)
-            steps = abs((idx2 - idx1) % len(SCALE_ORDER))
-            cf = min(
-                MAX_CROSSFADE_MS,
-                CROSSFADE_BASE_MS + steps*INTERVAL_CROSSFADE_FACTOR,
-                len(main),
-                len(clip)//2
-            )
+            cf = _crossfade_ms(prev_lbl, lbl, scale, len(melody), len(clip))
 
         # Portamento for close moves
         if prev_seg and abs(scale.index(prev_lbl)-scale.index(lbl))<=2:
             clip = portamento(prev_seg, clip)
 
+        if first_lbl is None:
+            first_lbl, first_clip = lbl, clip
+
         # Append
-        main = main.append(clip, crossfade=cf) if cf>0 else main + clip
+        melody.append(clip, crossfade=cf)
         prev_seg, prev_lbl = clip, lbl
 
-    # 5) Mix background
-    if bg and len(main)>0:
-        loops = math.ceil(main.duration_seconds / bg.duration_seconds)
-        bg_loop = (bg*loops)[:len(main)]
-        main = bg_loop.overlay(main)
-
-    # 6) Outro handling
-    if mode in ('outro','both') and os.path.exists(END_TUNE_PATH):
-        master = master + main + AudioSegment.from_wav(END_TUNE_PATH)
-    elif mode=='swap' and os.path.exists(START_TUNE_PATH):
-        master = master + main + AudioSegment.from_wav(START_TUNE_PATH)
-    else:
-        master = master + main
-
-    # 7) Reverb
-    if IR_SIGNAL is not None:
-        master = apply_convolution_reverb(master)
-
-    # 8) Trim to max_duration if specified
+    return first_lbl, first_clip, prev_lbl, prev_seg
+
+# ======== PARALLEL PHRASE RENDERING ========
+_phrase_pool = None
+_phrase_pool_workers = None
+# Servers render from several threads; only one may create the pool
+_phrase_pool_lock = threading.Lock()
+_phrase_swars = None
+
+def _load_swar_samples():
+    global _phrase_swars
+    if _phrase_swars is None:
+        _phrase_swars = {lbl: _decode(path)
+                         for lbl,path in SWAR_SAMPLE_MAP.items() if os.path.exists(path)}
+    return _phrase_swars
+
+def _render_phrase(task):
+    """
+    Process-pool worker: render one planned phrase.
+    """
+    plan, pattern, scale = task
+    melody = MelodyBuffer()
+    first_lbl, first_clip, last_lbl, last_clip = _build_melody(
+        plan, _load_swar_samples(), pattern, scale, melody
+    )
+    return melody.finish(), first_lbl, first_clip, last_lbl, last_clip
+
+def _get_phrase_pool(workers):
+    global _phrase_pool, _phrase_pool_workers
+    with _phrase_pool_lock:
+        if _phrase_pool is None or _phrase_pool_workers != workers:
+            from concurrent.futures import ProcessPoolExecutor
+            if _phrase_pool is not None:
+                _phrase_pool.shutdown(wait=False)
+            _phrase_pool = ProcessPoolExecutor(max_workers=workers)
+            _phrase_pool_workers = workers
+        return _phrase_pool
+
+def _plan_phrases(sequence, swars, rng, start_index=1):
+    """
+    Plan the melody phrase by phrase, each NOTES_PER_PHRASE-note phrase on
+    its own seed drawn from `rng`, so the result depends only on that seed,
+    not on the worker count.
+    """
+    plan = []
+    for start in range(0, len(sequence), NOTES_PER_PHRASE):
+        phrase_rng = random.Random(rng.getrandbits(64))
+        plan += _plan_notes(sequence[start:start + NOTES_PER_PHRASE], swars, phrase_rng,
+                            start_index=start_index + start)
+    return plan
+
+def _build_melody_parallel(plan, pattern, scale, melody, workers=None):
+    """
+    Render every phrase of the plan in a process pool and join them into
+    `melody` with the same crossfade/portamento rules used between notes.
+    """
+    workers = workers or os.cpu_count() or 1
+    phrases = {}
+    for p in plan:
+        phrases.setdefault((p['index'] - 1) // NOTES_PER_PHRASE, []).append(p)
+    tasks = [(phrase, pattern, scale) for _, phrase in sorted(phrases.items())]
+
+    prev_seg, prev_lbl = None, None
+    for audio, first_lbl, first_clip, last_lbl, last_clip in _get_phrase_pool(workers).map(_render_phrase, tasks):
+        if first_lbl is None or melody.full:
+            continue
+        cf = 0
+        if prev_lbl:
+            cf = _crossfade_ms(prev_lbl, first_lbl, scale, len(melody), len(first_clip))
+        if prev_seg and abs(scale.index(prev_lbl)-scale.index(first_lbl))<=2:
+            audio = portamento(prev_seg, audio)
+        melody.append(audio, crossfade=cf)
+        prev_seg, prev_lbl = last_clip, last_lbl
+
+def generate_from_clean_swar_sequence(sequence, output_file=OUTPUT_FILE,max_duration=None, chunked=False,
+                                      seed=None, parallel=False, workers=None, state_file=None):
+    """
+    Render a swar sequence with the dataset_2 harmonium samples.
+
+    With chunked=True the mix is done in float32 blocks and written to a
+    16-bit WAV as it is produced, so peak memory stays roughly constant
+    however long the tune is.
+
+    With parallel=True the melody is rendered phrase by phrase in a pool of
+    `workers` processes (default: all cores). A `seed` makes either mode
+    reproducible.
+
+    With `max_duration` the timeline is planned before any audio is made:
+    intro/outro that fit are kept, only the notes that start inside the
+    remaining melody budget are rendered, and the last of them ends the
+    phrase, fading out right where the outro (or the tune) begins.
+
+    With `state_file` the engine state needed by extend_enhanced_render()
+    is saved there as JSON.
+    """
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    rng = random.Random(seed) if seed is not None else random
+
+    # Decide Intro/Outro Mode
+    mode = rng.choice(['none','intro','outro','both','swap'])
+    # — RANDOMIZE RHYTHM & SCALE ORDER FOR FRESHNESS —
+    pattern = RHYTHM_VOLUME_PATTERN.copy()
+    rng.shuffle(pattern)
+
+    # create a working copy of the scale
+    scale = SCALE_ORDER.copy()
+    # 50% chance to reverse (descending feel)
+    if rng.random() < 0.5:
+        scale.reverse()
+    # rotate starting point by a random offset
+    rot = rng.randint(0, len(scale)-1)
+    scale = scale[rot:] + scale[:rot]
+
+    # 1) Intro / outro clips
+    with span("enhanced.load_intro"):
+        intro_files, outro_files = [], []
+        if mode in ('intro','both') and os.path.exists(START_TUNE_PATH):
+            intro_files.append(START_TUNE_PATH)
+        if mode == 'swap' and os.path.exists(END_TUNE_PATH):
+            intro_files.append(END_TUNE_PATH)
+        if mode in ('outro','both') and os.path.exists(END_TUNE_PATH):
+            outro_files.append(END_TUNE_PATH)
+        elif mode=='swap' and os.path.exists(START_TUNE_PATH):
+            outro_files.append(START_TUNE_PATH)
+        intro = [_decode(f) for f in intro_files]
+        outro = [_decode(f) for f in outro_files]
+
+    # 2) Random Background
+    with span("enhanced.load_background"):
+        bg = chosen = None
+        # collect any .wav file starting with "bg" or "bf"
+        candidates = []
+        for fn in os.listdir(DATA_DIR):
+            if (fn.lower().startswith("bg") or fn.lower().startswith("bf")) and fn.lower().endswith(".wav"):
+                candidates.append(os.path.join(DATA_DIR, fn))
+        if candidates:
+            chosen = rng.choice(sorted(candidates))
+            bg = _decode(chosen).apply_gain(BG_VOLUME_REDUCTION_DB)
+
+    # 3) Load Swar Samples
+    with span("enhanced.load_samples"):
+        swars = {lbl: _decode(path)
+                 for lbl,path in SWAR_SAMPLE_MAP.items() if os.path.exists(path)}
+        missing = [lbl for lbl in SWAR_SAMPLE_MAP if lbl not in swars]
+        if missing:
+            logger.warning("⚠️ Missing audio files for: %s", missing)
+
+    # 4) Plan the timeline: with a duration budget only the notes (and
+    #    intro/outro) that fit are rendered, instead of trimming afterwards
+    with span("enhanced.plan"):
+        parallel = parallel and len(sequence) > NOTES_PER_PHRASE
+        planner = _plan_phrases if parallel else _plan_notes
+        plan = planner(sequence, swars, rng)
+        melody_ms = None
+        if max_duration is not None:
+            max_ms = int(max_duration * 1000)
+            intro, outro = _fit_intro_outro(intro, outro, max_ms)
+            melody_ms = max(0, max_ms - sum(map(len, intro + outro)))
+            # How long the notes sound depends on crossfades and portamento,
+            # so a sequence can fall short of the budget; the melody then
+            # returns to its opening, as a reprise
+            while plan and _planned_ms(plan, swars, scale) < melody_ms:
+                plan += planner(sequence, swars, rng, start_index=plan[-1]['index'] + 1)
+            plan = _fit_plan(plan, swars, scale, melody_ms)
+
+    def build(melody):
+        if parallel:
+            _build_melody_parallel(plan, pattern, scale, melody, workers)
+        else:
+            _build_melody(plan, swars, pattern, scale, melody)
+
+    def save_state(melody_end_ms, faded, dry=None, dry_start_ms=0):
+        if state_file and plan:
+            intro_ms = sum(map(len, intro))
+            _save_state(
+                state_file, dry, dry_start_ms,
+                splice_ms=melody_end_ms - (FINAL_FADE_MS if faded else 0),
+                last_index=plan[-1]['index'], last_swar=plan[-1]['swar'],
+                scale=scale, pattern=pattern,
+                background=chosen, bg_start_ms=intro_ms,
+                outro=outro_files,
+                seed=rng.getrandbits(32)
+            )
+
+    # _fit_intro_outro drops clips all or nothing
+    intro_files, outro_clips = intro_files[:len(intro)], outro_files[:len(outro)]
+
+    if chunked:
+        melody_len, faded = _render_chunked(build, swars, intro_files, outro_clips, bg, output_file,
+                                            max_duration, melody_ms)
+        # The streaming reverb has no whole-file dry master to keep a tail
+        # from, so an extension of a chunked render starts its reverb afresh
+        save_state(sum(map(len, intro)) + melody_len, faded)
+        logger.info("✅ Enhanced audio exported to: %s", output_file)
+        return
+
+    # 5) Build Melody
+    with span("enhanced.melody"):
+        melody = MelodyBuffer(limit_ms=melody_ms)
+        build(melody)
+        faded = melody.full
+        main = melody.finish()
+
+    # 6) Mix background
+    with span("enhanced.background_mix"):
+        if bg and len(main)>0:
+            loops = math.ceil(main.duration_seconds / bg.duration_seconds)
+            bg_loop = (bg*loops)[:len(main)]
+            main = bg_loop.overlay(main)
+
+    # 7) Intro + melody + outro
+    with span("enhanced.outro"):
+        master = AudioSegment.silent(0)
+        for seg in intro + [main] + outro:
+            master = master + seg
+
+    save_state(sum(map(len, intro)) + len(main), faded, master if IR_SIGNAL is not None else None)
+
+    # 8) Reverb: only the melody is convolved, intro/outro come prepared
+    with span("enhanced.reverb"):
+        if IR_SIGNAL is not None:
+            sections = ([_prepared_clip(f, master.frame_rate, master.channels) for f in intro_files] + [main] +
+                        [_prepared_clip(f, master.frame_rate, master.channels) for f in outro_clips])
+            mixed = mix_with_reverb(sections, master.frame_rate, master.channels)
+            master = _from_float(mixed, master.frame_rate, master.sample_width)
+
+    # 9) Trim to max_duration (a safety net; the plan already fits it)
     if max_duration is not None:
         max_ms = int(max_duration * 1000)
         master = master[:max_ms]
 
-    # 9) Export
-    master.export(output_file, format="wav")
-    print(f"✅ Enhanced audio exported to: {output_file}")
\ No newline at end of file
+    # 10) Export
+    with span("enhanced.export"):
+        master.export(output_file, format="wav")
+    logger.info("✅ Enhanced audio exported to: %s", output_file)
+
+def _render_chunked(build, swars, intro_files, outro_files, bg, output_file, max_duration, melody_ms=None):
+    # Output format follows pydub's rule of upgrading to the richest input
+    segs = [_decode(f) for f in intro_files + outro_files] + list(swars.values())
+    frame_rate = max((s.frame_rate for s in segs), default=44100)
+    channels = max((s.channels for s in segs), default=1)
+
+    out = ChunkedOutput(
+        output_file, frame_rate, channels, bg=bg,
+        max_ms=None if max_duration is None else int(max_duration * 1000)
+    )
+    try:
+        with span("enhanced.melody"):
+            for f in intro_files:
+                out.add_prepared(_prepared_clip(f, frame_rate, channels))
+            melody = MelodyBuffer(sink=lambda seg: out.add(seg, with_background=True), limit_ms=melody_ms)
+            build(melody)
+            melody.finish()
+            for f in outro_files:
+                out.add_prepared(_prepared_clip(f, frame_rate, channels))
+    finally:
+        out.close()
+    return melody.flushed_ms, melody.full
+
+# ======== EXTENSION ========
+def state_tail_path(state_file):
+    return os.path.splitext(state_file)[0] + ".tail.wav"
+
+def _save_state(state_file, dry, dry_start_ms, splice_ms, **state):
+    """
+    Write the engine state for a later extension. `dry` is the master
+    before reverb, starting `dry_start_ms` into the output; the part just
+    before the splice point is kept next to the state for the reverb.
+    """
+    tail_path = state_tail_path(state_file)
+    state.update(version=STATE_VERSION, splice_ms=splice_ms, dry_tail=None)
+    if dry is not None:
+        ir_ms = int(len(IR_SIGNAL) / 44.1)
+        end = splice_ms - dry_start_ms
+        dry[max(0, end - ir_ms - MAX_CROSSFADE_MS):max(0, end)].export(tail_path, format="wav")
+        state["dry_tail"] = os.path.basename(tail_path)
+    elif os.path.exists(tail_path):
+        os.remove(tail_path)
+    tmp = state_file + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_file)
+
+def load_state(state_file):
+    """
+    Engine state saved by a render, or None if it is missing or from an
+    older format.
+    """
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get("version") == STATE_VERSION else None
+
+def extend_enhanced_render(new_notes, output_file, max_duration, state_file, state=None):
+    """
+    Make a render longer by rendering only `new_notes` (the continuation of
+    its sequence) and splicing them on where the old melody began its final
+    fade. The new melody keeps the old scale, rhythm and note numbering,
+    crossfades in from the last old note by the usual interval rule, picks
+    the background loop up where it was, and ends on the outro chosen for the tune if it fits; with
+    reverb, the old dry tail is convolved with it so earlier notes ring on.
+
+    Returns:
+        False if there is no usable state (the caller should re-render).
+    """
+    state = state or load_state(state_file)
+    if state is None or not os.path.exists(output_file):
+        return False
+    rng = random.Random(state["seed"])
+    scale, pattern = state["scale"], state["pattern"]
+    max_ms = int(max_duration * 1000)
+
+    with span("enhanced.load_samples"):
+        swars = _load_swar_samples()
+        outro_files = [f for f in state["outro"] if os.path.exists(f)]
+        outro = [_decode(f) for f in outro_files]
+        # An outro dropped to make room in the shorter tune may fit now
+        _fit_intro_outro([AudioSegment.silent(state["bg_start_ms"])], outro, max_ms)
+        outro_files = outro_files[:len(outro)]
+        bg = None
+        if state["background"] and os.path.exists(state["background"]):
+            bg = _decode(state["background"]).apply_gain(BG_VOLUME_REDUCTION_DB)
+        old = AudioSegment.from_wav(output_file)[:state["splice_ms"]]
+
+    with span("enhanced.plan"):
+        plan = _plan_notes(new_notes, swars, rng, start_index=state["last_index"] + 1)
+        if not plan:
+            return False
+        first = plan[0]
+        clip_ms = int(min(_note_ms(first), len(swars[first['swar']])) / TRANSPOSE_FACTOR)
+        cf = _crossfade_ms(state["last_swar"], first['swar'], scale, len(old), clip_ms)
+        melody_ms = max(0, max_ms - len(old) + cf - sum(map(len, outro)))
+        while _planned_ms(plan, swars, scale) < melody_ms:
+            plan += _plan_notes(new_notes, swars, rng, start_index=plan[-1]['index'] + 1)
+        plan = _fit_plan(plan, swars, scale, melody_ms)
+
+    with span("enhanced.melody"):
+        melody = MelodyBuffer(limit_ms=melody_ms)
+        _build_melody(plan, swars, pattern, scale, melody)
+        faded = melody.full
+        new = melody.finish()
+
+    start_ms = len(old) - cf
+    with span("enhanced.background_mix"):
+        if bg and len(new) > 0:
+            # Continue the loop from where the old melody had got to
+            offset = (start_ms - state["bg_start_ms"]) % len(bg)
+            bg_loop = bg[offset:] + bg * math.ceil(len(new) / len(bg))
+            new = bg_loop[:len(new)].overlay(new)
+
+    dry, dry_start = new, start_ms
+    with span("enhanced.reverb"):
+        tail_path = os.path.join(os.path.dirname(state_file), state["dry_tail"]) if state["dry_tail"] else None
+        if IR_SIGNAL is not None:
+            context = AudioSegment.from_wav(tail_path) if tail_path and os.path.exists(tail_path) else AudioSegment.silent(0)
+            # The stored tail ends at the splice point; the new audio starts cf earlier
+            context = context[:max(0, len(context) - cf)]
+            dry, dry_start = context + new, start_ms - len(context)
+            # The new melody is convolved once; the outro comes prepared
+            fr = max(s.frame_rate for s in [dry] + outro)
+            ch = max(s.channels for s in [dry] + outro)
+            sw = max(s.sample_width for s in [dry] + outro)
+            mixed = mix_with_reverb([dry] + [_prepared_clip(f, fr, ch) for f in outro_files], fr, ch)
+            skip = int(context.set_frame_rate(fr).frame_count())
+            end = skip + int(new.set_frame_rate(fr).frame_count())
+            new, outro = _from_float(mixed[skip:end], fr, sw), [_from_float(mixed[end:], fr, sw)]
+
+    with span("enhanced.outro"):
+        master = old.append(new, crossfade=min(cf, len(old), len(new))) if len(old) else new
+        for seg in outro:
+            master = master + seg
+        master = master[:max_ms]
+
+    with span("enhanced.export"):
+        tmp = output_file + ".tmp"
+        master.export(tmp, format="wav")
+        os.replace(tmp, output_file)
+
+    _save_state(
+        state_file, dry if IR_SIGNAL is not None else None, dry_start,
+        splice_ms=start_ms + len(new) - (FINAL_FADE_MS if faded else 0),
+        last_index=plan[-1]['index'], last_swar=plan[-1]['swar'],
+        scale=scale, pattern=pattern,
+        background=state["background"], bg_start_ms=state["bg_start_ms"],
+        outro=state["outro"], seed=rng.getrandbits(32)
+    )
+    logger.info("✅ Extended %s to %.1fs", output_file, len(master) / 1000)
+    return True
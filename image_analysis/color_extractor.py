@@ -3,21 +3,21 @@
 import cv2
 import numpy as np
 from sklearn.cluster import KMeans
+from image_analysis.image_loader import load_image, COLOR_MIN_SIDE
 
 def extract_dominant_colors(image_path, num_colors=7):
     """
     Extract dominant RGB colors from an image using KMeans clustering.
     
     Args:
-        image_path (str): Path to the image.
+        image_path (str | bytes | np.ndarray): Path to the image, its encoded
+            bytes, or a decoded BGR array.
         num_colors (int): Number of dominant colors to extract.
 
     Returns:
         List of RGB tuples.
     """
-    image = cv2.imread(image_path)
-    if image is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
+    image = load_image(image_path, min_side=COLOR_MIN_SIDE)
     
     # Convert from BGR (OpenCV default) to RGB
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
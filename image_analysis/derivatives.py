@@ -0,0 +1,296 @@
+# image_analysis/derivatives.py
+
+import collections
+import hashlib
+import logging
+import os
+import re
+import threading
+
+import cv2
+
+from image_analysis.image_loader import decode_image, FEATURE_MIN_SIDE
+
+logger = logging.getLogger(__name__)
+
+# Derivative name → longest side in pixels. Thumbnails are small enough to
+# come from the same reduced decode the analysis uses.
+SIZES = {
+    "thumb": int(os.environ.get("IMAGE_THUMB_SIDE", 320)),
+    "display": int(os.environ.get("IMAGE_DISPLAY_SIDE", 1280)),
+}
+FORMATS = {
+    "webp": (".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, 80]),
+    "jpeg": (".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+}
+DEFAULT_FORMAT = "webp"
+# Decodes are made at one of these shorter-side scales (None = full size)
+# and shared, so a thumbnail and the analysis stage reuse one decode
+DECODE_LEVELS = (FEATURE_MIN_SIDE, None)
+DECODED_CACHE_SIZE = int(os.environ.get("DECODED_CACHE_SIZE", 16))
+# Content-addressed files never change, so clients may keep them for a year
+CACHE_MAX_AGE = 365 * 24 * 3600
+
+_NAME_RE = re.compile(r"^(?P<size>[a-z]+)\.(?P<ext>webp|jpg)$")
+# Next to a source's derivatives: the source's path, or for uploads (which
+# have no file of their own) the uploaded bytes, so any process sharing the
+# cache directory can make the missing derivatives later
+SOURCE_NAME = "source"
+ORIGINAL_NAME = "original"
+_HASH_RE = re.compile(r"^[0-9a-f]{16}$")
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def decode_level(min_side):
+    """
+    Smallest shared decode scale that satisfies `min_side`.
+    """
+    if not min_side:
+        return None
+    for level in DECODE_LEVELS:
+        if level is None or level >= min_side:
+            return level
+    return None
+
+
+def fit_within(image, max_side):
+    """
+    Downscale (never upscale) so the longer side is at most `max_side`.
+    """
+    h, w = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+class ImageDerivatives:
+    """
+    Resized WebP/JPEG versions of source images, made on first request and
+    kept on disk as <cache_dir>/<source hash>/<size>.<ext>.
+
+    Sources are identified by a hash of their bytes (remembered per path
+    and mtime, so a file is only hashed again when it changes), which makes
+    every derivative URL immutable. The hash → source mapping is also kept
+    on disk, so derivatives can be made by any process (or after a restart). Decoded arrays are kept in a small LRU
+    keyed by source hash and decode scale; decoded() hands the same arrays
+    to the analysis stage, so each source is decoded once per scale. When
+    the files exceed `max_bytes`, the least recently written go first.
+    """
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024, decoded_cache_size=DECODED_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.decoded_cache_size = decoded_cache_size
+        self._lock = threading.Lock()
+        self._hashes = {}                           # path → (mtime_ns, size, hash)
+        self._sources = {}                          # hash → path, to remake evicted files
+        self._decoded = collections.OrderedDict()   # (hash, level) → array
+        self._key_locks = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._files = self._scan()                  # relative path → (mtime, bytes)
+
+    def _scan(self):
+        files = {}
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir() and _HASH_RE.match(entry.name):
+                for f in os.scandir(entry.path):
+                    if _NAME_RE.match(f.name) or f.name == ORIGINAL_NAME:
+                        st = f.stat()
+                        files[os.path.join(entry.name, f.name)] = (st.st_mtime, st.st_size)
+        return files
+
+    # ---------------- sources ----------------
+    def source_hash(self, path, data=None):
+        """
+        Content hash of a source file, recomputed only when it changes.
+        """
+        st = os.stat(path)
+        with self._lock:
+            known = self._hashes.get(path)
+        if known and known[:2] == (st.st_mtime_ns, st.st_size):
+            return known[2]
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        digest = content_hash(data)
+        with self._lock:
+            self._hashes[path] = (st.st_mtime_ns, st.st_size, digest)
+            known = self._sources.get(digest) == path
+            self._sources[digest] = path
+        if not known and os.path.basename(path) != ORIGINAL_NAME:
+            self._write_file(os.path.join(digest, SOURCE_NAME), os.path.abspath(path).encode("utf-8"))
+        return digest
+
+    def source_path(self, digest):
+        """
+        A file with the content of `digest`, or None if none is known.
+        """
+        with self._lock:
+            candidates = [self._sources.get(digest)]
+        try:
+            with open(os.path.join(self.cache_dir, digest, SOURCE_NAME), encoding="utf-8") as f:
+                candidates.append(f.read())
+        except OSError:
+            pass
+        candidates.append(os.path.join(self.cache_dir, digest, ORIGINAL_NAME))
+        for path in candidates:
+            try:
+                if path and self.source_hash(path) == digest:
+                    return path
+            except OSError:
+                continue
+        return None
+
+    def decoded(self, path, min_side=None):
+        """
+        BGR array of a source image with its shorter side at least
+        `min_side` (full size for None), from the shared decode cache.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        return self._decoded_array(self.source_hash(path, data), data, min_side)
+
+    def _decoded_array(self, digest, data, min_side):
+        level = decode_level(min_side)
+        key = (digest, level)
+        with self._lock:
+            if key in self._decoded:
+                self._decoded.move_to_end(key)
+                return self._decoded[key]
+        image = decode_image(data, min_side=level)
+        self.remember(digest, image, level)
+        return image
+
+    def remember(self, digest, image, level):
+        """
+        Keep an array decoded elsewhere (e.g. an upload) for later derivatives.
+        """
+        with self._lock:
+            self._decoded[(digest, level)] = image
+            self._decoded.move_to_end((digest, level))
+            while len(self._decoded) > self.decoded_cache_size:
+                self._decoded.popitem(last=False)
+
+    # ---------------- derivatives ----------------
+    def relative_path(self, digest, size, fmt):
+        return os.path.join(digest, size + FORMATS[fmt][0])
+
+    def path(self, digest, size, fmt):
+        return os.path.join(self.cache_dir, self.relative_path(digest, size, fmt))
+
+    def url(self, digest, size="display", fmt=DEFAULT_FORMAT):
+        return f"/images/{digest}/{size}{FORMATS[fmt][0]}"
+
+    def get(self, source_path, size="display", fmt=DEFAULT_FORMAT):
+        """
+        Derivative of a source file, made now if it isn't cached.
+
+        Returns:
+            (source hash, derivative path)
+        """
+        digest = self.source_hash(source_path)
+        path = self.path(digest, size, fmt)
+        if not os.path.exists(path):
+            with self._key_lock(path):
+                if not os.path.exists(path):
+                    with open(source_path, "rb") as f:
+                        data = f.read()
+                    image = self._decoded_array(digest, data, SIZES[size])
+                    self._write(digest, image, size, fmt)
+        return digest, path
+
+    def store(self, digest, image, sizes=tuple(SIZES), formats=tuple(FORMATS), original=None):
+        """
+        Write derivatives straight from an array already decoded (at any
+        scale; they are never upscaled), e.g. an upload being analysed.
+        With `original`, the source's bytes are kept in the cache so the
+        other derivatives can be made from them when first requested.
+        """
+        if original is not None:
+            rel = os.path.join(digest, ORIGINAL_NAME)
+            if not os.path.exists(os.path.join(self.cache_dir, rel)):
+                self._write_file(rel, original, budgeted=True)
+        for size in sizes:
+            for fmt in formats:
+                path = self.path(digest, size, fmt)
+                if not os.path.exists(path):
+                    with self._key_lock(path):
+                        if not os.path.exists(path):
+                            self._write(digest, image, size, fmt)
+
+    def _key_lock(self, path):
+        with self._lock:
+            return self._key_locks.setdefault(path, threading.Lock())
+
+    def _write(self, digest, image, size, fmt):
+        ext, _, params = FORMATS[fmt]
+        ok, buf = cv2.imencode(ext, fit_within(image, SIZES[size]), params)
+        if not ok:
+            raise ValueError(f"Could not encode {fmt}")
+        rel = self.relative_path(digest, size, fmt)
+        self._write_file(rel, buf.tobytes(), budgeted=True)
+        with self._lock:
+            self._key_locks.pop(os.path.join(self.cache_dir, rel), None)
+
+    def _write_file(self, rel, data, budgeted=False):
+        path = os.path.join(self.cache_dir, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        if budgeted:
+            with self._lock:
+                self._files[rel] = (os.path.getmtime(path), len(data))
+                self._evict_locked()
+
+    def _evict_locked(self):
+        total = sum(n for _, n in self._files.values())
+        for rel, (_, n) in sorted(self._files.items(), key=lambda kv: kv[1][0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, rel))
+            except FileNotFoundError:
+                pass
+            del self._files[rel]
+            total -= n
+
+    # ---------------- serving ----------------
+    def response(self, digest, name):
+        """
+        Flask response for /images/<digest>/<size>.<ext>, with a year-long,
+        immutable cache lifetime.
+        """
+        from flask import abort, send_file
+        m = _NAME_RE.match(name)
+        fmt = {".webp": "webp", ".jpg": "jpeg"}.get("." + m.group("ext")) if m else None
+        if not _HASH_RE.match(digest) or fmt is None or m.group("size") not in SIZES:
+            abort(404)
+        path = self.path(digest, m.group("size"), fmt)
+        if not os.path.exists(path):
+            # Made on first request (or again after eviction) when the
+            # source is still around
+            source = self.source_path(digest)
+            if source is None:
+                abort(404)
+            self.get(source, m.group("size"), fmt)
+        response = send_file(os.path.abspath(path), mimetype=FORMATS[fmt][1], max_age=CACHE_MAX_AGE, etag=digest + name)
+        response.headers["Cache-Control"] = f"public, max-age={CACHE_MAX_AGE}, immutable"
+        return response
+
+
+def pick_format(req):
+    """
+    WebP unless the client asks for JPEG (?format=jpeg) or says it can't
+    take WebP in its Accept header.
+    """
+    fmt = req.args.get("format")
+    if fmt in FORMATS:
+        return fmt
+    accept = req.headers.get("Accept", "")
+    return "webp" if not accept or "image/webp" in accept or "*/*" in accept else "jpeg"
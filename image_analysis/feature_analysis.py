@@ -2,12 +2,14 @@
 
 import cv2
 import numpy as np
+from image_analysis.image_loader import load_image, FEATURE_MIN_SIDE
 
 def extract_image_features(image_path):
-    import cv2
-    import numpy as np
-
-    img = cv2.imread(image_path)
+    """
+    Brightness, contrast and edge density of an image (path, encoded bytes
+    or decoded BGR array).
+    """
+    img = load_image(image_path, min_side=FEATURE_MIN_SIDE)
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
     brightness = np.mean(gray)
@@ -44,9 +46,7 @@ def analyze_brightness(image_path):
     """
     Compute average brightness of the image (0–255).
     """
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    if image is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
+    image = load_image(image_path, min_side=FEATURE_MIN_SIDE, grayscale=True)
     return np.mean(image)
 
 def analyze_texture(image_path):
@@ -54,7 +54,7 @@ def analyze_texture(image_path):
     Estimate texture by computing the variance of the Laplacian.
     High variance → rough texture, low variance → smooth.
     """
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    image = load_image(image_path, min_side=FEATURE_MIN_SIDE, grayscale=True)
     laplacian = cv2.Laplacian(image, cv2.CV_64F)
     return laplacian.var()
 
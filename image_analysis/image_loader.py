@@ -0,0 +1,104 @@
+# image_analysis/image_loader.py
+
+import struct
+import cv2
+import numpy as np
+
+# Smallest side the analysis stages need. Colours are clustered on a
+# 200×200 thumbnail; brightness/contrast/edge statistics are stable at
+# ~512 px, so decoding a 12 MP photo at full size only wastes time.
+COLOR_MIN_SIDE = 200
+FEATURE_MIN_SIDE = 512
+
+_REDUCED_COLOR = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+_REDUCED_GRAY = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+# JPEG start-of-frame markers (C4, C8 and CC are other segment types)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def probe_size(data):
+    """
+    Read (width, height) from a JPEG or PNG header without decoding.
+
+    Returns:
+        (width, height), or None for other formats or truncated data.
+    """
+    data = bytes(data[:65536]) if len(data) > 65536 else bytes(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:                      # fill byte
+            i += 1
+            continue
+        if marker in _JPEG_SOF:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:   # no length field
+            i += 2
+            continue
+        i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+    return None
+
+def reduction_factor(size, min_side):
+    """
+    Largest IMREAD_REDUCED_* factor (8, 4 or 2) that keeps the shorter side
+    at least `min_side` pixels; 1 when the image must be decoded in full.
+    """
+    if size is None or not min_side:
+        return 1
+    short = min(size)
+    for factor in (8, 4, 2):
+        if short // factor >= min_side:
+            return factor
+    return 1
+
+def decode_image(data, min_side=None, grayscale=False):
+    """
+    Decode an encoded image (bytes, e.g. an upload) to a BGR or grayscale array.
+
+    With `min_side`, JPEGs are decoded at a reduced scale chosen from the
+    header size so the shorter side stays at least `min_side` pixels.
+
+    Raises:
+        ValueError: The data is not a decodable image.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    factor = reduction_factor(probe_size(data), min_side)
+    if factor > 1:
+        flag = (_REDUCED_GRAY if grayscale else _REDUCED_COLOR)[factor]
+    else:
+        flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    image = cv2.imdecode(buf, flag)
+    if image is None:
+        raise ValueError("Unsupported or corrupt image")
+    return image
+
+def load_image(image, min_side=None, grayscale=False):
+    """
+    Accept an image path, encoded bytes or an already-decoded BGR array and
+    return a BGR (or grayscale) array, decoding at reduced scale where
+    `min_side` allows it.
+    """
+    if isinstance(image, np.ndarray):
+        if grayscale and image.ndim == 3:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return decode_image(image, min_side, grayscale)
+    try:
+        with open(image, 'rb') as f:
+            data = f.read()
+    except OSError:
+        raise FileNotFoundError(f"Image not found: {image}")
+    try:
+        return decode_image(data, min_side, grayscale)
+    except ValueError:
+        raise FileNotFoundError(f"Image not found: {image}")
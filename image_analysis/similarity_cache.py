@@ -0,0 +1,237 @@
+# image_analysis/similarity_cache.py
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import numpy as np
+
+from image_analysis.swar_mapper import rgb_to_hsv
+
+logger = logging.getLogger(__name__)
+
+HUE_BINS = 6
+# Relative weight of each part of the signature in the distance
+PALETTE_WEIGHT = 1.0
+TONE_WEIGHT = 1.0
+EDGE_WEIGHT = 0.5
+# The index log is rewritten once it has this many records per live entry
+INDEX_COMPACT_FACTOR = 2
+
+def image_signature(colors, features):
+    """
+    Compact vector describing an image for near-duplicate matching.
+
+    Built from what the pipeline already computes: the dominant palette as
+    a saturation-weighted circular hue histogram (so cluster order and tiny
+    hue shifts don't matter) plus mean palette saturation/value, brightness,
+    contrast and edge density, each scaled to roughly [0, 1].
+    """
+    hist = np.zeros(HUE_BINS)
+    sats, vals = [], []
+    for rgb in colors:
+        h, s, v = rgb_to_hsv(*[int(c) for c in rgb])
+        sats.append(s / 255)
+        vals.append(v / 255)
+        # Split each hue between its two nearest bins (bins wrap around)
+        pos = h / 180 * HUE_BINS
+        lo = int(pos) % HUE_BINS
+        frac = pos - int(pos)
+        weight = s / 255
+        hist[lo] += weight * (1 - frac)
+        hist[(lo + 1) % HUE_BINS] += weight * frac
+    if hist.sum() > 0:
+        hist /= hist.sum()
+
+    tone = [
+        np.mean(sats) if sats else 0.0,
+        np.mean(vals) if vals else 0.0,
+        features["brightness"] / 255,
+        min(features["contrast"] / 128, 1.0),
+    ]
+    edges = [min(features["edge_density"] / 0.2, 1.0)]
+    return np.concatenate([
+        hist * PALETTE_WEIGHT,
+        np.asarray(tone) * TONE_WEIGHT,
+        np.asarray(edges) * EDGE_WEIGHT
+    ]).astype(np.float32)
+
+
+class SimilarityCache:
+    """
+    Nearest-neighbour cache of past results keyed by image signature.
+
+    Each entry keeps the raga and swar sequence of one generated tune (and
+    optionally copies of its rendered files). lookup() returns the closest
+    entry within `threshold` (Euclidean distance between signatures) for
+    the same duration and raga constraint, so re-crops, re-encodes and
+    burst shots reuse earlier work instead of exact-hash misses.
+
+    The index is a float32 matrix searched by brute force, which is exact
+    and well under a millisecond at the default `max_entries`. It survives
+    restarts as an append-only log of small records (signature and
+    metadata; each sequence is stored in its entry's directory), so an
+    update writes one line rather than the whole cache. The log is
+    rewritten once it holds INDEX_COMPACT_FACTOR times more records than entries.
+    """
+
+    def __init__(self, cache_dir, threshold=0.15, max_entries=5000):
+        self.cache_dir = cache_dir
+        self.threshold = float(threshold)
+        self.max_entries = int(max_entries)
+        self.index_path = os.path.join(cache_dir, "index.jsonl")
+        self._lock = threading.Lock()
+        self._entries = []                    # entry dicts, aligned with _vectors rows
+        self._records = 0                     # lines in the index log
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    # ---------------- persistence ----------------
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        entries = {}
+        try:
+            with open(self.index_path) as f:
+                for line in f:
+                    self._records += 1
+                    try:
+                        r = json.loads(line)
+                    except ValueError:
+                        continue              # a line cut short by a crash
+                    if r["op"] == "add":
+                        entries[r["entry"]["id"]] = r["entry"]
+                    elif r["op"] == "use" and r["id"] in entries:
+                        entries[r["id"]].update(last_used=r["last_used"], hits=r["hits"])
+                    elif r["op"] == "del":
+                        entries.pop(r["id"], None)
+        except (OSError, KeyError, TypeError) as e:
+            logger.warning("⚠️ Ignoring unreadable similarity index: %s", e)
+            entries = {}
+        self._set_entries(list(entries.values()))
+
+    def _set_entries(self, entries):
+        self._entries = entries
+        self._vectors = np.array([e["signature"] for e in entries], dtype=np.float32)
+        if not entries:
+            self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def _sequence_path(self, entry_id):
+        return os.path.join(self.cache_dir, entry_id, "sequence.json")
+
+    def _write_sequence(self, entry_id, sequence):
+        path = self._sequence_path(entry_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(sequence, f)
+
+    def _append_locked(self, record):
+        with open(self.index_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self._records += 1
+        if self._records > INDEX_COMPACT_FACTOR * len(self._entries) + 100:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            for e in self._entries:
+                f.write(json.dumps({"op": "add", "entry": e}) + "\n")
+        os.replace(tmp, self.index_path)
+        self._records = len(self._entries)
+
+    # ---------------- queries ----------------
+    def lookup(self, signature, duration, raga=None):
+        """
+        Closest cached entry within the threshold, or None.
+
+        Returns:
+            (entry, distance) or None.
+        """
+        with self._lock:
+            if not self._entries:
+                return None
+            d = np.linalg.norm(self._vectors - signature, axis=1)
+            ok = np.array([
+                e["duration"] == duration and (raga is None or e["raga"] == raga)
+                for e in self._entries
+            ])
+            d[~ok] = np.inf
+            best = int(np.argmin(d))
+            if d[best] > self.threshold:
+                return None
+            entry = self._entries[best]
+            entry["hits"] += 1
+            entry["last_used"] = time.time()
+            self._append_locked({"op": "use", "id": entry["id"], "last_used": entry["last_used"], "hits": entry["hits"]})
+            entry = dict(entry)
+        try:
+            with open(self._sequence_path(entry["id"])) as f:
+                entry["sequence"] = json.load(f)
+        except (OSError, ValueError):
+            return None                       # evicted meanwhile
+        return entry, float(d[best])
+
+    def audio_path(self, entry, target):
+        """
+        Cached render of `target` for an entry, if one was stored.
+        """
+        name = entry.get("audio", {}).get(target)
+        if not name:
+            return None
+        path = os.path.join(self.cache_dir, entry["id"], name)
+        return path if os.path.exists(path) else None
+
+    # ---------------- updates ----------------
+    def add(self, signature, duration, raga, sequence, audio=None):
+        """
+        Store a new result. `audio` maps target → rendered file to copy in.
+        """
+        entry_id = uuid.uuid4().hex[:12]
+        entry_dir = os.path.join(self.cache_dir, entry_id)
+        self._write_sequence(entry_id, sequence)
+        stored = {}
+        if audio:
+            for target, path in audio.items():
+                if os.path.exists(path):
+                    name = target + os.path.splitext(path)[1]
+                    shutil.copyfile(path, os.path.join(entry_dir, name))
+                    stored[target] = name
+        now = time.time()
+        entry = {
+            "id": entry_id,
+            "signature": [float(x) for x in signature],
+            "duration": duration,
+            "raga": raga,
+            "audio": stored,
+            "created": now,
+            "last_used": now,
+            "hits": 0
+        }
+        with self._lock:
+            self._entries.append(entry)
+            vec = np.asarray(signature, dtype=np.float32)[np.newaxis]
+            self._vectors = vec if self._vectors.size == 0 else np.vstack([self._vectors, vec])
+            self._append_locked({"op": "add", "entry": entry})
+            self._evict_locked()
+        return dict(entry, sequence=sequence)
+
+    def _evict_locked(self):
+        while len(self._entries) > self.max_entries:
+            oldest = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+            entry = self._entries.pop(oldest)
+            self._vectors = np.delete(self._vectors, oldest, axis=0)
+            shutil.rmtree(os.path.join(self.cache_dir, entry["id"]), ignore_errors=True)
+            self._append_locked({"op": "del", "id": entry["id"]})
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "hits": sum(e["hits"] for e in self._entries)
+            }
@@ -1,41 +1,227 @@
+"""
+Batch renderer: turn every image in a directory into tunes, offline.
+
+    python main.py --input-dir random_images --output-dir rendered --durations 45
+    python main.py --input-dir photos --recursive --workers 8 --targets enhanced,midi --seed 1
+
+Images are rendered in a process pool with the same pipeline the servers
+use. Every finished image is appended to a JSON-lines manifest (image,
+raga, duration, seed, outputs, timings), so an interrupted run picks up
+where it stopped and images whose outputs are up to date are skipped.
+"""
+
+import argparse
+import json
 import os
 import random
+import signal
+import sys
 import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 IMAGE_DIR = 'random_images'
+OUTPUT_DIR = 'rendered'
+MANIFEST_NAME = 'manifest.jsonl'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def find_images(input_dir, recursive=False):
+    """
+    Image paths under `input_dir`, relative to it and sorted.
+    """
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for f in files:
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                found.append(os.path.relpath(os.path.join(root, f), input_dir))
+        if not recursive:
+            break
+    return sorted(found)
+
+def job_key(image, duration, targets):
+    return f"{image}|{duration}|{','.join(targets)}"
+
+def output_paths(output_dir, image, duration, targets):
+    from pipeline import output_extension
+    stem = os.path.splitext(image)[0]
+    return {t: os.path.join(output_dir, f"{stem}__{duration}s__{t}{output_extension(t)}") for t in targets}
+
+def load_manifest(path):
+    """
+    Latest manifest entry per job key. A line cut short by an interruption
+    is ignored.
+    """
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            try:
+                e = json.loads(line)
+            except ValueError:
+                continue
+            entries[e['key']] = e
+    return entries
+
+def is_up_to_date(entry, image_stat, seed):
+    if not entry or entry.get('status') != 'done':
+        return False
+    if entry.get('image_mtime_ns') != image_stat.st_mtime_ns or entry.get('image_size') != image_stat.st_size:
+        return False
+    if seed is not None and entry.get('seed') != seed:
+        return False
+    return all(os.path.exists(p) for p in entry['outputs'].values())
+
+def job_seed(base_seed, image, duration):
+    """
+    Per-image seed: derived from --seed so reruns are reproducible, or
+    random (and recorded in the manifest) otherwise.
+    """
+    if base_seed is None:
+        return random.getrandbits(32)
+    return zlib.crc32(f"{base_seed}:{image}:{duration}".encode())
+
+def plan(args, targets, manifest):
+    """
+    Jobs still to render, plus the number skipped as up to date.
+    """
+    jobs, skipped = [], 0
+    for image in find_images(args.input_dir, args.recursive):
+        path = os.path.join(args.input_dir, image)
+        st = os.stat(path)
+        for duration in args.durations:
+            key = job_key(image, duration, targets)
+            wanted_seed = None if args.seed is None else job_seed(args.seed, image, duration)
+            if not args.force and is_up_to_date(manifest.get(key), st, wanted_seed):
+                skipped += 1
+                continue
+            jobs.append({
+                'key': key,
+                'image': image,
+                'image_path': path,
+                'image_mtime_ns': st.st_mtime_ns,
+                'image_size': st.st_size,
+                'duration': duration,
+                'seed': wanted_seed if wanted_seed is not None else job_seed(None, image, duration),
+                'outputs': output_paths(args.output_dir, image, duration, targets)
+            })
+    return jobs, skipped
+
+# ---------------- worker process ----------------
+def _init_worker():
+    import pipeline
+    # One image per process already uses every core; no nested phrase pools
+    pipeline.PHRASE_WORKERS = 1
+    # Ctrl-C is handled by the parent, which cancels outstanding jobs
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def render_job(job):
+    """
+    Render one image in a worker and return its manifest entry.
+    """
+    import numpy as np
+    from pipeline import render_image_tune
+    from utils.metrics import STAGE_SECONDS
+
+    random.seed(job['seed'])
+    np.random.seed(job['seed'] % 2**32)
+    before = STAGE_SECONDS.snapshot()
+    start = time.perf_counter()
+    entry = {k: job[k] for k in ('key', 'image', 'image_mtime_ns', 'image_size', 'duration', 'seed', 'outputs')}
+
+    # Render to .part files so an interrupted job never looks finished
+    parts = {t: '.part'.join(os.path.splitext(p)) for t, p in job['outputs'].items()}
+    try:
+        for p in parts.values():
+            os.makedirs(os.path.dirname(p) or '.', exist_ok=True)
+        raga, _ = render_image_tune(job['image_path'], parts, job['duration'], seed=job['seed'])
+        for t, p in parts.items():
+            os.replace(p, job['outputs'][t])
+        entry.update(status='done', raga=raga)
+    except Exception as e:
+        for p in parts.values():
+            if os.path.exists(p):
+                os.remove(p)
+        entry.update(status='failed', error=f"{type(e).__name__}: {e}")
+
+    after = STAGE_SECONDS.snapshot()
+    entry['timings'] = {
+        stage[0]: round(total - before.get(stage, (0.0, 0))[0], 4)
+        for stage, (total, _) in after.items()
+        if total != before.get(stage, (0.0, 0))[0]
+    }
+    entry['timings']['total'] = round(time.perf_counter() - start, 4)
+    entry['finished'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    return entry
+
+# ---------------- driver ----------------
+def run(args):
+    from pipeline import parse_render_targets, estimate_render_seconds
+    from utils.cost_model import COST_MODEL
+
+    targets = parse_render_targets(args.targets)
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output_dir, MANIFEST_NAME)
+    jobs, skipped = plan(args, targets, load_manifest(manifest_path))
+    print(f"🖼️ {len(jobs)} to render, {skipped} up to date ({args.workers} workers)")
+    if not jobs:
+        return 0
+
+    # Shortest first (render times fitted from earlier runs' timings), so
+    # short tunes are done early and the ETA firms up quickly
+    COST_MODEL.observe_manifest(manifest_path)
+    for job in jobs:
+        job['cost'] = estimate_render_seconds(targets, job['duration'])
+    jobs.sort(key=lambda job: job['cost'])
+    remaining, finished_cost = sum(job['cost'] for job in jobs), 0.0
+
+    done = failed = 0
+    start = time.time()
+    pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker)
+    try:
+        with open(manifest_path, 'a') as manifest:
+            futures = {pool.submit(render_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                entry = future.result()
+                remaining -= futures[future]['cost']
+                finished_cost += futures[future]['cost']
+                # Appended as soon as each image finishes: this is the resume point
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+                os.fsync(manifest.fileno())
+
+                finished = done + failed + 1
+                # Predicted work left, at the pace the pool has shown so far
+                eta = remaining * (time.time() - start) / finished_cost
+                if entry['status'] == 'done':
+                    done += 1
+                    print(f"✅ [{finished}/{len(jobs)}] {entry['image']} ({entry['duration']}s) "
+                          f"{entry['timings']['total']:.1f}s, ETA {eta / 60:.1f} min")
+                else:
+                    failed += 1
+                    print(f"❌ [{finished}/{len(jobs)}] {entry['image']} ({entry['duration']}s): {entry['error']}")
+    except KeyboardInterrupt:
+        print("\n⏹️ Interrupted; finished images are in the manifest, rerun to resume.")
+        pool.shutdown(wait=False, cancel_futures=True)
+        return 130
+    pool.shutdown()
+    print(f"🏁 Rendered {done}, failed {failed}, skipped {skipped} in {(time.time() - start) / 60:.1f} min")
+    return 1 if failed else 0
 
-def get_random_images(num_images=10):
-    all_images = [f for f in os.listdir(IMAGE_DIR) if f.endswith(('.jpg', '.png', '.jpeg'))]
-    if not all_images:
-        return []
-    return random.sample(all_images, min(num_images, len(all_images)))
-
-def generate_tune_from_image(image_path, duration_seconds=45):
-    # Placeholder for actual tune generation logic
-    # In a real scenario, this would involve image analysis and music synthesis
-    print(f"Generating a {duration_seconds}-second tune for {image_path}...")
-    # Simulate tune generation
-    time.sleep(1) # Simulate some processing time
-    tune_name = f"tune_for_{os.path.basename(image_path).split('.')[0]}_{random.randint(1000, 9999)}.wav"
-    rag_name = f"rag_for_{os.path.basename(image_path).split('.')[0]}_{random.randint(100, 999)}"
-    print(f"Generated tune: {tune_name} with rag: {rag_name}")
-    return tune_name, rag_name
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render every image in a directory to tunes")
+    parser.add_argument('--input-dir', default=IMAGE_DIR)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--recursive', action='store_true', help="include subdirectories")
+    parser.add_argument('--durations', type=int, nargs='+', default=[45], help="tune lengths in seconds")
+    parser.add_argument('--targets', default='enhanced', help="comma-separated render targets")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=None, help="base seed for reproducible renders")
+    parser.add_argument('--manifest', default=None, help=f"default: <output-dir>/{MANIFEST_NAME}")
+    parser.add_argument('--force', action='store_true', help="re-render even if up to date")
+    args = parser.parse_args(argv)
+    return run(args)
 
 if __name__ == '__main__':
-    print("Starting image to tune process...")
-    while True:
-        selected_images = get_random_images(10)
-        if not selected_images:
-            print("No images found in the directory. Please add images to image_to_harmonium/random_images/. Retrying in 5 seconds...")
-            time.sleep(5)
-            continue
-        
-        print(f"Selected images for this loop: {selected_images}")
-        for img in selected_images:
-            full_image_path = os.path.join(IMAGE_DIR, img)
-            tune, rag = generate_tune_from_image(full_image_path, 45)
-            print(f"Processed {img}: Tune - {tune}, Rag - {rag}")
-            # In a real application, you would play the tune here
-            time.sleep(45) # Simulate playing the tune for 45 seconds
-        print("Loop complete. Starting next loop in 5 seconds...")
-        time.sleep(5)
\ No newline at end of file
+    sys.exit(main())
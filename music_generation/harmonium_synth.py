@@ -1,10 +1,16 @@
-def synthesize_sequence_to_audio(sequence, output_path="output.wav", total_duration=7.0):
-    from scipy.io.wavfile import write
-    from utils.audio_utils import normalize_audio, apply_fade
-    import numpy as np
+import logging
 
-    sample_rate = 44100
-    audio = np.zeros(0)
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+CHUNK_SECONDS = 5.0
+
+def _note_tones(sequence, sample_rate, dtype):
+    """
+    Yield one faded sine tone per note event.
+    """
+    from utils.audio_utils import apply_fade
+    import numpy as np
 
     for note in sequence:
         swar = note['swar']
@@ -12,13 +18,60 @@ def synthesize_sequence_to_audio(sequence, output_path="output.wav", total_durat
         duration = note['duration']
         volume = note['volume']
 
-        print(f"▶️ {swar} - {freq:.2f} Hz for {duration:.2f}s (vol: {volume:.2f})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("▶️ %s - %.2f Hz for %.2fs (vol: %.2f)", swar, freq, duration, volume)
+
+        n = int(sample_rate * duration)
+        t = np.arange(n, dtype=dtype)
+        t *= dtype(2 * np.pi * freq / sample_rate)
+        tone = np.sin(t, out=t)
+        tone *= dtype(volume)
+        yield apply_fade(tone, 0.05, 0.05, sample_rate)
+
+def synthesize_sequence_to_audio(sequence, output_path="output.wav", total_duration=7.0, chunked=False):
+    """
+    Render note events as sine tones into a 16-bit WAV.
+
+    With chunked=True the sequence is rendered twice in float32: once to find
+    the peak, then again straight into the file in CHUNK_SECONDS blocks, so
+    memory use does not grow with the duration.
+    """
+    from scipy.io.wavfile import write
+    from utils.audio_utils import normalize_audio
+    import numpy as np
+
+    if chunked:
+        _synthesize_chunked(sequence, output_path)
+    else:
+        tones = list(_note_tones(sequence, SAMPLE_RATE, np.float64))
+        audio = np.concatenate(tones) if tones else np.zeros(0)
+        write(output_path, SAMPLE_RATE, normalize_audio(audio))
+    logger.info("✅ Audio saved to %s (%.1f sec)", output_path, total_duration)
+
+def _synthesize_chunked(sequence, output_path):
+    from utils.audio_utils import WavChunkWriter
+    import numpy as np
 
-        t = np.linspace(0, duration, int(sample_rate * duration), endpoint=False)
-        tone = np.sin(2 * np.pi * freq * t) * volume
-        tone = apply_fade(tone, 0.05, 0.05, sample_rate)
-        audio = np.concatenate([audio, tone])
+    # Pass 1: peak level
+    peak = 0.0
+    for tone in _note_tones(sequence, SAMPLE_RATE, np.float32):
+        if len(tone):
+            peak = max(peak, float(np.max(tone)), -float(np.min(tone)))
+    gain = np.float32(1.0 / peak) if peak > 0 else np.float32(0.0)
 
-    audio = normalize_audio(audio)
-    write(output_path, sample_rate, audio.astype(np.int16))
-    print(f"\n✅ Audio saved to {output_path} ({total_duration:.1f} sec)")
+    # Pass 2: render again and stream to disk
+    block = np.empty(int(SAMPLE_RATE * CHUNK_SECONDS), dtype=np.float32)
+    filled = 0
+    with WavChunkWriter(output_path, SAMPLE_RATE) as writer:
+        for tone in _note_tones(sequence, SAMPLE_RATE, np.float32):
+            tone *= gain
+            pos = 0
+            while pos < len(tone):
+                take = min(len(block) - filled, len(tone) - pos)
+                block[filled:filled + take] = tone[pos:pos + take]
+                filled += take
+                pos += take
+                if filled == len(block):
+                    writer.write(block)
+                    filled = 0
+        writer.write(block[:filled])
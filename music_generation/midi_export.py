@@ -0,0 +1,90 @@
+# music_generation/midi_export.py
+
+import logging
+import math
+
+from music_generation.wavetable_synth import NOTES_PER_PHRASE, PHRASE_END_HOLD, PHRASE_ACCENT_DB
+
+logger = logging.getLogger(__name__)
+
+# One beat per second, so note durations map straight to beats
+TEMPO_BPM = 60
+CHANNEL = 0
+PROGRAM = 20                 # General MIDI "Reed Organ" (0-based)
+BEND_RANGE_SEMITONES = 2     # set explicitly via RPN 0 (the GM default)
+BASE_VELOCITY = 100          # velocity for volume 1.0 without an accent
+
+def frequency_to_midi(freq):
+    """
+    Split a frequency into the nearest MIDI note and the pitch-wheel value
+    (-8192..8191) that corrects it to the exact, possibly non-12-TET, pitch.
+    """
+    exact = 69 + 12 * math.log2(freq / 440.0)
+    note = int(round(exact))
+    bend = int(round((exact - note) * 8192 / BEND_RANGE_SEMITONES))
+    return note, max(-8192, min(8191, bend))
+
+def volume_to_velocity(volume, accent_db=0.0):
+    """
+    Map a 0–1 note volume plus an accent in dB to a MIDI velocity, using the
+    usual 40·log10 velocity-to-level curve so +N dB sounds like +N dB.
+    """
+    v = BASE_VELOCITY * volume * 10 ** (accent_db / 40)
+    return max(1, min(127, int(round(v))))
+
+def note_events(sequence, total_duration=None):
+    """
+    Yield (start_s, duration_s, note, bend, velocity) for every note event,
+    with the phrase-end hold and accent the audio renderers apply. Rests
+    (zero frequency or volume) are yielded with note=None.
+    """
+    t = 0.0
+    for i, note in enumerate(sequence, 1):
+        if total_duration is not None and t >= total_duration:
+            break
+        d = max(0.01, float(note['duration']))
+        accent = 0.0
+        if i % NOTES_PER_PHRASE == 0:
+            d *= PHRASE_END_HOLD
+            accent = PHRASE_ACCENT_DB
+        if total_duration is not None:
+            d = min(d, total_duration - t)
+
+        freq, volume = float(note['frequency']), float(note['volume'])
+        if freq > 0 and volume > 0:
+            pitch, bend = frequency_to_midi(freq)
+            yield t, d, pitch, bend, volume_to_velocity(volume, accent)
+        else:
+            yield t, d, None, 0, 0
+        t += d
+
+def sequence_to_midi(sequence, total_duration=None):
+    """
+    Build a MIDIFile from note events (the output of arrange_swar_sequence or
+    enhance_swar_sequence).
+    """
+    from midiutil import MIDIFile
+
+    midi = MIDIFile(1, deinterleave=False)
+    midi.addTempo(0, 0, TEMPO_BPM)
+    midi.addProgramChange(0, CHANNEL, 0, PROGRAM)
+    midi.makeRPNCall(0, CHANNEL, 0, 0, 0, BEND_RANGE_SEMITONES, 0)
+
+    bend = 0
+    for t, d, pitch, new_bend, velocity in note_events(sequence, total_duration):
+        if pitch is None:
+            continue
+        if new_bend != bend:
+            midi.addPitchWheelEvent(0, CHANNEL, t, new_bend)
+            bend = new_bend
+        midi.addNote(0, CHANNEL, pitch, t, d, velocity)
+    return midi
+
+def write_midi(sequence, output_path="tune.mid", total_duration=None):
+    """
+    Write note events as a Standard MIDI File.
+    """
+    midi = sequence_to_midi(sequence, total_duration)
+    with open(output_path, 'wb') as f:
+        midi.writeFile(f)
+    logger.info("✅ MIDI saved to %s", output_path)
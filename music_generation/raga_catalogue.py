@@ -0,0 +1,213 @@
+# music_generation/raga_catalogue.py
+
+import json
+import os
+import types
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Data files (JSON, or YAML with PyYAML installed) to load ragas from, in
+# order; later files override ragas of the same name. Directories load
+# every .json/.yaml/.yml file in them.
+RAGA_CATALOGUE_PATH = os.environ.get("RAGA_CATALOGUE_PATH", os.path.join(ROOT, "data", "ragas.json"))
+
+# The twelve swars of the octave, in pitch order; a raga's swar set is a
+# 12-bit mask with bit i set for SWARS[i]
+SWARS = ("Sa", "Re(k)", "Re", "Ga(k)", "Ga", "Ma", "Ma(tivra)", "Pa", "Dha(k)", "Dha", "Ni(k)", "Ni")
+SWAR_INDEX = {s: i for i, s in enumerate(SWARS)}
+SWAR_INDEX["Sa(upper)"] = 0
+FULL_MASK = (1 << len(SWARS)) - 1
+
+# Set bits of every 12-bit mask, for Hamming distances between swar sets
+_POPCOUNT = np.array([bin(m).count("1") for m in range(FULL_MASK + 1)], dtype=np.uint8)
+
+def swar_mask(swars):
+    """
+    12-bit mask of a collection of swar names.
+
+    Raises:
+        KeyError: An unknown swar name.
+    """
+    mask = 0
+    for s in swars:
+        mask |= 1 << SWAR_INDEX[s]
+    return mask
+
+
+def mask_swars(mask):
+    """
+    Swar names of a mask, in pitch order.
+    """
+    return [s for i, s in enumerate(SWARS) if mask >> i & 1]
+
+
+def _normalize(name):
+    return " ".join(name.lower().split())
+
+
+class Raga:
+    """
+    One catalogue entry: its swar set as a mask and its phrases as arrays
+    of swar indices (0-11), with the names kept for the legacy dict view.
+    """
+
+    __slots__ = ("name", "thaat", "mask", "aroha", "avaroha", "pakad", "swars", "_names")
+
+    def __init__(self, name, thaat, swars, aroha, avaroha, pakad=()):
+        self.name = name
+        self.thaat = thaat
+        self.swars = list(swars)
+        self._names = {"aroha": list(aroha), "avaroha": list(avaroha), "pakad": list(pakad)}
+        self.mask = swar_mask(self.swars)
+        for phrase, names in self._names.items():
+            setattr(self, phrase, np.array([SWAR_INDEX[s] for s in names], dtype=np.int8))
+
+    @classmethod
+    def from_dict(cls, name, entry):
+        """
+        Raises:
+            ValueError: A missing field or unknown swar name.
+        """
+        try:
+            swars = entry.get("swars") or mask_swars(swar_mask(entry["aroha"] + entry["avaroha"]))
+            return cls(name, entry.get("thaat"), swars, entry["aroha"], entry["avaroha"], entry.get("pakad", ()))
+        except KeyError as e:
+            raise ValueError(f"Raga '{name}': missing field or unknown swar {e}") from None
+
+    def as_dict(self):
+        """
+        The raga in the original RAGA_LIBRARY layout.
+        """
+        return {"thaat": self.thaat, "swars": list(self.swars), **{k: list(v) for k, v in self._names.items()}}
+
+    def __repr__(self):
+        return f"Raga({self.name!r}, thaat={self.thaat!r}, swars={'|'.join(mask_swars(self.mask))})"
+
+
+class RagaCatalogue:
+    """
+    Ragas indexed by name, thaat and swar mask.
+
+    The masks of all ragas sit in one uint16 array, so set queries against a
+    swar set ("ragas the image's swars cover", "ragas using all of these
+    swars", "nearest swar sets") are a few vectorised bitwise operations
+    over the whole catalogue, however large.
+    """
+
+    def __init__(self, ragas=()):
+        self._ragas = {}
+        for raga in ragas:
+            self._ragas[raga.name] = raga
+        self._build()
+
+    def _build(self):
+        self.names = list(self._ragas)
+        self.masks = np.array([r.mask for r in self._ragas.values()], dtype=np.uint16)
+        self._by_key = {_normalize(n): n for n in self.names}
+        self._by_thaat = {}
+        self._by_mask = {}
+        for i, raga in enumerate(self._ragas.values()):
+            self._by_thaat.setdefault(raga.thaat, []).append(i)
+            self._by_mask.setdefault(raga.mask, []).append(i)
+        self.library = types.MappingProxyType({n: r.as_dict() for n, r in self._ragas.items()})
+
+    def __len__(self):
+        return len(self._ragas)
+
+    def __iter__(self):
+        return iter(self._ragas.values())
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def get(self, name):
+        """
+        A raga by name, ignoring case and extra spaces; None if unknown.
+        """
+        key = self._by_key.get(_normalize(name)) if isinstance(name, str) else None
+        return self._ragas.get(key) if key else None
+
+    def _pick(self, idx):
+        return [self._ragas[self.names[i]] for i in idx]
+
+    def thaats(self):
+        return sorted(t for t in self._by_thaat if t)
+
+    def by_thaat(self, thaat):
+        return self._pick(self._by_thaat.get(thaat, ()))
+
+    def with_mask(self, mask):
+        """
+        Ragas with exactly this swar set.
+        """
+        return self._pick(self._by_mask.get(mask, ()))
+
+    def subsets_of(self, mask):
+        """
+        Ragas whose swars are all in `mask`.
+        """
+        return self._pick(np.flatnonzero((self.masks & ~np.uint16(mask) & FULL_MASK) == 0))
+
+    def supersets_of(self, mask):
+        """
+        Ragas that use every swar in `mask`.
+        """
+        return self._pick(np.flatnonzero((self.masks & np.uint16(mask)) == mask))
+
+    def nearest(self, mask, k=3):
+        """
+        The `k` ragas whose swar sets differ from `mask` in the fewest swars,
+        as (raga, differing swars), closest first.
+        """
+        distance = _POPCOUNT[self.masks ^ np.uint16(mask)]
+        k = min(k, len(distance))
+        if k == 0:
+            return []
+        idx = np.argsort(distance, kind="stable")[:k]
+        return [(self._ragas[self.names[i]], int(distance[i])) for i in idx]
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(f"PyYAML is needed to read {path}") from None
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    # {"ragas": {name: entry}}, a bare {name: entry} or a list of entries with "name"
+    ragas = data.get("ragas", data) if isinstance(data, dict) else data
+    if isinstance(ragas, dict):
+        ragas = [{"name": n, **entry} for n, entry in ragas.items()]
+    try:
+        return [Raga.from_dict(entry["name"], entry) for entry in ragas]
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"{path}: {e}") from None
+
+
+def _files(path):
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith((".json", ".yaml", ".yml"))]
+    return [path]
+
+
+def load_catalogue(paths=None):
+    """
+    Load a catalogue from data files (RAGA_CATALOGUE_PATH by default, a
+    list of paths separated by os.pathsep).
+    """
+    paths = RAGA_CATALOGUE_PATH if paths is None else paths
+    if isinstance(paths, str):
+        paths = [p for p in paths.split(os.pathsep) if p]
+    ragas = []
+    for path in paths:
+        for f in _files(path):
+            ragas += _read(f)
+    return RagaCatalogue(ragas)
+
+
+CATALOGUE = load_catalogue()
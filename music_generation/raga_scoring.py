@@ -0,0 +1,168 @@
+# music_generation/raga_scoring.py
+
+import os
+import numpy as np
+from music_generation.raga_catalogue import CATALOGUE, SWARS
+
+# Image vector layout: image_analysis.similarity_cache.image_signature()
+# (hue histogram bins centred on red, yellow, green, cyan, blue, magenta,
+# then palette saturation/value, brightness, contrast, edge density)
+IMAGE_FEATURES = (
+    "red", "yellow", "green", "cyan", "blue", "magenta",
+    "saturation", "value", "brightness", "contrast", "edges"
+)
+# Subtracted from the tone features so that "darker/flatter than usual"
+# counts against a raga dimension instead of just counting less for it
+FEATURE_CENTER = {"saturation": 0.4, "value": 0.55, "brightness": 0.45, "contrast": 0.45, "edges": 0.25}
+
+THAATS = ("Kalyan", "Bilawal", "Khamaj", "Kafi", "Asavari", "Bhairavi", "Bhairav", "Marwa", "Purvi", "Todi")
+RAGA_DIMS = SWARS + THAATS + ("pentatonic",)
+
+# How strongly each image feature pulls towards each raga dimension.
+# Warm palettes favour the bright Kalyan colours (shuddha Ga/Ni, tivra Ma)
+# and cool ones the komal swars of Malkauns-like ragas, as the tone
+# classes in raga_selector do; dark or low-contrast images lean to komal
+# Re/Dha (Bhairavi, Todi), busy high-contrast ones to the tense Marwa and
+# Purvi colours, and calm bright ones to the pentatonic ragas.
+AFFINITY = {
+    "red":        {"Ga": 1.0, "Ni": 0.8, "Ma(tivra)": 0.6, "Kalyan": 0.8},
+    "yellow":     {"Ga": 0.8, "Dha": 0.8, "Re": 0.5, "Bilawal": 0.5, "Kalyan": 0.4, "pentatonic": 0.6},
+    "green":      {"Ga(k)": 0.6, "Dha": 0.8, "Ni(k)": 0.6, "Kafi": 1.0},
+    "cyan":       {"Ga(k)": 0.8, "Ma": 0.6, "Ni(k)": 0.6, "Kafi": 0.4, "Asavari": 0.4},
+    "blue":       {"Ga(k)": 1.0, "Dha(k)": 0.8, "Ni(k)": 0.8, "Bhairavi": 0.4, "Asavari": 0.4},
+    "magenta":    {"Re(k)": 0.8, "Dha(k)": 0.6, "Ma(tivra)": 0.4, "Purvi": 0.6, "Bhairav": 0.6},
+    "saturation": {"Ga": 0.4, "Ni": 0.4, "Kalyan": 0.4, "Ga(k)": -0.3},
+    "value":      {"Ga": 0.4, "Dha": 0.4, "pentatonic": 0.4, "Dha(k)": -0.4, "Re(k)": -0.4},
+    "brightness": {"pentatonic": 0.8, "Re": 0.4, "Re(k)": -0.8, "Dha(k)": -0.6, "Bhairavi": -0.6, "Todi": -0.4},
+    "contrast":   {"Ma(tivra)": 0.6, "Re(k)": 0.4, "Marwa": 0.6, "Todi": 0.4, "pentatonic": -0.4},
+    "edges":      {"Marwa": 0.6, "Purvi": 0.6, "Re(k)": 0.4, "pentatonic": -0.8},
+}
+
+# Softmax temperature for choose_raga(): 0 always takes the best raga,
+# higher values let the runners-up through more often
+RAGA_TEMPERATURE = float(os.environ.get("RAGA_TEMPERATURE", 0.02))
+RAGA_TOP_K = 3
+
+
+def raga_vector(raga):
+    """
+    A raga as a vector over RAGA_DIMS: its swars (as a share of its swar
+    count, so seven-swar ragas don't outscore pentatonic ones by size),
+    a one-hot thaat and a pentatonic flag.
+    """
+    vec = np.zeros(len(RAGA_DIMS))
+    swars = [s for s in raga["swars"] if s in SWARS]
+    for s in swars:
+        vec[RAGA_DIMS.index(s)] = 1 / len(swars)
+    if raga.get("thaat") in THAATS:
+        vec[RAGA_DIMS.index(raga["thaat"])] = 1.0
+    vec[-1] = 1.0 if len(swars) <= 5 else 0.0
+    return vec
+
+
+def catalogue_vectors(catalogue):
+    """
+    raga_vector() of every raga in a catalogue at once, from the swar masks.
+    """
+    bits = (catalogue.masks[:, np.newaxis] >> np.arange(len(SWARS))) & 1
+    counts = bits.sum(axis=1)
+    vec = np.zeros((len(catalogue), len(RAGA_DIMS)))
+    vec[:, :len(SWARS)] = bits / np.maximum(counts, 1)[:, np.newaxis]
+    for i, raga in enumerate(catalogue):
+        if raga.thaat in THAATS:
+            vec[i, RAGA_DIMS.index(raga.thaat)] = 1.0
+    vec[:, -1] = counts <= 5
+    return vec
+
+
+def affinity_matrix():
+    """
+    AFFINITY as an (image features × raga dims) matrix.
+    """
+    w = np.zeros((len(IMAGE_FEATURES), len(RAGA_DIMS)))
+    for feature, row in AFFINITY.items():
+        for dim, weight in row.items():
+            w[IMAGE_FEATURES.index(feature), RAGA_DIMS.index(dim)] = weight
+    return w
+
+
+def build_scoring_matrix(library=None):
+    """
+    Fold the affinities and raga vectors into one (image features × ragas)
+    matrix, so scoring a batch of images is a single matrix multiply.
+
+    Returns:
+        (raga names, matrix)
+    """
+    if library is None:
+        names, ragas = list(CATALOGUE.names), catalogue_vectors(CATALOGUE)
+    else:
+        names = list(library)
+        ragas = np.array([raga_vector(library[n]) for n in names])
+    return names, (affinity_matrix() @ ragas.T).astype(np.float32)
+
+
+RAGA_NAMES, SCORING_MATRIX = build_scoring_matrix()
+_CENTER = np.array([FEATURE_CENTER.get(f, 0.0) for f in IMAGE_FEATURES], dtype=np.float32)
+
+
+def image_vector(colors, features):
+    """
+    An image as a vector over IMAGE_FEATURES.
+    """
+    from image_analysis.similarity_cache import image_signature
+    return image_signature(colors, features)
+
+
+def score_ragas(image_vectors):
+    """
+    Score every raga for a batch of image vectors.
+
+    Args:
+        image_vectors: (n_images × len(IMAGE_FEATURES)) array, or one vector.
+
+    Returns:
+        (n_images × n_ragas) scores, columns in RAGA_NAMES order.
+    """
+    x = np.atleast_2d(np.asarray(image_vectors, dtype=np.float32)) - _CENTER
+    return x @ SCORING_MATRIX
+
+
+def rank_ragas(image_vectors, top_k=RAGA_TOP_K):
+    """
+    Best `top_k` ragas per image, as lists of (raga, score), best first.
+    """
+    scores = score_ragas(image_vectors)
+    top_k = min(top_k, scores.shape[1])
+    # argpartition keeps this linear in the library size; only the top
+    # k columns are sorted
+    top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    ranked = []
+    for row, idx in zip(scores, top):
+        idx = idx[np.argsort(-row[idx])]
+        ranked.append([(RAGA_NAMES[i], float(row[i])) for i in idx])
+    return ranked
+
+
+def pick_raga(choices, temperature=None):
+    """
+    Sample one raga from ranked (raga, score) choices with a softmax over
+    the scores; temperature 0 returns the best one.
+    """
+    temperature = RAGA_TEMPERATURE if temperature is None else temperature
+    if temperature <= 0 or len(choices) == 1:
+        return choices[0][0]
+    scores = np.array([s for _, s in choices])
+    p = np.exp((scores - scores.max()) / temperature)
+    return choices[np.random.choice(len(choices), p=p / p.sum())][0]
+
+
+def choose_raga(colors, features, temperature=None):
+    """
+    Pick a raga for one image from its dominant colours and features.
+
+    Returns:
+        (raga, ranked choices)
+    """
+    choices = rank_ragas(image_vector(colors, features))[0]
+    return pick_raga(choices, temperature), choices
@@ -2,6 +2,7 @@
 
 import numpy as np
 from config import RAGA_LIBRARY, OCTAVE_MULTIPLIERS, SWAR_FREQUENCIES
+from music_generation.raga_catalogue import CATALOGUE, swar_mask
 
 def classify_warm_or_cool(hue_values):
     """
@@ -28,9 +29,26 @@ def select_raga_from_tone(tone_type):
         'Puriya Dhanashri', 'Bhopali', 'Kafi', 'Bhairav'
     ])
 
-def choose_raga_from_colors(rgb_colors):
-    from image_analysis.swar_mapper import rgb_to_hsv
+def choose_raga_from_colors(rgb_colors, features=None):
+    """
+    Pick a raga for an image. With its extracted `features`, every raga in
+    RAGA_LIBRARY is scored (see raga_scoring); with colours only, a raga
+    made entirely of the colours' swars is preferred, and otherwise the
+    warm/cool tone classes above decide.
+    """
+    if features is not None:
+        from music_generation.raga_scoring import choose_raga
+        raga, choices = choose_raga(rgb_colors, features)
+        print(f"🧠 Raga: {raga} (of {', '.join(f'{r} {s:.2f}' for r, s in choices)})")
+        return raga
+
+    from image_analysis.swar_mapper import rgb_to_hsv, map_hue_to_swar
     hues = [rgb_to_hsv(*rgb)[0] for rgb in rgb_colors]
+    covered = CATALOGUE.subsets_of(swar_mask(map_hue_to_swar(h) for h in hues))
+    if covered:
+        raga = np.random.choice([r.name for r in covered])
+        print(f"🧠 Swars → Raga: {raga} (of {len(covered)} within the palette)")
+        return raga
     tone = classify_warm_or_cool(hues)
     raga = select_raga_from_tone(tone)
     print(f"🧠 Tone: {tone.upper()} → Raga: {raga}")
@@ -47,9 +65,10 @@ def get_raga_swar_pool(raga_name, octaves=('Mandra','Madhya','Tara')):
       • pakad motifs repeated
       • octave-shifted swars for color
     """
-    raga = RAGA_LIBRARY.get(raga_name)
-    if not raga:
+    found = CATALOGUE.get(raga_name)
+    if not found:
         raise ValueError(f"Raga '{raga_name}' not found.")
+    raga = RAGA_LIBRARY[found.name]
 
     pool = []
 
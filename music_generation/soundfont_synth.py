@@ -0,0 +1,104 @@
+# music_generation/soundfont_synth.py
+
+import importlib.util
+import logging
+import os
+import numpy as np
+
+from music_generation.midi_export import note_events, CHANNEL, BEND_RANGE_SEMITONES
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+SOUNDFONT_PATH = os.environ.get("HARMONIUM_SOUNDFONT", os.path.join("soundfonts", "harmonium.sf2"))
+SOUNDFONT_BANK = 0
+SOUNDFONT_PRESET = int(os.environ.get("HARMONIUM_SOUNDFONT_PRESET", 0))
+SYNTH_GAIN = 0.5
+RELEASE_TAIL_S = 0.5         # let the last note ring out (unless trimmed)
+
+def soundfont_available(path=SOUNDFONT_PATH):
+    """
+    True when pyfluidsynth is installed and the SoundFont file exists.
+    """
+    return importlib.util.find_spec("fluidsynth") is not None and os.path.exists(path)
+
+def _open_synth(path, sample_rate):
+    try:
+        import fluidsynth
+    except ImportError as e:
+        raise RuntimeError("FluidSynth backend needs pyfluidsynth and libfluidsynth installed") from e
+    if not os.path.exists(path):
+        raise RuntimeError(f"SoundFont not found: {path}")
+
+    synth = fluidsynth.Synth(gain=SYNTH_GAIN, samplerate=sample_rate)
+    sfid = synth.sfload(path)
+    synth.program_select(CHANNEL, sfid, SOUNDFONT_BANK, SOUNDFONT_PRESET)
+    # RPN 0: pitch-bend range, matching the bend values from note_events()
+    synth.cc(CHANNEL, 101, 0)
+    synth.cc(CHANNEL, 100, 0)
+    synth.cc(CHANNEL, 6, BEND_RANGE_SEMITONES)
+    synth.cc(CHANNEL, 38, 0)
+    return synth
+
+def render_soundfont_blocks(sequence, total_duration=None, sample_rate=SAMPLE_RATE, soundfont=SOUNDFONT_PATH):
+    """
+    Play the note events through FluidSynth offline and yield float32
+    stereo blocks of shape (frames, 2), one per note event.
+
+    Durations come from the events, volume and phrase accents from the
+    note velocities, and non-12-TET pitches from the pitch wheel.
+    """
+    synth = _open_synth(soundfont, sample_rate)
+    scale = np.float32(1 / 32768)
+    limit = None if total_duration is None else int(round(total_duration * sample_rate))
+    written = 0
+
+    def pull(frames):
+        nonlocal written
+        if limit is not None:
+            frames = min(frames, limit - written)
+        if frames <= 0:
+            return None
+        block = synth.get_samples(frames).astype(np.float32).reshape(-1, 2)
+        block *= scale
+        written += frames
+        return block
+
+    try:
+        bend = 0
+        for t, d, pitch, new_bend, velocity in note_events(sequence, total_duration):
+            # Frames are counted from absolute times so rounding never drifts
+            frames = int(round((t + d) * sample_rate)) - written
+            if pitch is not None:
+                if new_bend != bend:
+                    synth.pitch_bend(CHANNEL, new_bend)
+                    bend = new_bend
+                synth.noteon(CHANNEL, pitch, velocity)
+            block = pull(frames)
+            if pitch is not None:
+                synth.noteoff(CHANNEL, pitch)
+            if block is not None:
+                yield block
+        tail = pull(int(RELEASE_TAIL_S * sample_rate))
+        if tail is not None:
+            yield tail
+    finally:
+        synth.delete()
+
+def render_soundfont(sequence, total_duration=None, sample_rate=SAMPLE_RATE, soundfont=SOUNDFONT_PATH):
+    """
+    Render the whole tune into one float32 (frames, 2) NumPy buffer.
+    """
+    blocks = list(render_soundfont_blocks(sequence, total_duration, sample_rate, soundfont))
+    return np.concatenate(blocks) if blocks else np.zeros((0, 2), dtype=np.float32)
+
+def synthesize_soundfont(sequence, output_path="soundfont_tune.wav", total_duration=None):
+    """
+    Render note events with the harmonium SoundFont into a 16-bit stereo WAV.
+    """
+    from utils.audio_utils import WavChunkWriter, soft_limit
+
+    with WavChunkWriter(output_path, SAMPLE_RATE, channels=2) as writer:
+        for block in render_soundfont_blocks(sequence, total_duration):
+            writer.write(soft_limit(block))
+    logger.info("✅ SoundFont audio saved to %s", output_path)
@@ -1,4 +1,5 @@
 
+import math
 import random
 from config import SWAR_FREQUENCIES, OCTAVE_MULTIPLIERS
 
@@ -154,8 +155,14 @@ TRANSITIONS = {
     'Ni': ['Dha', 'Sa', 'Re', 'Ga', 'Ma']
 }
 
-def generate_markov_sequence(length, swar_pool):
-    seq = [random.choice(swar_pool)]
+def generate_markov_sequence(length, swar_pool, history=None):
+    """
+    `length` swars from the transition table. With `history` (the swars
+    so far) the chain continues from its end and only the new swars are
+    returned.
+    """
+    history = list(history or [])
+    seq = history + ([] if history else [random.choice(swar_pool)])
 
     def is_valid(candidate):
         temp = seq + [candidate]
@@ -167,12 +174,12 @@ def generate_markov_sequence(length, swar_pool):
                     return False
         return True
 
-    while len(seq) < length:
+    while len(seq) < len(history) + length:
         curr = seq[-1]
         opts = TRANSITIONS.get(curr, swar_pool)
         valid = [n for n in opts if n in swar_pool and is_valid(n)]
         seq.append(random.choice(valid if valid else swar_pool))
-    return seq
+    return seq[len(history):]
 
 def insert_phrases(base_seq, swar_pool, every=8):
     out = []
@@ -205,12 +212,12 @@ def smooth_melody(seq, swar_pool):
     out.append(seq[-1])
     return out
 
-def enhance_swar_sequence(swar_source, total_duration=10.0, music_params=None):
-    tempo = music_params.get("tempo_multiplier",1.0) if music_params else 1.0
-    avg = 0.4/tempo
-    count = int(total_duration/avg)
+# Note lengths for enhance_swar_sequence; the final note is stretched or
+# shortened so the notes add up to the requested duration
+NOTE_DURATIONS = [0.5, 0.75, 1.0]
+MIN_LAST_NOTE = 0.25
 
-    # build pool & freq
+def _swar_pool(swar_source):
     if isinstance(swar_source[0][1], str):
         pool = [s for s,_ in swar_source]
         freq_map = {s: SWAR_FREQUENCIES.get(s,0.0)*OCTAVE_MULTIPLIERS.get(o,1.0)
@@ -218,17 +225,55 @@ def enhance_swar_sequence(swar_source, total_duration=10.0, music_params=None):
     else:
         pool = [s for s,_ in swar_source]
         freq_map = {s:f for s,f in swar_source}
+    return pool, freq_map
 
-    raw = generate_markov_sequence(count, pool)
-    phrased = insert_phrases(raw, pool, every=random.randint(6,9))
-    smooth = smooth_melody(phrased, pool)
+def _note_count(total_duration, music_params):
+    tempo = music_params.get("tempo_multiplier",1.0) if music_params else 1.0
+    avg = 0.4/tempo
+    # Enough notes to fill the duration even if every one is the shortest
+    return max(int(total_duration/avg), math.ceil(total_duration/min(NOTE_DURATIONS)) + 1)
 
+def _timed_notes(swars, freq_map, total_duration):
     sequence = []
-    for s in smooth[:count]:
+    elapsed = 0.0
+    for s in swars:
+        remaining = total_duration - elapsed
+        if remaining <= 1e-6:
+            break
+        dur = random.choice(NOTE_DURATIONS)
+        # Never leave a sliver too short to be a note: the last one takes it
+        if remaining - dur < MIN_LAST_NOTE:
+            dur = remaining
         sequence.append({
             'swar': s,
             'frequency': freq_map.get(s,0.0),
-            'duration': random.choice([0.5,0.75,1.0]),
+            'duration': round(dur, 3),
             'volume': 1.0
         })
+        elapsed += dur
     return sequence
+
+def enhance_swar_sequence(swar_source, total_duration=10.0, music_params=None):
+    count = _note_count(total_duration, music_params)
+    pool, freq_map = _swar_pool(swar_source)
+
+    raw = generate_markov_sequence(count, pool)
+    phrased = insert_phrases(raw, pool, every=random.randint(6,9))
+    smooth = smooth_melody(phrased, pool)
+    return _timed_notes(smooth[:count], freq_map, total_duration)
+
+def extend_swar_sequence(sequence, swar_source, extra_duration, music_params=None):
+    """
+    Continue an enhanced sequence by `extra_duration` seconds: the Markov
+    chain picks up from the sequence's last swars and the join is smoothed
+    like any other step. Returns only the new notes.
+    """
+    count = _note_count(extra_duration, music_params)
+    pool, freq_map = _swar_pool(swar_source)
+    history = [n['swar'] for n in sequence[-6:]]
+
+    raw = generate_markov_sequence(count, pool, history=history)
+    phrased = insert_phrases(raw, pool, every=random.randint(6,9))
+    # Smooth across the join, then drop the note that was already played
+    smooth = smooth_melody(history[-1:] + phrased, pool)[1:] if history else smooth_melody(phrased, pool)
+    return _timed_notes(smooth[:count], freq_map, extra_duration)
@@ -0,0 +1,137 @@
+# music_generation/wavetable_synth.py
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+TABLE_SIZE = 2048
+
+# Reed voice: harmonic amplitudes of one free reed (1st = fundamental).
+# A harmonium reed is bright with a soft formant around the 3rd–5th partial.
+REED_HARMONICS = [1.0, 0.72, 0.58, 0.50, 0.42, 0.30, 0.22, 0.17, 0.12, 0.09, 0.06, 0.04]
+SECOND_REED_CENTS = 4.0      # detuned second reed (the "musette" beating)
+SECOND_REED_LEVEL = 0.8
+
+# Bellows: note attack/release plus a slow breathing swell over the piece
+ATTACK_S = 0.04
+RELEASE_S = 0.08
+BELLOWS_RATE_HZ = 0.25
+BELLOWS_DEPTH = 0.08
+
+# Phrase shaping, mirroring the sample renderer in enhance_tune.py
+NOTES_PER_PHRASE = 7
+PHRASE_END_HOLD = 3.0
+PHRASE_ACCENT_DB = 4.0
+
+def _build_wavetable(harmonics=REED_HARMONICS, size=TABLE_SIZE):
+    """
+    One cycle of the additive reed waveform, normalized to ±1 and padded
+    with a wrap-around sample for linear interpolation.
+    """
+    x = np.arange(size) / size
+    wave = np.zeros(size)
+    for n, amp in enumerate(harmonics, 1):
+        # Alternate phases keep the crest factor (and so the headroom) low
+        wave += amp * np.sin(2 * np.pi * n * x + (n % 2) * np.pi / 2)
+    wave /= np.max(np.abs(wave))
+    return np.append(wave, wave[0]).astype(np.float32)
+
+WAVETABLE = _build_wavetable()
+
+def _lookup(phase):
+    """
+    Read the wavetable at `phase` (cycles, in [0, 1)) with linear interpolation.
+    """
+    pos = phase * TABLE_SIZE
+    idx = pos.astype(np.int32)
+    frac = (pos - idx).astype(np.float32)
+    lo = WAVETABLE[idx]
+    return lo + (WAVETABLE[idx + 1] - lo) * frac
+
+def _note_parameters(sequence):
+    """
+    Per-note duration (s), frequency and linear gain, with the phrase-end
+    hold and accent the sample renderer applies.
+    """
+    durations, freqs, gains = [], [], []
+    for i, note in enumerate(sequence, 1):
+        d = max(0.01, float(note['duration']))
+        g = float(note['volume'])
+        if i % NOTES_PER_PHRASE == 0:
+            d *= PHRASE_END_HOLD
+            g *= 10 ** (PHRASE_ACCENT_DB / 20)
+        durations.append(d)
+        freqs.append(float(note['frequency']))
+        gains.append(g)
+    return durations, freqs, gains
+
+def render_wavetable(sequence, sample_rate=SAMPLE_RATE):
+    """
+    Yield the tune as float32 blocks, one phrase per block.
+
+    Each phrase is rendered with array operations only: per-sample
+    frequency and gain come from np.repeat over the note events, phase is
+    a cumulative sum carried across phrases (so notes join legato, as on a
+    real harmonium), and both reeds are wavetable lookups.
+    """
+    durations, freqs, gains = _note_parameters(sequence)
+    counts = np.array([int(round(d * sample_rate)) for d in durations], dtype=np.int64)
+    attack = max(1, int(ATTACK_S * sample_rate))
+    release = max(1, int(RELEASE_S * sample_rate))
+    detune = 2 ** (SECOND_REED_CENTS / 1200)
+    headroom = np.float32(1.0 / ((1 + SECOND_REED_LEVEL) * (1 + BELLOWS_DEPTH)))
+
+    phase1 = phase2 = 0.0
+    t0 = 0
+    for start in range(0, len(counts), NOTES_PER_PHRASE):
+        c = counts[start:start + NOTES_PER_PHRASE]
+        total = int(c.sum())
+        if total == 0:
+            continue
+        f = np.repeat(np.asarray(freqs[start:start + NOTES_PER_PHRASE]), c)
+        g = np.repeat(np.asarray(gains[start:start + NOTES_PER_PHRASE], dtype=np.float32), c)
+
+        # Phase of both reeds, continuous across note and phrase boundaries
+        inc = f / sample_rate
+        p1 = np.cumsum(inc) + phase1
+        p2 = np.cumsum(inc * detune) + phase2
+        phase1, phase2 = p1[-1] % 1.0, p2[-1] % 1.0
+        p1 %= 1.0
+        p2 %= 1.0
+        out = _lookup(p1)
+        out += SECOND_REED_LEVEL * _lookup(p2)
+
+        # Bellows envelope: per-note attack/release from sample positions
+        note_start = np.repeat(np.cumsum(c) - c, c)
+        pos = np.arange(total) - note_start
+        left = np.repeat(c, c) - pos
+        env = np.minimum(np.minimum(pos / attack, left / release), 1.0).astype(np.float32)
+        t = (t0 + np.arange(total)) / sample_rate
+        env *= (1 + BELLOWS_DEPTH * np.sin(2 * np.pi * BELLOWS_RATE_HZ * t)).astype(np.float32)
+
+        out *= env
+        out *= g
+        out *= headroom
+        out[f == 0] = 0.0               # rests
+        t0 += total
+        yield out
+
+def synthesize_wavetable(sequence, output_path="wavetable_tune.wav", total_duration=None):
+    """
+    Render note events with the wavetable reed voice into a 16-bit WAV,
+    trimmed to `total_duration` seconds when given.
+    """
+    from utils.audio_utils import WavChunkWriter, soft_limit
+
+    remaining = None if total_duration is None else int(total_duration * SAMPLE_RATE)
+    with WavChunkWriter(output_path, SAMPLE_RATE) as writer:
+        for block in render_wavetable(sequence):
+            if remaining is not None:
+                block = block[:remaining]
+                remaining -= len(block)
+            writer.write(soft_limit(block))
+            if remaining == 0:
+                break
+    logger.info("✅ Wavetable audio saved to %s", output_path)
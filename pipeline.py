@@ -0,0 +1,346 @@
+# pipeline.py
+
+import json
+import os
+import threading
+import time
+
+from utils.metrics import RENDERS, RENDER_SECONDS, CACHE_HITS, CACHE_MISSES, duration_class, span
+from utils.cost_model import COST_MODEL
+
+# ----------------------------------------
+# Render targets
+# ----------------------------------------
+# Each target is one audio variant of the same swar sequence. Only the
+# targets a caller asks for are rendered; the rest can be produced later
+# from the saved sequence with render_lazily().
+
+# Tunes at least this long are rendered in float32 chunks straight to disk,
+# keeping peak memory flat instead of growing with the duration.
+CHUNKED_RENDER_MIN_SECONDS = float(os.environ.get('CHUNKED_RENDER_MIN_SECONDS', 120))
+# Tunes at least this long have their phrases rendered in a process pool
+# of PHRASE_WORKERS processes (only worth it with more than one core).
+PARALLEL_RENDER_MIN_SECONDS = float(os.environ.get('PARALLEL_RENDER_MIN_SECONDS', 120))
+PHRASE_WORKERS = int(os.environ.get('PHRASE_WORKERS', os.cpu_count() or 1))
+
+def _chunked(duration):
+    return duration is not None and duration >= CHUNKED_RENDER_MIN_SECONDS
+
+def _parallel(duration):
+    return PHRASE_WORKERS > 1 and duration is not None and duration >= PARALLEL_RENDER_MIN_SECONDS
+
+def _render_normal(sequence, output_path, duration, seed=None):
+    from music_generation.harmonium_synth import synthesize_sequence_to_audio
+    synthesize_sequence_to_audio(sequence, output_path, duration, chunked=_chunked(duration))
+
+def _render_enhanced(sequence, output_path, duration, seed=None, state_file=None):
+    from enhance_tune import generate_from_clean_swar_sequence
+    generate_from_clean_swar_sequence(sequence, output_file=output_path, max_duration=duration,
+                                      chunked=_chunked(duration), seed=seed,
+                                      parallel=_parallel(duration), workers=PHRASE_WORKERS,
+                                      state_file=state_file)
+
+def _render_wavetable(sequence, output_path, duration, seed=None):
+    from music_generation.wavetable_synth import synthesize_wavetable
+    synthesize_wavetable(sequence, output_path, duration)
+
+def _render_midi(sequence, output_path, duration, seed=None):
+    from music_generation.midi_export import write_midi
+    write_midi(sequence, output_path, duration)
+
+RENDERERS = {
+    'normal': _render_normal,        # sine synthesizer
+    'enhanced': _render_enhanced,    # dataset_2 harmonium samples
+    'wavetable': _render_wavetable,  # vectorized additive reed voice
+    'midi': _render_midi,            # note events only, for client-side synths
+}
+
+def _render_soundfont(sequence, output_path, duration, seed=None):
+    from music_generation.soundfont_synth import synthesize_soundfont
+    synthesize_soundfont(sequence, output_path, duration)
+
+# FluidSynth is optional: offered only when pyfluidsynth and the SoundFont exist
+from music_generation.soundfont_synth import soundfont_available
+if soundfont_available():
+    RENDERERS['soundfont'] = _render_soundfont
+
+DEFAULT_TARGETS = ('enhanced',)
+# Targets that produce audio, as opposed to MIDI note events
+AUDIO_TARGETS = tuple(t for t in RENDERERS if t != 'midi')
+
+def _extend_enhanced(new_notes, output_path, duration, state_file):
+    from enhance_tune import extend_enhanced_render
+    return extend_enhanced_render(new_notes, output_path, duration, state_file)
+
+# Targets that can be lengthened by rendering only the new notes, given the
+# engine state saved next to the render (see extend_tune()). The others are
+# cheap enough to re-render from the extended sequence.
+EXTENDERS = {
+    'enhanced': _extend_enhanced,
+}
+
+def state_path(output_path):
+    """
+    Where the engine state of a render is kept for later extensions.
+    """
+    return os.path.splitext(output_path)[0] + '.state.json'
+
+def output_extension(target):
+    """
+    File extension for a target's output.
+    """
+    return '.mid' if target == 'midi' else '.wav'
+
+_render_locks = {}
+_render_locks_guard = threading.Lock()
+
+def parse_render_targets(value, default=DEFAULT_TARGETS):
+    """
+    Parse a comma-separated target list such as "normal,enhanced".
+
+    Returns:
+        Tuple of target names, in the order given.
+    """
+    if not value:
+        return tuple(default)
+    targets = []
+    for name in str(value).split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in RENDERERS:
+            raise ValueError(f"Unknown render target '{name}'. Choose from: {', '.join(RENDERERS)}")
+        if name not in targets:
+            targets.append(name)
+    return tuple(targets) or tuple(default)
+
+def render_targets(sequence, outputs, duration, seed=None, keep_state=False):
+    """
+    Render the sequence once per requested target.
+
+    Args:
+        sequence (list): Note events from the swar arranger.
+        outputs (dict): Target name → output path.
+        duration (float): Requested tune length in seconds.
+        seed (int): Makes the renders reproducible.
+        keep_state (bool): Save the engine state of extendable targets
+            next to their output (see extend_tune()).
+
+    Each output is rendered to a .part file and moved into place under its
+    render lock, so a concurrent lazy request never serves it half-written.
+    """
+    for target, path in outputs.items():
+        root, ext = os.path.splitext(path)
+        tmp = root + '.part' + ext
+        with _lock_for(path):
+            _render_one(target, sequence, tmp, duration, seed,
+                        state_file=state_path(path) if keep_state else None)
+            os.replace(tmp, path)
+
+def _render_one(target, sequence, path, duration, seed=None, state_file=None):
+    start = time.perf_counter()
+    kwargs = {'state_file': state_file} if state_file and target in EXTENDERS else {}
+    with span(f"render.{target}"):
+        RENDERERS[target](sequence, path, duration, seed=seed, **kwargs)
+    elapsed = time.perf_counter() - start
+    RENDER_SECONDS.observe(elapsed, target=target, duration=duration_class(duration))
+    RENDERS.inc(target=target)
+    COST_MODEL.observe(target, duration, elapsed, reverb=_reverb(target))
+
+def _reverb(target):
+    """Whether renders of `target` run the convolution reverb"""
+    if target != 'enhanced':
+        return False
+    import enhance_tune
+    return enhance_tune.IR_SIGNAL is not None
+
+# Image analysis and sequencing before the renders, in seconds
+ANALYSIS_SECONDS = 0.3
+
+def estimate_render_seconds(targets, duration, analysis=True):
+    """
+    Predicted wall time to render `targets` at `duration` (see
+    utils.cost_model), plus the image analysis when `analysis` is set.
+    """
+    total = ANALYSIS_SECONDS if analysis else 0.0
+    for target in targets:
+        total += COST_MODEL.predict(target, duration, reverb=_reverb(target))
+    return total
+
+# ----------------------------------------
+# Image → tune
+# ----------------------------------------
+def render_image_tune(image_path, outputs, duration, raga=None, seed=None):
+    """
+    Run the whole pipeline for one image: raga, image features, enhanced
+    swar sequence, then the requested renders.
+
+    Args:
+        image_path (str): Source image (or its bytes or decoded array).
+        outputs (dict): Target name → output path.
+        duration (float): Tune length in seconds.
+        raga (str): Raga to use; by default the image's best-scoring ones
+            are sampled (see music_generation.raga_scoring).
+
+    Returns:
+        (raga, sequence)
+    """
+    from image_analysis.image_loader import load_image, FEATURE_MIN_SIDE
+    from image_analysis.color_extractor import extract_dominant_colors
+    from image_analysis.feature_analysis import extract_image_features, derive_music_params_from_features
+    from music_generation.raga_selector import choose_raga_from_colors, get_raga_swars
+    from music_generation.swar_arranger import enhance_swar_sequence
+
+    image = load_image(image_path, min_side=FEATURE_MIN_SIDE)
+    with span("extract_image_features"):
+        features = extract_image_features(image)
+        music_params = derive_music_params_from_features(features)
+    if not raga:
+        with span("extract_dominant_colors"):
+            colors = extract_dominant_colors(image, 7)
+        with span("choose_raga"):
+            raga = choose_raga_from_colors(colors, features)
+    with span("get_raga_swars"):
+        swar_source = get_raga_swars(raga)
+    with span("sequence"):
+        sequence = enhance_swar_sequence(
+            swar_source=swar_source,
+            total_duration=duration,
+            music_params=music_params
+        )
+    render_targets(sequence, outputs, duration, seed)
+    return raga, sequence
+
+# ----------------------------------------
+# Sequence persistence (for lazy renders)
+# ----------------------------------------
+def save_sequence(sequence, path, duration, **extra):
+    """
+    Store a sequence and its duration so other targets can be rendered later.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    payload = {'duration': duration, 'sequence': sequence}
+    payload.update(extra)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+def load_sequence(path):
+    with open(path) as f:
+        return json.load(f)
+
+def _lock_for(path):
+    with _render_locks_guard:
+        return _render_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+def sequence_lock(sequence_path):
+    """
+    Lock held while a saved sequence is replaced or extended together with
+    its renders (see extend_tune()).
+    """
+    return _lock_for(sequence_path)
+
+def invalidate(output_path):
+    """
+    Remove a stale render (with its engine state and the dry tail saved
+    beside it), waiting for any lazy render of it to finish first.
+    """
+    from enhance_tune import state_tail_path
+    with _lock_for(output_path):
+        state = state_path(output_path)
+        for path in (output_path, state, state_tail_path(state)):
+            if os.path.exists(path):
+                os.remove(path)
+
+def render_lazily(target, output_path, sequence_path, keep_state=False):
+    """
+    Render `target` from the saved sequence unless it already exists.
+
+    Concurrent requests for the same file wait for a single render.
+
+    Returns:
+        True if the output exists afterwards, False if there is no sequence.
+    """
+    if os.path.exists(output_path):
+        CACHE_HITS.inc(cache='lazy_render')
+        return True
+    with _lock_for(output_path):
+        if os.path.exists(output_path):
+            CACHE_HITS.inc(cache='lazy_render')
+            return True
+        if not os.path.exists(sequence_path):
+            return False
+        CACHE_MISSES.inc(cache='lazy_render')
+        saved = load_sequence(sequence_path)
+        root, ext = os.path.splitext(output_path)
+        tmp = root + '.part' + ext
+        _render_one(target, saved['sequence'], tmp, saved['duration'], saved.get('seed'),
+                    state_file=state_path(output_path) if keep_state else None)
+        os.replace(tmp, output_path)
+    return True
+
+# ----------------------------------------
+# Extension
+# ----------------------------------------
+def extend_tune(sequence_path, outputs, duration):
+    """
+    Lengthen the saved tune to `duration` seconds.
+
+    The swar sequence is continued from where it ended (the saved sequence
+    needs the raga's `swar_source`, and optionally `music_params`, for
+    this). Renders with saved engine state only get the new notes rendered
+    and spliced on; the others are re-rendered from the longer sequence.
+
+    Args:
+        sequence_path (str): Sequence saved by save_sequence().
+        outputs (dict): Target name → existing output path to extend.
+        duration (float): New length in seconds.
+
+    Returns:
+        Number of new notes.
+
+    Raises:
+        ValueError: The tune is already that long, or can't be continued.
+    """
+    # Concurrent extensions would both pass the length check and splice
+    # their notes into the same renders; they take turns instead
+    with sequence_lock(sequence_path):
+        return _extend_locked(sequence_path, outputs, duration)
+
+def _extend_locked(sequence_path, outputs, duration):
+    from music_generation.swar_arranger import extend_swar_sequence
+
+    saved = load_sequence(sequence_path)
+    if duration <= saved['duration']:
+        raise ValueError(f"The tune is already {saved['duration']}s long")
+    if not saved.get('swar_source'):
+        raise ValueError("This tune was saved without its raga swars, so it can't be continued")
+    with span("sequence.extend"):
+        new_notes = extend_swar_sequence(saved['sequence'], saved['swar_source'],
+                                         duration - saved['duration'], saved.get('music_params'))
+    saved['sequence'] = saved['sequence'] + new_notes
+    saved['duration'] = duration
+    save_sequence(path=sequence_path, **saved)
+
+    # Outputs removed by a /generate while this call waited for the lock
+    # follow lazily from the new sequence
+    for target, path in outputs.items():
+        if not os.path.exists(path):
+            continue
+        with _lock_for(path):
+            _extend_one(target, saved['sequence'], new_notes, path, duration, saved.get('seed'))
+    return len(new_notes)
+
+def _extend_one(target, sequence, new_notes, path, duration, seed=None):
+    extender = EXTENDERS.get(target)
+    state_file = state_path(path)
+    if extender is not None and os.path.exists(state_file):
+        with span(f"extend.{target}"):
+            if extender(new_notes, path, duration, state_file):
+                return
+    root, ext = os.path.splitext(path)
+    tmp = root + '.part' + ext
+    _render_one(target, sequence, tmp, duration, seed,
+                state_file=state_file if extender is not None else None)
+    os.replace(tmp, path)
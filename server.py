@@ -1,7 +1,14 @@
 # server.py
 from flask import Flask, request, jsonify, abort, send_file, Response
 from werkzeug.utils import secure_filename
-import os, re
+import os, re, shutil, logging, contextlib
+from pipeline import (RENDERERS, parse_render_targets, render_targets, render_lazily, invalidate, save_sequence,
+                      sequence_lock, extend_tune, estimate_render_seconds)
+from utils.metrics import span, metrics_response, CACHE_HITS, CACHE_MISSES
+from utils.admission import AdmissionController, Rejected, limited, rejection_response
+from utils.profiling import profiled, profiles_response
+from image_analysis.similarity_cache import SimilarityCache
+from image_analysis.derivatives import ImageDerivatives, content_hash, pick_format
 
 app = Flask(__name__, static_folder="web", static_url_path="")
 UPLOAD_FOLDER = 'uploads'
@@ -9,19 +16,78 @@ OUTPUT_FOLDER = 'output'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Render target → file served under /output/ (only targets this install can render)
+TARGET_FILES = {t: f for t, f in {
+    "normal": "output.wav",
+    "enhanced": "enhanced_tune.wav",
+    "wavetable": "wavetable_tune.wav",
+    "soundfont": "soundfont_tune.wav",
+    "midi": "tune.mid"
+}.items() if t in RENDERERS}
+TARGET_BY_FILE = {f: t for t, f in TARGET_FILES.items()}
+SEQUENCE_PATH = os.path.join(OUTPUT_FOLDER, "sequence.json")
+
+# Admission control for /generate (override with environment variables):
+# requests beyond the limit wait in a bounded queue, the rest get 429/503
+GENERATE_MAX_CONCURRENT = int(os.environ.get("GENERATE_MAX_CONCURRENT", os.cpu_count() or 1))
+GENERATE_MAX_QUEUE = int(os.environ.get("GENERATE_MAX_QUEUE", 2 * GENERATE_MAX_CONCURRENT))
+GENERATE_QUEUE_TIMEOUT = float(os.environ.get("GENERATE_QUEUE_TIMEOUT", 30))
+
+# Uploads are analysed in memory; set KEEP_UPLOADS=1 to also store them
+KEEP_UPLOADS = os.environ.get("KEEP_UPLOADS", "0") == "1"
+generate_admission = AdmissionController(
+    "generate", GENERATE_MAX_CONCURRENT, GENERATE_MAX_QUEUE, GENERATE_QUEUE_TIMEOUT)
+
+# Near-duplicate reuse: uploads whose signature lies within
+# SIMILARITY_THRESHOLD of an earlier one (same duration) reuse its result.
+# SIMILARITY_CACHE_DIR="" turns it off; SIMILARITY_CACHE_AUDIO=0 keeps only
+# sequences (re-rendered on a hit) instead of also copying the audio.
+SIMILARITY_CACHE_DIR = os.environ.get("SIMILARITY_CACHE_DIR", "similarity_cache")
+SIMILARITY_THRESHOLD = float(os.environ.get("SIMILARITY_THRESHOLD", 0.15))
+SIMILARITY_CACHE_MAX = int(os.environ.get("SIMILARITY_CACHE_MAX", 5000))
+SIMILARITY_CACHE_AUDIO = os.environ.get("SIMILARITY_CACHE_AUDIO", "1") == "1"
+similarity_cache = (SimilarityCache(SIMILARITY_CACHE_DIR, SIMILARITY_THRESHOLD, SIMILARITY_CACHE_MAX)
+                    if SIMILARITY_CACHE_DIR else None)
+
+# Display-size and thumbnail copies of uploads, made from the analysis
+# decode and served from IMAGE_CACHE_DIR with year-long cache lifetimes
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_MB = float(os.environ.get("IMAGE_CACHE_MAX_MB", 200))
+derivatives = ImageDerivatives(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
 @app.route("/")
 def index():
     return app.send_static_file("index.html")
 
 @app.route("/generate", methods=["POST"])
+@limited(generate_admission)
+@profiled
 def generate_music():
     # 1) Validate upload
     if "image" not in request.files:
         return jsonify({"error": "No image uploaded"}), 400
     img = request.files["image"]
-    fname = secure_filename(img.filename)
-    in_path = os.path.join(UPLOAD_FOLDER, fname)
-    img.save(in_path)
+    data = img.read()
+
+    # Decode straight from memory, at reduced scale for large photos; both
+    # analysis stages then share the one decoded array
+    from image_analysis.image_loader import decode_image, FEATURE_MIN_SIDE
+    with span("upload.decode"):
+        try:
+            image = decode_image(data, min_side=FEATURE_MIN_SIDE)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    # The client gets resized copies back instead of its full-size upload:
+    # the thumbnail now, from the analysis decode, the display copy from
+    # the kept upload when it is first requested
+    with span("upload.derivatives"):
+        upload_hash = content_hash(data)
+        fmt = pick_format(request)
+        derivatives.store(upload_hash, image, sizes=("thumb",), formats=(fmt,), original=data)
+    if KEEP_UPLOADS:
+        with span("upload.save"):
+            with open(os.path.join(UPLOAD_FOLDER, secure_filename(img.filename) or "upload"), "wb") as f:
+                f.write(data)
 
     # 2) Parse inputs
     try:
@@ -29,68 +95,180 @@ def generate_music():
     except ValueError:
         user_duration = 7.0
     user_raga = request.form.get("raga", "").strip()
+    try:
+        targets = parse_render_targets(request.form.get("targets"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # 3) Core imports
     from image_analysis.color_extractor import extract_dominant_colors
     from image_analysis.swar_mapper import get_swar_and_freq_from_rgb
     from image_analysis.feature_analysis import extract_image_features, derive_music_params_from_features
+    from image_analysis.similarity_cache import image_signature
     from music_generation.raga_selector import choose_raga_from_colors, get_raga_swars
     from music_generation.swar_arranger import arrange_swar_sequence, enhance_swar_sequence
-    from music_generation.harmonium_synth import synthesize_sequence_to_audio
-    from enhance_tune import generate_from_clean_swar_sequence
 
-    # 4) Raga selection
-    colors = extract_dominant_colors(in_path, 7)
-    raga = user_raga or choose_raga_from_colors(colors)
+    # 4) Image analysis
+    with span("extract_dominant_colors"):
+        colors = extract_dominant_colors(image, 7)
+    with span("extract_image_features"):
+        features = extract_image_features(image)
+
+    # 5) Near-duplicate lookup: a re-crop or re-encode of an earlier upload
+    #    reuses that upload's raga, sequence and (if cached) audio
+    signature = image_signature(colors, features)
+    match = None
+    if similarity_cache is not None:
+        with span("similarity.lookup"):
+            match = similarity_cache.lookup(signature, user_duration, raga=user_raga or None)
+        if match:
+            CACHE_HITS.inc(cache="similarity")
+        else:
+            CACHE_MISSES.inc(cache="similarity")
+
+    # 6) Raga selection
+    with span("choose_raga"):
+        if match:
+            raga = match[0]["raga"]
+        else:
+            raga = user_raga or choose_raga_from_colors(colors, features)
 
-    # 5) Build swar_source
+    # 7) Build swar_source
     use_raga_mode = True
-    if use_raga_mode:
-        swar_source = get_raga_swars(raga)
-    else:
-        swar_source = [get_swar_and_freq_from_rgb(c) for c in colors]
+    with span("get_raga_swars"):
+        if use_raga_mode:
+            swar_source = get_raga_swars(raga)
+        else:
+            swar_source = [get_swar_and_freq_from_rgb(c) for c in colors]
 
-    # 6) Music parameters
-    features = extract_image_features(in_path)
+    # 8) Sequence generation
+    use_enhanced = True  # toggle or read from form param
     music_params = derive_music_params_from_features(features)
+    with span("sequence"):
+        if match:
+            sequence = match[0]["sequence"]
+        else:
+            if use_enhanced:
+                sequence = enhance_swar_sequence(
+                    swar_source=swar_source,
+                    total_duration=user_duration,
+                    music_params=music_params
+                )
+            else:
+                sequence = arrange_swar_sequence(
+                    swar_source=swar_source,
+                    total_duration=user_duration,
+                    music_params=music_params
+                )
 
-    # 7) Sequence generation
-    use_enhanced = True  # toggle or read from form param
-    if use_enhanced:
-        sequence = enhance_swar_sequence(
-            swar_source=swar_source,
-            total_duration=user_duration,
-            music_params=music_params
-        )
-    else:
-        sequence = arrange_swar_sequence(
-            swar_source=swar_source,
-            total_duration=user_duration,
-            music_params=music_params
-        )
-
-    # 8) Audio synthesis
-    normal_path   = os.path.join(OUTPUT_FOLDER, "output.wav")
-    enhanced_path = os.path.join(OUTPUT_FOLDER, "enhanced_tune.wav")
-    synthesize_sequence_to_audio(sequence, normal_path, user_duration)
-    generate_from_clean_swar_sequence(sequence, output_file=enhanced_path,max_duration=user_duration)
-
-    # 9) JSON response
+    # 9) Audio synthesis — only the requested targets; the others are
+    #    rendered from the saved sequence when their URL is first fetched.
+    #    Targets the matched entry has on disk are copied instead.
+    #    The sequence goes first, so a lazy render that starts once the old
+    #    files are gone already uses it, and an /extend waits until the new
+    #    sequence and its renders are in place. The raga swars and music
+    #    params let /extend continue the sequence later.
+    with sequence_lock(SEQUENCE_PATH):
+        save_sequence(sequence, SEQUENCE_PATH, user_duration, raga=raga,
+                      swar_source=swar_source, music_params=music_params)
+        for filename in TARGET_FILES.values():
+            invalidate(os.path.join(OUTPUT_FOLDER, filename))
+        outputs = {t: os.path.join(OUTPUT_FOLDER, TARGET_FILES[t]) for t in targets}
+        to_render = dict(outputs)
+        if match:
+            for t, path in outputs.items():
+                cached = similarity_cache.audio_path(match[0], t)
+                if cached:
+                    shutil.copyfile(cached, path + '.part')
+                    os.replace(path + '.part', path)
+                    del to_render[t]
+        render_targets(sequence, to_render, user_duration, keep_state=True)
+    if similarity_cache is not None and not match:
+        with span("similarity.add"):
+            similarity_cache.add(signature, user_duration, raga, sequence,
+                                 audio=outputs if SIMILARITY_CACHE_AUDIO else None)
+
+    # 10) JSON response
     return jsonify({
         "raga": raga,
         "swaras": [s for s, _ in swar_source],
-        "normal_url": "/output/output.wav",
-        "enhanced_url": "/output/enhanced_tune.wav"
+        "rendered": list(targets),
+        "similar": {"distance": round(match[1], 4)} if match else None,
+        # Predicted seconds until each lazily rendered target's URL responds
+        "eta": {t: round(estimate_render_seconds((t,), user_duration, analysis=False), 1)
+                for t in TARGET_FILES if t not in targets},
+        "image_url": derivatives.url(upload_hash, "display", fmt),
+        "thumb_url": derivatives.url(upload_hash, "thumb", fmt),
+        **{f"{t}_url": f"/output/{f}" for t, f in TARGET_FILES.items()}
     })
 
+@app.route("/extend", methods=["POST"])
+@limited(generate_admission)
+@profiled
+def extend_music():
+    # 1) Parse inputs
+    form = request.get_json(silent=True) or request.form
+    try:
+        new_duration = float(form.get("duration"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Give the new duration in seconds"}), 400
+    if not os.path.exists(SEQUENCE_PATH):
+        return jsonify({"error": "Nothing to extend; generate a tune first"}), 404
+
+    # 2) Extend the renders that exist: only the new notes are rendered and
+    #    spliced on where the engine state allows it. Targets not rendered
+    #    yet follow lazily from the longer sequence.
+    outputs = {t: os.path.join(OUTPUT_FOLDER, f) for t, f in TARGET_FILES.items()
+               if os.path.exists(os.path.join(OUTPUT_FOLDER, f))}
+    try:
+        added = extend_tune(SEQUENCE_PATH, outputs, new_duration)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # A lazy render that started before the extension used the old sequence
+    for t, f in TARGET_FILES.items():
+        if t not in outputs:
+            invalidate(os.path.join(OUTPUT_FOLDER, f))
+
+    # 3) JSON response
+    return jsonify({
+        "duration": new_duration,
+        "new_notes": added,
+        "extended": list(outputs),
+        **{f"{t}_url": f"/output/{f}" for t, f in TARGET_FILES.items()}
+    })
+
+@app.route("/images/<digest>/<name>")
+def get_image_derivative(digest, name):
+    return derivatives.response(digest, name)
+
+@app.route("/metrics")
+def metrics():
+    return metrics_response()
+
+@app.route("/profiles")
+@app.route("/profiles/<name>")
+def profiles(name=None):
+    return profiles_response(name)
+
 @app.route("/output/<path:filename>")
 def serve_audio(filename):
     path = os.path.join(OUTPUT_FOLDER, filename)
+    target = TARGET_BY_FILE.get(filename)
+    if target:
+        # A lazy render is generation work too, so it shares the /generate slots
+        slot = contextlib.nullcontext() if os.path.exists(path) else generate_admission.slot()
+        try:
+            with slot:
+                if not render_lazily(target, path, SEQUENCE_PATH, keep_state=True):
+                    abort(404)
+        except Rejected as e:
+            return rejection_response(e)
     if not os.path.exists(path):
         abort(404)
+    mimetype = 'audio/midi' if filename.endswith('.mid') else 'audio/wav'
     range_header = request.headers.get('Range', None)
     if not range_header:
-        return send_file(path, mimetype='audio/wav')
+        return send_file(path, mimetype=mimetype)
     size = os.path.getsize(path)
     m = re.match(r"bytes=(\d+)-(\d*)", range_header)
     if not m:
@@ -102,11 +280,12 @@ def serve_audio(filename):
     with open(path, 'rb') as f:
         f.seek(start)
         data = f.read(length)
-    rv = Response(data, 206, mimetype='audio/wav', direct_passthrough=True)
+    rv = Response(data, 206, mimetype=mimetype, direct_passthrough=True)
     rv.headers.add('Content-Range', f'bytes {start}-{end}/{size}')
     rv.headers.add('Accept-Ranges', 'bytes')
     rv.headers.add('Content-Length', str(length))
     return rv
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     app.run(debug=True)
@@ -1,118 +1,178 @@
-from flask import Flask, send_from_directory, jsonify, request
-import os, random, threading, time
+from flask import Flask, Response, send_from_directory, jsonify, request
+import os, random, threading, time, logging, uuid, contextlib
 from pydub import AudioSegment
 AudioSegment.converter = r"C:\ffmpeg\bin\ffmpeg.exe"
 
 # Core imports (from your old working pipeline)
-from image_analysis.color_extractor import extract_dominant_colors
-from image_analysis.swar_mapper import get_swar_and_freq_from_rgb
-from image_analysis.feature_analysis import extract_image_features, derive_music_params_from_features
-from music_generation.raga_selector import choose_raga_from_colors, get_raga_swars
-from music_generation.swar_arranger import arrange_swar_sequence, enhance_swar_sequence
-from music_generation.harmonium_synth import synthesize_sequence_to_audio
-from enhance_tune import generate_from_clean_swar_sequence
-from config import RAGA_LIBRARY
+from pipeline import render_image_tune, estimate_render_seconds, AUDIO_TARGETS
+from tune_pool import TunePool, sidecar_path
+from utils.metrics import metrics_response
+from utils.admission import AdmissionController, Rejected, rejection_response
+from utils.profiling import request_profiler, with_profile_id, profiles_response
+from utils.job_queue import JobQueue, DONE, FINISHED
+from sessions import SessionRegistry, SessionExists, SessionLimit, SESSION_NAME_RE, crossfade_step
+from session_stream import StreamHub
+from image_analysis.derivatives import ImageDerivatives, SIZES, pick_format
+from image_analysis.image_loader import FEATURE_MIN_SIDE
+from utils.metrics import REGISTRY
+from worker import RENDER_JOB
 
 
 app = Flask(__name__, static_folder="static2", template_folder="static2")
+logger = logging.getLogger("server2")
 
 IMAGE_DIR = "random_images"
 TUNE_DIR = "generated_tunes"
 os.makedirs(IMAGE_DIR, exist_ok=True)
 os.makedirs(TUNE_DIR, exist_ok=True)
 
-# Global state variables
-lock = threading.Lock()
-running = False
-start_time = 0
-processed = 0
-selected_images = []  # List of 10 selected images
-current_index = 0     # Current playing index (0-9)
-generation_complete = False
-playback_start_time = 0
+# Render engine for session tunes: "enhanced" (samples) or the much
+# cheaper "wavetable" voice for high-load deployments
+TUNE_ENGINE = os.environ.get("TUNE_ENGINE", "enhanced")
+if TUNE_ENGINE not in AUDIO_TARGETS:
+    raise ValueError(f"Unknown TUNE_ENGINE '{TUNE_ENGINE}'. Choose from: {', '.join(AUDIO_TARGETS)}")
+
+# Resized WebP/JPEG versions of the images for the player, made on first
+# request and served from IMAGE_CACHE_DIR with year-long cache lifetimes
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_MB = float(os.environ.get("IMAGE_CACHE_MAX_MB", 200))
+derivatives = ImageDerivatives(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
+# Pre-generation pool (override with environment variables)
+TUNES_PER_SESSION = 10
+POOL_DURATIONS = [int(d) for d in os.environ.get("POOL_DURATIONS", "15").split(",") if d.strip()]
+POOL_DISK_BUDGET_MB = float(os.environ.get("POOL_DISK_BUDGET_MB", 500))
+POOL_VARIANTS_PER_IMAGE = int(os.environ.get("POOL_VARIANTS_PER_IMAGE", 1))
+
+# Admission control for /start: a session's batch render holds one slot
+# until it finishes; further /start calls queue briefly or get 429/503
+START_MAX_CONCURRENT = int(os.environ.get("START_MAX_CONCURRENT", 1))
+START_MAX_QUEUE = int(os.environ.get("START_MAX_QUEUE", 4))
+START_QUEUE_TIMEOUT = float(os.environ.get("START_QUEUE_TIMEOUT", 5))
+start_admission = AdmissionController("start", START_MAX_CONCURRENT, START_MAX_QUEUE, START_QUEUE_TIMEOUT)
+
+# Shared job queue: with JOB_QUEUE_PATH set, /start enqueues render jobs for
+# worker.py processes and /status reads progress from the queue, so any
+# number of web processes (and hosts) can serve the same session
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH")
+job_queue = JobQueue(JOB_QUEUE_PATH) if JOB_QUEUE_PATH else None
+if job_queue is not None:
+    REGISTRY.gauge("harmonium_job_queue_jobs", "Jobs in the shared queue by status.", ("status",),
+                   callback=lambda: {(s,): n for s, n in job_queue.counts().items()})
+
+# Named sessions: listeners attach to a session and share its batch and
+# playback clock. /start, /status and /stop without a session name use
+# DEFAULT_SESSION. Sessions end on DELETE /sessions/<name> (or /stop), or
+# after SESSION_IDLE_TIMEOUT seconds without a status poll; a listener
+# counts as present until LISTENER_TIMEOUT seconds after its last poll.
+DEFAULT_SESSION = "default"
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 8))
+SESSION_IDLE_TIMEOUT = float(os.environ.get("SESSION_IDLE_TIMEOUT", 900))
+LISTENER_TIMEOUT = float(os.environ.get("LISTENER_TIMEOUT", 30))
+
+# Consecutive tunes overlap by SESSION_CROSSFADE seconds on the session
+# clock. /sessions/<name>/stream mixes them on the server into one
+# continuous MP3 stream shared by every listener of the session.
+SESSION_CROSSFADE = float(os.environ.get("SESSION_CROSSFADE", 1.5))
+streams = StreamHub()
+REGISTRY.gauge("harmonium_stream_listeners", "Listeners attached to session streams.",
+               callback=streams.listener_count)
 
 def generate_real_tune(image_path, duration, output_path):
     """Generate a single tune from an image"""
     try:
-        # 1. Extract features
-        raga = random.choice(list(RAGA_LIBRARY.keys()))
-        swar_source = get_raga_swars(raga)
-
-        features = extract_image_features(image_path)
-        music_params = derive_music_params_from_features(features)
-
-        # 2. Sequence generation
-        sequence = enhance_swar_sequence(
-            swar_source=swar_source,
-            total_duration=duration,
-            music_params=music_params
-        )
-
-        # 3. Synthesize to audio
-        temp_path = output_path + ".temp.wav"
-        synthesize_sequence_to_audio(sequence, temp_path, duration)
-        generate_from_clean_swar_sequence(sequence, output_file=output_path, max_duration=duration)
-        
-        # Clean up temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-            
+        # The player only uses one audio variant; the MIDI sidecar is for
+        # clients with their own synths. The analysis decode is shared with
+        # the image derivatives, so the thumbnail costs no second decode.
+        image = derivatives.decoded(image_path, FEATURE_MIN_SIDE)
+        render_image_tune(image, {
+            TUNE_ENGINE: output_path,
+            "midi": sidecar_path(output_path, ".mid")
+        }, duration)
+        derivatives.get(image_path, "thumb")
         return True
     except Exception as e:
-        print(f"Error generating tune for {image_path}: {e}")
+        logger.exception("Error generating tune for %s: %s", image_path, e)
         return False
 
-def batch_tune_generator(duration):
-    """Generate tunes for all 10 selected images"""
-    global running, processed, generation_complete, playback_start_time, current_index, selected_images
-    
+pool = TunePool(
+    IMAGE_DIR, TUNE_DIR, generate_real_tune,
+    durations=POOL_DURATIONS,
+    budget_bytes=POOL_DISK_BUDGET_MB * 1024 * 1024,
+    variants_per_image=POOL_VARIANTS_PER_IMAGE
+)
+
+sessions = SessionRegistry(
+    max_sessions=MAX_SESSIONS,
+    idle_timeout=SESSION_IDLE_TIMEOUT,
+    listener_timeout=LISTENER_TIMEOUT,
+    on_expire=lambda session: pool.release(session.owner),
+    crossfade=SESSION_CROSSFADE
+)
+
+def tune_render_seconds(duration):
+    """Predicted time to render one session tune (audio plus MIDI sidecar)"""
+    return estimate_render_seconds((TUNE_ENGINE, "midi"), duration)
+
+def generation_eta(session, now):
+    """Seconds until a local session's batch is rendered, from the cost model"""
+    remaining = sum(1 for t in session.tunes if t is None)
+    if session.generation_complete or not remaining:
+        return 0.0
+    per_tune = tune_render_seconds(session.duration)
+    # The tune in progress has been rendering since the last one finished
+    return max(0.0, remaining * per_tune - min(now - session.progress_at, 0.95 * per_tune))
+
+def batch_tune_generator(session, acquired_at, profiler=None):
+    """Render the tunes the pool could not supply for the session's images"""
     try:
-        # Generate tunes for all selected images
-        for i, image_name in enumerate(selected_images):
-            if not running:  # Check if stopped during generation
-                break
-                
-            image_path = os.path.join(IMAGE_DIR, image_name)
-            tune_name = f"{os.path.splitext(image_name)[0]}_tune.wav"
-            tune_path = os.path.join(TUNE_DIR, tune_name)
-            
-            print(f"Generating tune {i+1}/10: {image_name}")
-            
-            success = generate_real_tune(image_path, duration, tune_path)
-            
-            with lock:
-                if success:
-                    processed += 1
-                else:
-                    print(f"Failed to generate tune for {image_name}")
+        with profiler or contextlib.nullcontext(), pool.foreground():
+            for i, image_name in enumerate(list(session.images)):
+                if not session.running:  # Check if stopped during generation
+                    break
+                if session.tunes[i] is not None:
+                    continue
+
+                print(f"[{session.name}] Generating tune {i+1}/{len(session.images)}: {image_name}")
+
+                entry = pool.render(image_name, session.duration, owner=session.owner)
+
+                with session.lock:
+                    session.progress_at = time.time()
+                    if entry:
+                        session.tunes[i] = entry["file"]
+                        session.processed += 1
+                    else:
+                        print(f"Failed to generate tune for {image_name}")
         
-        # Mark generation as complete and start playback
-        with lock:
-            if running and processed > 0:
-                generation_complete = True
-                current_index = 0
-                playback_start_time = time.time()
-                print(f"Generation complete! Generated {processed} tunes. Starting playback...")
+        # Keep only images that got a tune, then start playback
+        with session.lock:
+            session.start_playback()
+            if session.generation_complete:
+                print(f"[{session.name}] Generation complete! Generated {session.processed} tunes. Starting playback...")
             
     except Exception as e:
         print(f"Error in batch generation: {e}")
-        with lock:
-            running = False
+        sessions.expire(session.name, session)
+    finally:
+        start_admission.release(acquired_at)
 
-def select_random_images():
-    """Select 10 random images from the directory"""
+def select_random_images(count=TUNES_PER_SESSION, exclude=()):
+    """Select `count` random images from the directory"""
     try:
         available_images = [
             f for f in os.listdir(IMAGE_DIR)
-            if f.lower().endswith((".jpg", ".jpeg", ".png"))
+            if f.lower().endswith((".jpg", ".jpeg", ".png")) and f not in exclude
         ]
+        if not available_images:
+            return []
         
-        if len(available_images) < 10:
-            # If less than 10 images, repeat some to make 10
-            selected = available_images * (10 // len(available_images) + 1)
-            return selected[:10]
+        if len(available_images) < count:
+            # If fewer images than needed, repeat some
+            selected = available_images * (count // len(available_images) + 1)
+            return selected[:count]
         else:
-            return random.sample(available_images, 10)
+            return random.sample(available_images, count)
             
     except Exception as e:
         print(f"Error selecting images: {e}")
@@ -122,108 +182,364 @@ def select_random_images():
 def index():
     return app.send_static_file("index.html")
 
+def _request_data():
+    return request.get_json(silent=True) or {}
+
+def _session_name(data=None):
+    data = _request_data() if data is None else data
+    return data.get("session") or request.args.get("session") or DEFAULT_SESSION
+
 @app.route("/start", methods=["POST"])
 def start():
-    global running, processed, start_time, selected_images, generation_complete, current_index, playback_start_time
-    
+    data = _request_data()
     try:
-        data = request.get_json()
-        duration = int(data.get("duration", 15)) if data else 15
+        duration = int(data.get("duration", 15))
     except (ValueError, TypeError):
         duration = 15
+    return start_session(_session_name(data), duration)
+
+def start_session(name, duration):
+    """Create session `name` and render its batch; if it already runs, join it instead"""
+    # An admin can ask for a profile of the session's renders (or, in queue
+    # mode, where workers render, of the request itself)
+    profiler, error = request_profiler("start")
+    if error is not None:
+        return error
+    if not SESSION_NAME_RE.match(name):
+        if profiler:
+            profiler.discard()
+        return jsonify({"status": "error", "message": "Session names are 1-64 letters, digits, '-' or '_'"}), 400
+    if job_queue is not None:
+        with profiler or contextlib.nullcontext():
+            response = start_queued(name, duration)
+        return with_profile_id(response, profiler)
     
-    with lock:
-        if not running:
-            # Reset all state
-            running = True
-            processed = 0
-            generation_complete = False
-            current_index = 0
-            start_time = time.time()
-            playback_start_time = 0
-            
-            # Select 10 random images
-            selected_images = select_random_images()
-            
-            if not selected_images:
-                running = False
-                return jsonify({"status": "error", "message": "No images found in directory"})
-            
-            print(f"Selected {len(selected_images)} images for generation")
-            
-            # Start batch generation in background thread
-            threading.Thread(target=batch_tune_generator, args=(duration,), daemon=True).start()
-            
-            return jsonify({"status": "started", "selected_count": len(selected_images)})
-        else:
-            return jsonify({"status": "already_running"})
+    pool.start()
+    if sessions.get(name) is not None:
+        if profiler:
+            profiler.discard()
+        return already_running(name)
+    try:
+        acquired_at = start_admission.acquire()
+    except Rejected as e:
+        if profiler:
+            profiler.discard()
+        return rejection_response(e)
+
+    handed_off = False
+    try:
+        try:
+            session = sessions.create(name, duration)
+        except SessionExists:
+            return already_running(name)
+        except SessionLimit as e:
+            return jsonify({"status": "error", "message": str(e)}), 429
+
+        with session.lock:
+            # Take ready tunes from the pool, then top up with random images
+            ready = pool.take(TUNES_PER_SESSION, duration, owner=session.owner)
+            session.images = [e["image"] for e in ready]
+            session.tunes = [e["file"] for e in ready]
+            missing = select_random_images(TUNES_PER_SESSION - len(ready), exclude=set(session.images)) \
+                if len(ready) < TUNES_PER_SESSION else []
+            session.images += missing
+            session.tunes += [None] * len(missing)
+            session.processed = len(ready)
+
+            if session.images:
+                print(f"[{name}] Selected {len(session.images)} images ({len(ready)} ready in pool)")
+                if missing:
+                    # Render the rest in a background thread, which keeps the slot
+                    threading.Thread(target=batch_tune_generator, args=(session, acquired_at, profiler),
+                                     daemon=True).start()
+                    handed_off = True
+                else:
+                    session.start_playback()
+
+        if not session.images:
+            sessions.expire(name, session)
+            return jsonify({"status": "error", "message": "No images found in directory"})
+
+        return with_profile_id(jsonify({
+            "status": "started",
+            "session": name,
+            "listener": session.join(),
+            "selected_count": len(session.images),
+            "from_pool": len(ready),
+            "eta": round(generation_eta(session, time.time()), 1)
+        }), profiler if handed_off else None)
+    finally:
+        if not handed_off:
+            start_admission.release(acquired_at)
+            if profiler:
+                profiler.discard()
+
+def already_running(name):
+    """The session exists: attach the caller to it rather than starting another batch"""
+    session = sessions.get(name)
+    return jsonify({
+        "status": "already_running",
+        "session": name,
+        "listener": session.join() if session else None
+    })
+
+def start_queued(name, duration):
+    """Queue-backed /start: the session is a batch of render jobs in the shared queue"""
+    images = select_random_images(TUNES_PER_SESSION)
+    if not images:
+        return jsonify({"status": "error", "message": "No images found in directory"})
+
+    # One open batch per session name; "<name>/<id>" lets the name be reused later
+    batch_id = f"{name}/{uuid.uuid4().hex}"
+    # Jobs carry their predicted render time, so workers run short ones first
+    cost = tune_render_seconds(duration)
+    jobs = [(RENDER_JOB, {"image": img, "duration": duration}, cost) for img in images]
+    meta = {"images": images, "duration": duration, "session": name}
+    if not job_queue.create_batch(batch_id, meta, jobs, exclusive=True, group=name):
+        return jsonify({"status": "already_running", "session": name, "listener": None})
+
+    print(f"Queued {len(images)} render jobs for session {name}")
+    return jsonify({
+        "status": "started",
+        "selected_count": len(images),
+        "from_pool": 0,
+        "eta": round(queued_eta(batch_id), 1),
+        "session": name,
+        "listener": None
+    })
 
 @app.route("/stop", methods=["POST"])
 def stop():
-    global running, generation_complete, current_index, playback_start_time
-    
-    with lock:
-        running = False
-        generation_complete = False
-        current_index = 0
-        playback_start_time = 0
-        
+    expire_session(_session_name())
     return jsonify({"status": "stopped"})
 
+def expire_session(name):
+    """End a session for all its listeners; False if there was none"""
+    if job_queue is not None:
+        batch = job_queue.latest_batch(group=name)
+        if batch:
+            job_queue.stop_batch(batch["id"])
+        return batch is not None
+    return sessions.expire(name) is not None
+
 @app.route("/status")
 def status():
-    global running, start_time, processed, selected_images, generation_complete, playback_start_time, current_index
-    
-    with lock:
-        now = time.time()
-        elapsed = int(now - start_time) if running else 0
-        
-        response_data = {
-            "elapsed": elapsed,
-            "count": processed,
-            "total_images": len(selected_images),
-            "generation_complete": generation_complete,
-            "running": running
-        }
-        
-        if generation_complete and running and processed > 0 and len(selected_images) > 0:
-            # Calculate which tune should be playing based on time
-            time_since_playback = now - playback_start_time
-            tune_duration = 15  # Default duration, should match the actual duration
-            
-            # Calculate current index based on elapsed time
-            calculated_index = int(time_since_playback // tune_duration) % len(selected_images)
-            
-            # Update current index if it's time for the next tune
-            if calculated_index != current_index:
-                current_index = calculated_index
-                playback_start_time = now - (calculated_index * tune_duration)
-            
-            # Get current image and tune
-            if current_index < len(selected_images):
-                current_image = selected_images[current_index]
-                current_tune = f"{os.path.splitext(current_image)[0]}_tune.wav"
-                
-                # Calculate remaining time for current tune
-                time_in_current_tune = time_since_playback % tune_duration
-                remaining_time = max(0, tune_duration - time_in_current_tune)
-                
-                response_data.update({
-                    "image": current_image,
-                    "tune": current_tune,
-                    "current_index": current_index + 1,  # 1-based for display
-                    "remaining": round(remaining_time, 1),
-                    "progress": round((time_in_current_tune / tune_duration) * 100, 1)
-                })
-        
-        return jsonify(response_data)
+    return jsonify(session_status(_session_name(), request.args.get("listener")))
+
+def session_status(name, listener=None):
+    """Progress and playback position of a session (idle fields if it doesn't exist)"""
+    if job_queue is not None:
+        return queued_status(name)
+
+    session = sessions.get(name)
+    if session is None:
+        return {"elapsed": 0, "count": 0, "total_images": 0, "generation_complete": False,
+                "running": False, "session": name}
+    session.touch(listener)
+
+    now = time.time()
+    response_data = session.summary(LISTENER_TIMEOUT)
+    response_data["elapsed"] = int(now - session.created)
+    with session.lock:
+        response_data["eta"] = round(generation_eta(session, now), 1)
+
+    # Every listener derives the position from the shared clock
+    playing = session.playback(now)
+    if playing:
+        midi = sidecar_path(playing["tune"], ".mid")
+        response_data.update(image_urls(playing["image"]))
+        response_data.update({
+            "image": playing["image"],
+            "tune": playing["tune"],
+            "midi_url": f"/tune/{midi}" if os.path.exists(os.path.join(TUNE_DIR, midi)) else None,
+            "current_index": playing["index"] + 1,  # 1-based for display
+            "remaining": round(playing["remaining"], 1),
+            "progress": round(playing["progress"] * 100, 1)
+        })
+    return response_data
+
+def queued_status(name):
+    """Session progress read from the shared job queue (same fields as /status)"""
+    batch = job_queue.latest_batch(group=name)
+    if batch is None:
+        return {"elapsed": 0, "count": 0, "total_images": 0, "generation_complete": False,
+                "running": False, "session": name}
+
+    now = time.time()
+    jobs = job_queue.batch_jobs(batch["id"])
+    done = [j for j in jobs if j["status"] == DONE]
+    finished = all(j["status"] in FINISHED for j in jobs)
+    complete = bool(done) and finished
+    response_data = {
+        "elapsed": int(now - batch["created"]),
+        "count": len(done),
+        "total_images": len(jobs),
+        "generation_complete": complete,
+        "running": not finished or complete,
+        "session": name,
+        "duration": batch["meta"]["duration"],
+        "eta": 0.0 if complete else round(queued_eta(batch["id"], jobs), 1)
+    }
+
+    if complete:
+        # Playback starts when the last job finished, so every web process
+        # derives the same position without any shared clock state
+        step = crossfade_step(batch["meta"]["duration"], SESSION_CROSSFADE)
+        time_since_playback = now - max(j["updated"] for j in jobs)
+        index = int(time_since_playback // step) % len(done)
+        time_in_current_tune = time_since_playback % step
+        job = done[index]
+        response_data.update(image_urls(job["payload"]["image"]))
+        response_data.update({
+            "image": job["payload"]["image"],
+            "tune": job["result"]["file"],
+            "midi_url": f"/tune/{job['result']['midi']}",
+            "current_index": index + 1,
+            "remaining": round(max(0, step - time_in_current_tune), 1),
+            "progress": round((time_in_current_tune / step) * 100, 1)
+        })
+    return response_data
+
+def queued_eta(batch_id, jobs=None):
+    """
+    Seconds until a queued batch is rendered: the work the workers will
+    claim before its last job (shortest first, see JobQueue.claim), shared
+    among the workers currently active
+    """
+    jobs = job_queue.batch_jobs(batch_id) if jobs is None else jobs
+    pending = [j for j in jobs if j["status"] not in FINISHED]
+    if not pending:
+        return 0.0
+    now = time.time()
+    ahead = job_queue.backlog_seconds(until=max(job_queue.aged_cost(j, now) for j in pending))
+    return ahead / max(1, job_queue.active_workers())
+
+def queued_timeline(name, batch_id):
+    """Playback clock of a queue-mode session's batch, for its stream"""
+    batch = job_queue.latest_batch(group=name)
+    if batch is None or batch["id"] != batch_id:
+        return None
+    jobs = job_queue.batch_jobs(batch["id"])
+    done = [j for j in jobs if j["status"] == DONE]
+    complete = bool(done) and all(j["status"] in FINISHED for j in jobs)
+    duration = batch["meta"]["duration"]
+    return {
+        "start": max(j["updated"] for j in jobs) if complete else None,
+        "step": crossfade_step(duration, SESSION_CROSSFADE),
+        "duration": duration,
+        "tunes": [os.path.join(TUNE_DIR, j["result"]["file"]) for j in done] if complete else []
+    }
+
+# ---------------- named sessions ----------------
+@app.route("/sessions", methods=["GET"])
+def list_sessions():
+    if job_queue is not None:
+        found = [{"session": b["meta"].get("session"), "duration": b["meta"]["duration"], "created": b["created"]}
+                 for b in job_queue.open_batches() if b["meta"].get("session")]
+    else:
+        found = [s.summary(LISTENER_TIMEOUT) for s in sessions.all()]
+    return jsonify({"sessions": found})
+
+@app.route("/sessions", methods=["POST"])
+def create_session():
+    data = _request_data()
+    try:
+        duration = int(data.get("duration", 15))
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "duration must be a whole number of seconds"}), 400
+    return start_session(data.get("name") or uuid.uuid4().hex[:8], duration)
+
+@app.route("/sessions/<name>", methods=["GET"])
+def get_session(name):
+    response_data = session_status(name, request.args.get("listener"))
+    return jsonify(response_data), 200 if response_data["running"] else 404
+
+@app.route("/sessions/<name>/join", methods=["POST"])
+def join_session(name):
+    if job_queue is not None:
+        # Queue-mode sessions live in the shared queue; listeners aren't tracked
+        response_data = queued_status(name)
+        listener = None
+    else:
+        session = sessions.get(name)
+        listener = session.join() if session else None
+        response_data = session_status(name, listener)
+    if not response_data["running"]:
+        return jsonify({"status": "error", "message": f"No session '{name}'"}), 404
+    return jsonify({"status": "joined", "listener": listener, **response_data})
+
+@app.route("/sessions/<name>/leave", methods=["POST"])
+def leave_session(name):
+    session = sessions.get(name) if job_queue is None else None
+    if session is not None:
+        session.leave(_request_data().get("listener") or request.args.get("listener"))
+    return jsonify({"status": "left"})
+
+@app.route("/sessions/<name>", methods=["DELETE"])
+def delete_session(name):
+    if not expire_session(name):
+        return jsonify({"status": "error", "message": f"No session '{name}'"}), 404
+    return jsonify({"status": "expired", "session": name})
+
+@app.route("/stream")
+@app.route("/sessions/<name>/stream")
+def stream_session(name=None):
+    """
+    The session's tunes, crossfaded on the server into one endless MP3
+    stream. Every listener of a session shares one mixer and encoder, so
+    each tune is read and encoded once however many are listening; the
+    stream follows the same clock as /status.
+    """
+    name = name or _session_name()
+    if job_queue is not None:
+        batch = job_queue.latest_batch(group=name)
+        if batch is None:
+            return jsonify({"status": "error", "message": f"No session '{name}'"}), 404
+        key = batch["id"]
+        timeline = lambda: queued_timeline(name, key)
+    else:
+        session = sessions.get(name)
+        if session is None:
+            return jsonify({"status": "error", "message": f"No session '{name}'"}), 404
+        key = session.owner
+
+        def timeline():
+            # A playing stream keeps its session alive
+            if sessions.get(name) is not session:
+                return None
+            session.touch()
+            found = session.timeline()
+            if found:
+                found["tunes"] = [os.path.join(TUNE_DIR, t) for t in found["tunes"]]
+            return found
+
+    stream = streams.stream(key, timeline)
+    return Response(stream.listen(), mimetype=stream.mimetype, headers={"Cache-Control": "no-store"})
+
+def image_urls(image):
+    """Immutable display/thumbnail URLs for an image in IMAGE_DIR"""
+    fmt = pick_format(request)
+    digest = derivatives.source_hash(os.path.join(IMAGE_DIR, image))
+    return {"image_url": derivatives.url(digest, "display", fmt), "thumb_url": derivatives.url(digest, "thumb", fmt)}
 
 @app.route("/image/<filename>")
 def get_image(filename):
+    # ?size=thumb|display serves a resized copy; prefer the immutable
+    # /images/... URLs from /status, which browsers can cache for good
+    size = request.args.get("size")
     try:
+        if size in SIZES:
+            _, path = derivatives.get(os.path.join(IMAGE_DIR, os.path.basename(filename)), size, pick_format(request))
+            return send_from_directory(os.path.dirname(path), os.path.basename(path))
         return send_from_directory(IMAGE_DIR, filename)
     except FileNotFoundError:
         return jsonify({"error": "Image not found"}), 404
+    except ValueError:
+        return jsonify({"error": "Unsupported or corrupt image"}), 415
+
+@app.route("/images/<digest>/<name>")
+def get_image_derivative(digest, name):
+    return derivatives.response(digest, name)
 
 @app.route("/tune/<filename>")
 def get_tune(filename):
@@ -232,18 +548,33 @@ def get_tune(filename):
     except FileNotFoundError:
         return jsonify({"error": "Tune not found"}), 404
 
+@app.route("/pool")
+def pool_status():
+    return jsonify(pool.stats())
+
+@app.route("/metrics")
+def metrics():
+    return metrics_response()
+
+@app.route("/profiles")
+@app.route("/profiles/<name>")
+def profiles(name=None):
+    return profiles_response(name)
+
 # Health check endpoint
 @app.route("/health")
 def health():
     return jsonify({
         "status": "healthy",
         "timestamp": time.time(),
-        "running": running,
-        "processed": processed,
-        "total_images": len(selected_images)
+        "sessions": [s.summary(LISTENER_TIMEOUT) for s in sessions.all()],
+        "pool": pool.stats(),
+        "admission": start_admission.stats(),
+        "job_queue": job_queue.counts() if job_queue is not None else None
     })
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     print("Starting Harmonium Server...")
     print(f"Image directory: {IMAGE_DIR}")
     print(f"Tune directory: {TUNE_DIR}")
@@ -254,5 +585,12 @@ if __name__ == "__main__":
         print(f"Found {image_count} images in {IMAGE_DIR}")
     else:
         print(f"Warning: {IMAGE_DIR} directory not found!")
+
+    # With the debug reloader only the serving child should pre-generate;
+    # with a shared job queue the workers do all rendering
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true" and job_queue is None:
+        pool.start()
+    if job_queue is not None:
+        print(f"Using shared job queue {JOB_QUEUE_PATH}; start worker.py processes to render")
     
     app.run(debug=True, threaded=True, host='0.0.0.0', port=5000)
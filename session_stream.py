@@ -0,0 +1,344 @@
+# session_stream.py
+
+import collections
+import concurrent.futures
+import logging
+import math
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+logger = logging.getLogger(__name__)
+
+# The rate of the enhanced renders (dataset_2 is 48 kHz), so the default
+# engine's tunes are streamed without resampling
+STREAM_RATE = int(os.environ.get("STREAM_RATE", 48000))
+STREAM_CHANNELS = 2
+# Audio is mixed and encoded in blocks of STREAM_BLOCK_S, running up to
+# STREAM_LEAD_S ahead of the wall clock so encoding never starves a
+# listener. A new listener first gets the last STREAM_PREBUFFER_S of audio.
+STREAM_BLOCK_S = 0.5
+STREAM_LEAD_S = 1.0
+STREAM_PREBUFFER_S = float(os.environ.get("STREAM_PREBUFFER_S", 3.0))
+# Blocks a listener may fall behind before it is dropped
+STREAM_LISTENER_BACKLOG = 32
+# A stream with no listeners for this long stops its thread
+STREAM_IDLE_S = float(os.environ.get("STREAM_IDLE_S", 10.0))
+# Decoded tunes kept per stream: the two that can overlap, plus the next,
+# which is decoded ahead of time on a loader thread
+TUNE_CACHE_SIZE = 3
+
+# Constant bitrate, so every listener costs the same bandwidth and players
+# that estimate the length from the bitrate get it right; 0 is the highest
+# quality (320 kbit/s), 0.7 about 112 kbit/s
+STREAM_COMPRESSION = float(os.environ.get("STREAM_COMPRESSION", 0.7))
+STREAM_FORMATS = {
+    "mp3": ("audio/mpeg", dict(format="MP3", subtype="MPEG_LAYER_III",
+                               bitrate_mode="CONSTANT", compression_level=STREAM_COMPRESSION)),
+    "opus": ("audio/ogg", dict(format="OGG", subtype="OPUS")),
+}
+DEFAULT_STREAM_FORMAT = os.environ.get("STREAM_FORMAT", "mp3")
+
+
+def stream_formats():
+    """
+    Formats this libsndfile can encode.
+    """
+    available = sf.available_formats()
+    return [name for name, (_, kw) in STREAM_FORMATS.items()
+            if kw["format"] in available and kw["subtype"] in sf.available_subtypes(kw["format"])]
+
+
+class _Sink:
+    """
+    Write-only file object for libsndfile that hands out newly appended
+    bytes. Rewrites of bytes already sent (header updates at close) are
+    dropped, as a stream cannot take them back.
+    """
+
+    def __init__(self):
+        self.pos = 0
+        self.end = 0
+        self.pending = bytearray()
+
+    def write(self, data):
+        data = bytes(data)
+        if self.pos + len(data) > self.end:
+            new = data[max(0, self.end - self.pos):]
+            self.pending += new
+            self.end += len(new)
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        self.pos = {0: offset, 1: self.pos + offset, 2: self.end + offset}[whence]
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, n=-1):
+        return b""
+
+    def take(self):
+        data, self.pending = bytes(self.pending), bytearray()
+        return data
+
+
+class StreamEncoder:
+    """
+    Incremental encoder: float32 (frames × channels) blocks in, compressed
+    bytes out.
+    """
+
+    def __init__(self, fmt=DEFAULT_STREAM_FORMAT, samplerate=STREAM_RATE, channels=STREAM_CHANNELS):
+        self.mimetype, kw = STREAM_FORMATS[fmt]
+        self._sink = _Sink()
+        self._file = sf.SoundFile(self._sink, "w", samplerate=samplerate, channels=channels, **kw)
+
+    def encode(self, block):
+        self._file.write(block)
+        return self._sink.take()
+
+    def close(self):
+        self._file.close()
+        return self._sink.take()
+
+
+def load_tune(path, samplerate=STREAM_RATE, channels=STREAM_CHANNELS):
+    """
+    A rendered tune as float32 (frames × channels) at the stream format.
+    """
+    audio, sr = sf.read(path, dtype="float32", always_2d=True)
+    if sr != samplerate:
+        g = math.gcd(sr, samplerate)
+        audio = resample_poly(audio, samplerate // g, sr // g, axis=0).astype(np.float32)
+    if audio.shape[1] < channels:
+        audio = np.repeat(audio[:, :1], channels, axis=1)
+    return np.ascontiguousarray(audio[:, :channels])
+
+
+class SessionStream:
+    """
+    One continuous audio stream for a session, shared by all its listeners.
+
+    `timeline()` describes the session's playback clock: None once the
+    session is gone, otherwise a dict with "start" (wall-clock start of
+    playback, None while tunes are still rendering), "step" (seconds
+    between tune starts), "duration" (tune length) and "tunes" (file
+    paths in play order). Tune k starts at start + k·step; consecutive
+    tunes overlap by duration − step with an equal-power crossfade, so the
+    stream follows the same clock as /status.
+
+    A single thread mixes, encodes and paces the stream in real time; every
+    tune is read once per play and every block encoded once, whatever the
+    number of listeners. Tunes are decoded on a loader thread ahead of
+    their turn, so the mixer never waits on a read; a tune that is not
+    ready yet is skipped as silence. Silence is sent until playback starts.
+    """
+
+    def __init__(self, name, timeline, fmt=DEFAULT_STREAM_FORMAT, on_stop=None):
+        self.name = name
+        self.timeline = timeline
+        self.fmt = fmt
+        self.mimetype = STREAM_FORMATS[fmt][0]
+        self.on_stop = on_stop
+        self._lock = threading.Lock()
+        self._listeners = set()
+        self._recent = collections.deque(maxlen=max(1, math.ceil(STREAM_PREBUFFER_S / STREAM_BLOCK_S)))
+        self._tunes = collections.OrderedDict()   # path → Future of decoded audio
+        self._loader = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"stream-{name}-load")
+        self._stopped = threading.Event()
+        self._idle_since = time.time()
+        self._thread = threading.Thread(target=self._run, name=f"stream-{name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def listener_count(self):
+        with self._lock:
+            return len(self._listeners)
+
+    # ---------------- listeners ----------------
+    def listen(self):
+        """
+        Generator of encoded audio for one listener (a Flask response body).
+        """
+        q = queue.Queue(maxsize=STREAM_LISTENER_BACKLOG)
+        with self._lock:
+            if self.stopped:
+                return
+            for chunk in self._recent:
+                q.put_nowait(chunk)
+            self._listeners.add(q)
+        try:
+            while True:
+                try:
+                    chunk = q.get(timeout=STREAM_IDLE_S)
+                except queue.Empty:
+                    # A stalled producer is not a reason to hang up; a
+                    # stopped one sends None
+                    if self.stopped:
+                        return
+                    continue
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            with self._lock:
+                self._listeners.discard(q)
+                if not self._listeners:
+                    self._idle_since = time.time()
+
+    def _publish(self, chunk):
+        with self._lock:
+            self._recent.append(chunk)
+            for q in list(self._listeners):
+                try:
+                    q.put_nowait(chunk)
+                except queue.Full:
+                    # Too slow to keep up with real time: drop it rather
+                    # than hold everyone else back
+                    self._listeners.discard(q)
+                    logger.info("🐢 Dropped a slow listener from stream %s", self.name)
+
+    # ---------------- mixing ----------------
+    def _load(self, path):
+        try:
+            return load_tune(path)
+        except (OSError, RuntimeError, ValueError) as e:
+            logger.warning("⚠️ Stream %s can't read %s: %s", self.name, path, e)
+            return np.zeros((0, STREAM_CHANNELS), dtype=np.float32)
+
+    def _tune(self, path):
+        """
+        The decoded tune, or None while the loader is still on it.
+        """
+        future = self._tunes.get(path)
+        if future is None:
+            future = self._tunes[path] = self._loader.submit(self._load, path)
+            while len(self._tunes) > TUNE_CACHE_SIZE:
+                self._tunes.popitem(last=False)[1].cancel()
+        else:
+            self._tunes.move_to_end(path)
+        return future.result() if future.done() and not future.cancelled() else None
+
+    def _mix(self, tl, t0, frames):
+        """
+        `frames` of audio from `t0` seconds after playback start.
+        """
+        out = np.zeros((frames, STREAM_CHANNELS), dtype=np.float32)
+        tunes, step, duration = tl["tunes"], tl["step"], tl["duration"]
+        fade = max(0.0, duration - step)
+        times = t0 + np.arange(frames) / STREAM_RATE
+        first = max(0, math.floor((times[0] - duration) / step) + 1)
+        last = math.floor(times[-1] / step)
+        for k in range(first, last + 1):
+            local = times - k * step
+            mask = (local >= 0) & (local < duration)
+            if not mask.any():
+                continue
+            audio = self._tune(tunes[k % len(tunes)])
+            if audio is None:
+                continue
+            pos = local[mask]
+            idx = (pos * STREAM_RATE).astype(np.int64)
+            ok = idx < len(audio)
+            gain = np.ones(len(pos), dtype=np.float32)
+            if fade > 0:
+                gain *= np.where(pos < fade, np.sin(0.5 * np.pi * np.clip(pos / fade, 0, 1)), 1.0)
+                tail = pos - (duration - fade)
+                gain *= np.where(tail > 0, np.cos(0.5 * np.pi * np.clip(tail / fade, 0, 1)), 1.0)
+            rows = np.flatnonzero(mask)[ok]
+            out[rows] += audio[idx[ok]] * gain[ok, np.newaxis]
+        # Start decoding the next tune well before it comes in
+        self._tune(tunes[(last + 1) % len(tunes)])
+        np.clip(out, -1.0, 1.0, out=out)
+        return out
+
+    # ---------------- producer ----------------
+    def _run(self):
+        frames = int(STREAM_BLOCK_S * STREAM_RATE)
+        encoder = StreamEncoder(self.fmt)
+        next_wall = time.time()
+        try:
+            while True:
+                with self._lock:
+                    idle = not self._listeners and time.time() - self._idle_since > STREAM_IDLE_S
+                if idle:
+                    break
+                tl = self.timeline()
+                if tl is None:
+                    break
+                now = time.time()
+                if next_wall > now + STREAM_LEAD_S:
+                    time.sleep(next_wall - now - STREAM_LEAD_S)
+                elif next_wall < now - STREAM_LEAD_S:
+                    # Fell behind (e.g. a stalled read): skip ahead instead
+                    # of bursting old audio
+                    next_wall = now
+                if tl["start"] is None and tl["tunes"]:
+                    # Decode the opening tune while the batch still renders
+                    self._tune(tl["tunes"][0])
+                if tl["start"] is None or not tl["tunes"]:
+                    block = np.zeros((frames, STREAM_CHANNELS), dtype=np.float32)
+                else:
+                    block = self._mix(tl, next_wall - tl["start"], frames)
+                next_wall += STREAM_BLOCK_S
+                chunk = encoder.encode(block)
+                if chunk:
+                    self._publish(chunk)
+        except Exception:
+            logger.exception("Stream %s failed", self.name)
+        finally:
+            self._stopped.set()
+            with self._lock:
+                for q in self._listeners:
+                    try:
+                        q.put_nowait(None)
+                    except queue.Full:
+                        pass
+                self._listeners.clear()
+            self._loader.shutdown(wait=False, cancel_futures=True)
+            try:
+                encoder.close()
+            except RuntimeError:
+                pass
+            if self.on_stop:
+                self.on_stop(self)
+
+
+class StreamHub:
+    """
+    The running SessionStream of each session (by a key unique to the
+    session, not its reusable name), started by its first listener and
+    dropped when it stops.
+    """
+
+    def __init__(self, fmt=DEFAULT_STREAM_FORMAT):
+        self.fmt = fmt
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def stream(self, key, timeline):
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None or stream.stopped:
+                stream = self._streams[key] = SessionStream(key, timeline, self.fmt, on_stop=self._forget)
+            return stream
+
+    def _forget(self, stream):
+        with self._lock:
+            if self._streams.get(stream.name) is stream:
+                del self._streams[stream.name]
+
+    def listener_count(self):
+        with self._lock:
+            return sum(s.listener_count() for s in self._streams.values())
@@ -0,0 +1,223 @@
+# sessions.py
+
+import re
+import threading
+import time
+import uuid
+
+SESSION_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def crossfade_step(duration, crossfade):
+    """
+    Seconds between tune starts when consecutive tunes overlap by
+    `crossfade` (at most half a tune).
+    """
+    return duration - min(max(0.0, crossfade), duration / 2)
+
+
+class SessionExists(Exception):
+    """
+    Raised when creating a session under a name that is already taken.
+    """
+
+
+class SessionLimit(Exception):
+    """
+    Raised when creating a session would exceed the registry's limit.
+    """
+
+
+class Session:
+    """
+    One named listening session: a batch of images, the tune rendered for
+    each, and a playback clock shared by every listener attached to it.
+
+    The clock is a start time and a step between tune starts (the tune
+    duration less the `crossfade` consecutive tunes overlap by), so a
+    listener's position is plain arithmetic on the current time (see
+    playback()); polls never change the session's state.
+    """
+
+    def __init__(self, name, duration, crossfade=0.0):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.duration = duration
+        self.step = crossfade_step(duration, crossfade)
+        self.created = time.time()
+        self.lock = threading.Lock()
+        self.running = True
+        self.processed = 0
+        self.images = []             # selected images
+        self.tunes = []              # pool tune file for each image (None until rendered)
+        self.generation_complete = False
+        self.playback_start_time = 0
+        self.progress_at = self.created  # when the last tune finished rendering
+        self.listeners = {}          # listener id → last seen
+        self.last_active = self.created
+
+    @property
+    def owner(self):
+        """
+        Tune pool owner name for this session's claimed tunes.
+        """
+        return "session:" + self.id
+
+    # ---------------- listeners ----------------
+    def join(self):
+        listener = uuid.uuid4().hex[:12]
+        self.touch(listener)
+        return listener
+
+    def leave(self, listener):
+        with self.lock:
+            self.listeners.pop(listener, None)
+
+    def touch(self, listener=None):
+        now = time.time()
+        with self.lock:
+            self.last_active = now
+            if listener:
+                self.listeners[listener] = now
+
+    def listener_count(self, timeout):
+        cutoff = time.time() - timeout
+        with self.lock:
+            for listener, seen in list(self.listeners.items()):
+                if seen < cutoff:
+                    del self.listeners[listener]
+            return len(self.listeners)
+
+    # ---------------- playback ----------------
+    def start_playback(self):
+        """
+        Keep the images that got a tune and start the clock. Call with
+        `lock` held.
+        """
+        pairs = [(img, t) for img, t in zip(self.images, self.tunes) if t]
+        self.images = [img for img, _ in pairs]
+        self.tunes = [t for _, t in pairs]
+        if self.running and self.tunes:
+            self.generation_complete = True
+            self.playback_start_time = time.time()
+
+    def playback(self, now=None):
+        """
+        Which tune is playing and how far into it, or None before playback.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            if not (self.running and self.generation_complete and self.tunes):
+                return None
+            since = max(0.0, now - self.playback_start_time)
+            index = int(since // self.step) % len(self.tunes)
+            into = since % self.step
+            return {
+                "image": self.images[index],
+                "tune": self.tunes[index],
+                "index": index,
+                "remaining": max(0.0, self.step - into),
+                "progress": into / self.step
+            }
+
+    def timeline(self):
+        """
+        The playback clock for a session stream (see session_stream), or
+        None once the session has ended.
+        """
+        with self.lock:
+            if not self.running:
+                return None
+            playing = self.generation_complete and bool(self.tunes)
+            return {
+                "start": self.playback_start_time if playing else None,
+                "step": self.step,
+                "duration": self.duration,
+                "tunes": list(self.tunes) if playing else []
+            }
+
+    def summary(self, listener_timeout):
+        return {
+            "session": self.name,
+            "duration": self.duration,
+            "created": self.created,
+            "running": self.running,
+            "count": self.processed,
+            "total_images": len(self.images),
+            "generation_complete": self.generation_complete,
+            "listeners": self.listener_count(listener_timeout)
+        }
+
+
+class SessionRegistry:
+    """
+    Named sessions, created, joined and expired explicitly.
+
+    A session nobody has polled for `idle_timeout` seconds expires as well,
+    so abandoned sessions don't keep their tunes claimed. Expiry runs
+    `on_expire(session)` outside the registry lock. Sessions' tunes overlap
+    by `crossfade` seconds.
+    """
+
+    def __init__(self, max_sessions=8, idle_timeout=900.0, listener_timeout=30.0, on_expire=None, crossfade=0.0):
+        self.max_sessions = max_sessions
+        self.crossfade = crossfade
+        self.idle_timeout = idle_timeout
+        self.listener_timeout = listener_timeout
+        self.on_expire = on_expire
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def create(self, name, duration):
+        """
+        Raises:
+            ValueError: Invalid name.
+            SessionExists: The name is taken by a live session.
+            SessionLimit: max_sessions are already live.
+        """
+        if not SESSION_NAME_RE.match(name):
+            raise ValueError("Session names are 1-64 letters, digits, '-' or '_'")
+        self.reap()
+        with self._lock:
+            if name in self._sessions:
+                raise SessionExists(name)
+            if len(self._sessions) >= self.max_sessions:
+                raise SessionLimit(f"At most {self.max_sessions} sessions can run at once")
+            session = self._sessions[name] = Session(name, duration, self.crossfade)
+            return session
+
+    def get(self, name):
+        self.reap()
+        with self._lock:
+            return self._sessions.get(name)
+
+    def all(self):
+        self.reap()
+        with self._lock:
+            return list(self._sessions.values())
+
+    def expire(self, name, session=None):
+        """
+        Stop and forget a session (only `session` itself, if given).
+
+        Returns:
+            The expired session, or None.
+        """
+        with self._lock:
+            current = self._sessions.get(name)
+            if current is None or (session is not None and current is not session):
+                return None
+            del self._sessions[name]
+        with current.lock:
+            current.running = False
+            current.generation_complete = False
+        if self.on_expire:
+            self.on_expire(current)
+        return current
+
+    def reap(self):
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            idle = [s for s in self._sessions.values() if s.last_active < cutoff]
+        for session in idle:
+            self.expire(session.name, session)
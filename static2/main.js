@@ -16,6 +16,7 @@ let isTransitioning = false
 
 // Synchronization state
 let pendingImageFile = null
+let pendingImageUrl = null
 let pendingTuneFile = null
 let waitingForAudioEnd = false
 
@@ -24,6 +25,23 @@ let totalImages = 0
 let generationComplete = false
 let tuneDuration = 15 // Default duration, will be updated from user input
 
+// Shared session: open the page with ?session=<name> to listen along with
+// everyone else on that session (the server's default session otherwise)
+const sessionName = new URLSearchParams(window.location.search).get("session")
+let listenerId = null
+
+// Stream mode (?stream=1): play the session as one continuous stream that
+// the server crossfades, and use /status only to follow the images
+const streamMode = new URLSearchParams(window.location.search).get("stream") === "1"
+
+function sessionQuery() {
+  const params = new URLSearchParams()
+  if (sessionName) params.set("session", sessionName)
+  if (listenerId) params.set("listener", listenerId)
+  const query = params.toString()
+  return query ? `?${query}` : ""
+}
+
 // DOM elements
 const elements = {
   startBtn: document.getElementById("startBtn"),
@@ -292,6 +310,42 @@ async function setupAudio(audioSrc) {
   }
 }
 
+// One <audio> element on the session stream; it never changes track
+async function setupStream() {
+  if (isTransitioning) return
+
+  isTransitioning = true
+  audioLoading = true
+  updatePlayPauseButton()
+
+  const audio = new Audio()
+  audio.preload = "auto"
+  audio.src = `/stream${sessionQuery()}`
+  audio.addEventListener("play", handleAudioPlay)
+  audio.addEventListener("pause", handleAudioPause)
+  audio.addEventListener("ended", handleAudioEnded)
+  currentAudio = audio
+
+  try {
+    await new Promise((resolve, reject) => {
+      audio.addEventListener("canplay", resolve, { once: true })
+      audio.addEventListener("error", reject, { once: true })
+      audio.load()
+    })
+    audioLoading = false
+    isTransitioning = false
+    updatePlayPauseButton()
+    await fadeIn(audio, 1000)
+  } catch (error) {
+    console.error("Stream setup error:", error)
+    audioLoading = false
+    isTransitioning = false
+    currentAudio = null
+    updatePlayPauseButton()
+    showError("Failed to load audio stream")
+  }
+}
+
 // Audio event handlers with synchronization logic
 function handleAudioPlay() {
   isPlaying = true
@@ -317,7 +371,7 @@ function handleAudioEnded() {
     currentImageFile = pendingImageFile
     currentTuneFile = pendingTuneFile
     
-    const imgSrc = `/image/${pendingImageFile}?${Date.now()}`
+    const imgSrc = imageSource(pendingImageFile, pendingImageUrl)
     const tuneSrc = `/tune/${pendingTuneFile}?${Date.now()}`
     
     // Setup image and audio simultaneously
@@ -351,6 +405,12 @@ function handleImageError() {
   showError("Failed to load image")
 }
 
+// Display-size copy from /status (an immutable URL the browser can cache);
+// the original file as a fallback
+function imageSource(imageFile, imageUrl) {
+  return imageUrl || `/image/${imageFile}?${Date.now()}`
+}
+
 function setupImage(imageSrc) {
   imageLoading = true
   elements.imageLoader.classList.remove("hidden")
@@ -372,7 +432,7 @@ async function startGeneration() {
     const response = await fetch("/start", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ duration }),
+      body: JSON.stringify(sessionName ? { duration, session: sessionName } : { duration }),
     })
 
     if (!response.ok) {
@@ -384,6 +444,7 @@ async function startGeneration() {
     if (result.status === "error") {
       throw new Error(result.message)
     }
+    listenerId = result.listener || null
 
     isRunning = true
     totalImages = result.selected_count || 10
@@ -404,7 +465,7 @@ async function startGeneration() {
 
 async function stopGeneration() {
   try {
-    const response = await fetch("/stop", { method: "POST" })
+    const response = await fetch(`/stop${sessionQuery()}`, { method: "POST" })
 
     if (!response.ok) {
       throw new Error(`Server error: ${response.status}`)
@@ -446,7 +507,7 @@ async function stopGeneration() {
 
 async function updateStatus() {
   try {
-    const response = await fetch("/status")
+    const response = await fetch(`/status${sessionQuery()}`)
 
     if (!response.ok) {
       throw new Error(`Server error: ${response.status}`)
@@ -455,7 +516,7 @@ async function updateStatus() {
     const data = await response.json()
 
     // Simplified timing logic - let the audio play naturally
-    if (generationComplete && currentAudio && !currentAudio.paused) {
+    if (!streamMode && generationComplete && currentAudio && !currentAudio.paused) {
       // During audio playback, show audio time and remaining time
       const audioTime = currentAudio.currentTime || 0
       const audioDuration = currentAudio.duration || 0
@@ -471,6 +532,19 @@ async function updateStatus() {
     // Update count
     elements.count.textContent = `${data.count}/${data.total_images || totalImages}`
 
+    // The server ended the batch without a single tune (every render failed)
+    if (data.running === false && isRunning && !generationComplete) {
+      if (intervalId) {
+        clearInterval(intervalId)
+        intervalId = null
+      }
+      isRunning = false
+      updateButtonStates()
+      showLoading(false)
+      showError("No tunes could be generated. Please try again.")
+      return
+    }
+
     // Update generation status
     if (data.generation_complete && !generationComplete) {
       generationComplete = true
@@ -487,12 +561,22 @@ async function updateStatus() {
       elements.mainContent.classList.remove("hidden")
       elements.welcomeMessage.classList.add("hidden")
 
-      // If this is the first image/tune or no audio is currently playing
-      if (!currentImageFile || !currentTuneFile || !isPlaying) {
+      if (streamMode) {
+        // The stream crossfades on the server clock; just follow the images
+        if (imageChanged) {
+          currentImageFile = data.image
+          setupImage(imageSource(data.image, data.image_url))
+        }
+        currentTuneFile = data.tune
+        if (!currentAudio) {
+          await setupStream()
+        }
+      } else if (!currentImageFile || !currentTuneFile || !isPlaying) {
+        // First image/tune, or no audio is currently playing
         // Update immediately for the first track or when nothing is playing
         if (imageChanged) {
           currentImageFile = data.image
-          const imgSrc = `/image/${data.image}?${Date.now()}`
+          const imgSrc = imageSource(data.image, data.image_url)
           setupImage(imgSrc)
         }
 
@@ -504,6 +588,7 @@ async function updateStatus() {
       } else if ((imageChanged || tuneChanged) && isPlaying) {
         // If audio is playing and we have new content, wait for current audio to end
         pendingImageFile = data.image
+        pendingImageUrl = data.image_url || null
         pendingTuneFile = data.tune
         waitingForAudioEnd = true
         
@@ -521,7 +606,8 @@ async function updateStatus() {
 
     // Show loading during generation phase
     if (!data.generation_complete && isRunning) {
-      showLoading(true, `Generating tunes... (${data.count}/${data.total_images || totalImages} complete)`)
+      const eta = data.eta ? `, about ${Math.ceil(data.eta)}s left` : ""
+      showLoading(true, `Generating tunes... (${data.count}/${data.total_images || totalImages} complete${eta})`)
     }
   } catch (error) {
     console.error("Status update error:", error)
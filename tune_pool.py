@@ -0,0 +1,392 @@
+# tune_pool.py
+
+import collections
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from utils.metrics import CACHE_HITS, CACHE_MISSES
+
+try:
+    import fcntl
+except ImportError:                           # Windows: one pool process per tune directory
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+MANIFEST_NAME = "pool_manifest.json"
+# {image stem}__{duration}s__{token}.wav, plus optional sidecars such as .mid
+POOL_FILE_RE = re.compile(r"^(?P<stem>.+)__(?P<duration>\d+)s__(?P<token>[0-9a-f]{8})(?P<ext>\.wav|\.mid)$")
+SIDECAR_EXTENSIONS = (".mid",)
+# Temp files of renders (<tune>.part.wav, <tune>.part.mid). Those left by a
+# crash are swept at startup once this old; younger ones may belong to a
+# render still running in another process that shares the directory.
+PART_FILE_RE = re.compile(r"\.part\.[a-z0-9]+$")
+STALE_PART_SECONDS = 3600
+# Released owners remembered so a render that finishes after its owner
+# let go does not claim the tune for good
+RELEASED_OWNERS_KEPT = 1024
+
+
+def sidecar_path(path, ext):
+    """
+    Path of the `ext` file that accompanies a pool tune (or its temp file).
+    """
+    return os.path.splitext(path)[0] + ext
+
+
+class TunePool:
+    """
+    Rolling pool of pre-rendered tunes for the images in `image_dir`.
+
+    A background thread keeps up to `variants_per_image` unplayed tunes per
+    image and duration. Every tune is listed in a JSON manifest next to the
+    audio files. When the files exceed `budget_bytes`, the least recently
+    used tunes are deleted, starting with ones that have already been played.
+
+    Several processes (e.g. gunicorn workers) may share one `tune_dir`: the
+    manifest is only changed under an exclusive lock on a file next to it,
+    after merging in what the other processes wrote, so each sees the
+    tunes the others render and evict. Claims (take()) stay per process.
+    """
+
+    def __init__(self, image_dir, tune_dir, render_fn, durations=(15,),
+                 budget_bytes=500 * 1024 * 1024, variants_per_image=1,
+                 idle_interval=5.0):
+        self.image_dir = image_dir
+        self.tune_dir = tune_dir
+        self.render_fn = render_fn            # render_fn(image_path, duration, output_path) -> bool
+        self.durations = tuple(int(d) for d in durations)
+        self.budget_bytes = int(budget_bytes)
+        self.variants_per_image = variants_per_image
+        self.idle_interval = idle_interval
+        self.manifest_path = os.path.join(tune_dir, MANIFEST_NAME)
+        self.lock_path = self.manifest_path + ".lock"
+
+        self._lock = threading.Lock()
+        self._entries = {}                    # file name → entry dict
+        self._in_use = {}                     # owner → set of file names
+        self._released = collections.OrderedDict()  # recently released owners
+        self._foreground = 0                  # active foreground renders
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        os.makedirs(tune_dir, exist_ok=True)
+        self._load_manifest()
+
+    # ---------------- manifest ----------------
+    def _load_manifest(self):
+        with self._shared():
+            # Delete pool files nobody lists (a tune is listed in the same
+            # locked step that moves it into place) and stale temp files
+            now = time.time()
+            for fn in os.listdir(self.tune_dir):
+                path = os.path.join(self.tune_dir, fn)
+                if POOL_FILE_RE.match(fn) and sidecar_path(fn, ".wav") not in self._entries:
+                    os.remove(path)
+                elif PART_FILE_RE.search(fn):
+                    try:
+                        if now - os.path.getmtime(path) > STALE_PART_SECONDS:
+                            os.remove(path)
+                    except FileNotFoundError:
+                        pass                  # finished meanwhile
+
+    @contextmanager
+    def _shared(self):
+        """
+        Hold the pool lock and the manifest file lock, with the entries
+        merged from the manifest on entry and saved back on exit.
+        """
+        with self._lock, open(self.lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # released when the file closes
+            self._merge_manifest_locked()
+            yield
+            self._save_manifest()
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                return {e["file"]: e for e in json.load(f).get("entries", [])}
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("⚠️ Ignoring unreadable pool manifest: %s", e)
+            return {}
+
+    def _merge_manifest_locked(self):
+        """
+        Combine the stored entries with ours: tunes rendered by either side
+        are kept, tunes evicted by either side (their audio is gone) are
+        dropped, and play counts and last use take the larger value.
+        """
+        merged = self._read_manifest()
+        for name, mine in self._entries.items():
+            stored = merged.get(name)
+            if stored is None:
+                merged[name] = mine
+            else:
+                stored["plays"] = max(stored["plays"], mine["plays"])
+                stored["last_used"] = max(stored["last_used"], mine["last_used"])
+        self._entries = {
+            name: e for name, e in merged.items()
+            if os.path.exists(os.path.join(self.tune_dir, name))
+        }
+
+    def _save_manifest(self):
+        data = {
+            "version": 1,
+            "budget_bytes": self.budget_bytes,
+            "entries": sorted(self._entries.values(), key=lambda e: e["created"])
+        }
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    # ---------------- images ----------------
+    def list_images(self):
+        try:
+            return sorted(
+                f for f in os.listdir(self.image_dir)
+                if f.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        except FileNotFoundError:
+            return []
+
+    # ---------------- rendering ----------------
+    def render(self, image_name, duration, owner=None):
+        """
+        Render one tune into the pool and return its entry, or None on failure.
+
+        render_fn may also write sidecar files (e.g. a .mid) next to its
+        output; they are kept, counted and evicted together with the tune.
+        With `owner`, the new tune is claimed for that owner straight away
+        (as take() would) so it cannot be evicted before it is played,
+        unless the owner was released while the render ran.
+        """
+        duration = int(duration)
+        stem = os.path.splitext(image_name)[0]
+        name = f"{stem}__{duration}s__{uuid.uuid4().hex[:8]}.wav"
+        path = os.path.join(self.tune_dir, name)
+        tmp = path + ".part.wav"
+
+        if not self.render_fn(os.path.join(self.image_dir, image_name), duration, tmp):
+            for leftover in [tmp] + [sidecar_path(tmp, ext) for ext in SIDECAR_EXTENSIONS]:
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            return None
+
+        now = time.time()
+        with self._shared():
+            # Moved into place and listed in one step, so another process's
+            # startup sweep never sees the tune unlisted
+            os.replace(tmp, path)
+            sidecars = []
+            for ext in SIDECAR_EXTENSIONS:
+                if os.path.exists(sidecar_path(tmp, ext)):
+                    os.replace(sidecar_path(tmp, ext), sidecar_path(path, ext))
+                    sidecars.append(sidecar_path(name, ext))
+            if owner in self._released:
+                owner = None
+            entry = {
+                "file": name,
+                "image": image_name,
+                "duration": duration,
+                "size": sum(os.path.getsize(os.path.join(self.tune_dir, f)) for f in [name] + sidecars),
+                "sidecars": sidecars,
+                "created": now,
+                "last_used": now,
+                "plays": 0 if owner is None else 1
+            }
+            self._entries[name] = entry
+            if owner is not None:
+                self._in_use.setdefault(owner, set()).add(name)
+            self._evict_locked(protect={name})
+        return dict(entry)
+
+    @contextmanager
+    def foreground(self):
+        """
+        Pause pre-generation while a listener is waiting on a cold render.
+        """
+        with self._lock:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+            self._wake.set()
+
+    # ---------------- sessions ----------------
+    def take(self, count, duration, owner="default"):
+        """
+        Claim up to `count` ready tunes of `duration`, one per image.
+
+        Unplayed tunes are preferred; claimed tunes are marked as used and
+        protected from eviction until release(owner) is called.
+        """
+        duration = int(duration)
+        with self._shared():
+            busy = set().union(*self._in_use.values()) if self._in_use else set()
+            ready = [
+                e for e in self._entries.values()
+                if e["duration"] == duration and e["file"] not in busy
+            ]
+            random.shuffle(ready)
+            ready.sort(key=lambda e: e["plays"])
+
+            picked, images = [], set()
+            for e in ready:
+                if e["image"] in images:
+                    continue
+                picked.append(e)
+                images.add(e["image"])
+                if len(picked) == count:
+                    break
+
+            now = time.time()
+            for e in picked:
+                e["plays"] += 1
+                e["last_used"] = now
+            self._in_use[owner] = {e["file"] for e in picked}
+            self._released.pop(owner, None)
+            CACHE_HITS.inc(len(picked), cache="tune_pool")
+            CACHE_MISSES.inc(count - len(picked), cache="tune_pool")
+            self._wake.set()
+            return [dict(e) for e in picked]
+
+    def release(self, owner="default"):
+        """
+        Unprotect the owner's tunes; renders still running for it will not
+        claim theirs (until the owner takes tunes again).
+        """
+        with self._lock:
+            self._in_use.pop(owner, None)
+            self._released[owner] = True
+            self._released.move_to_end(owner)
+            while len(self._released) > RELEASED_OWNERS_KEPT:
+                self._released.popitem(last=False)
+        self._wake.set()
+
+    # ---------------- eviction ----------------
+    def total_bytes(self):
+        with self._lock:
+            return sum(e["size"] for e in self._entries.values())
+
+    def _evict_locked(self, protect=(), played_only=False, budget=None):
+        """
+        Delete least recently used tunes until the pool fits `budget`
+        (defaults to the pool budget).
+
+        Returns:
+            True if the pool is within budget afterwards.
+        """
+        budget = self.budget_bytes if budget is None else budget
+        total = sum(e["size"] for e in self._entries.values())
+        if total <= budget:
+            return True
+        busy = set(protect).union(*self._in_use.values()) if self._in_use else set(protect)
+        victims = sorted(
+            (e for e in self._entries.values()
+             if e["file"] not in busy and (e["plays"] > 0 or not played_only)),
+            key=lambda e: (e["plays"] == 0, e["last_used"])
+        )
+        for e in victims:
+            if total <= budget:
+                break
+            for fn in [e["file"]] + e.get("sidecars", []):
+                try:
+                    os.remove(os.path.join(self.tune_dir, fn))
+                except FileNotFoundError:
+                    pass
+            total -= e["size"]
+            del self._entries[e["file"]]
+        return total <= budget
+
+    # ---------------- background pre-generation ----------------
+    def _average_size(self, duration):
+        sizes = [e["size"] for e in self._entries.values() if e["duration"] == duration]
+        if sizes:
+            return sum(sizes) / len(sizes)
+        return duration * 44100 * 2 * 2      # 16-bit stereo estimate
+
+    def _next_job_locked(self):
+        """
+        Pick the (image, duration) with the fewest unplayed tunes, or None
+        when every image is covered or the budget has no room left.
+        """
+        images = self.list_images()
+        if not images:
+            return None
+        for duration in self.durations:
+            unplayed = {img: 0 for img in images}
+            for e in self._entries.values():
+                if e["duration"] == duration and e["plays"] == 0 and e["image"] in unplayed:
+                    unplayed[e["image"]] += 1
+            fewest = min(unplayed.values())
+            if fewest >= self.variants_per_image:
+                continue
+
+            # Make room by dropping played tunes only; never churn fresh ones
+            room = self.budget_bytes - self._average_size(duration)
+            if not self._evict_locked(played_only=True, budget=room):
+                return None
+
+            image = random.choice([img for img, n in unplayed.items() if n == fewest])
+            return image, duration
+        return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._shared():
+                job = None if self._foreground else self._next_job_locked()
+            if job is None:
+                self._wake.wait(self.idle_interval)
+                self._wake.clear()
+                continue
+            image, duration = job
+            logger.info("🎛️ Pre-generating %ss tune for %s", duration, image)
+            if self.render(image, duration) is None:
+                # Don't spin on an image that keeps failing
+                self._stop.wait(self.idle_interval)
+
+    def start(self):
+        """
+        Start the background pre-generator (idempotent).
+        """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="tune-pool", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            ready = {}
+            for e in self._entries.values():
+                key = str(e["duration"])
+                ready.setdefault(key, {"tunes": 0, "unplayed": 0})
+                ready[key]["tunes"] += 1
+                ready[key]["unplayed"] += e["plays"] == 0
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e["size"] for e in self._entries.values()),
+                "budget_bytes": self.budget_bytes,
+                "by_duration": ready,
+                "pregenerating": bool(self._thread and self._thread.is_alive())
+            }
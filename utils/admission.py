@@ -0,0 +1,181 @@
+# utils/admission.py
+
+import collections
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.metrics import REGISTRY
+
+ADMITTED = REGISTRY.counter(
+    "harmonium_admission_admitted_total", "Requests admitted to a limited endpoint.", ("endpoint",))
+REJECTED = REGISTRY.counter(
+    "harmonium_admission_rejected_total",
+    "Requests shed by admission control (queue_full → 429, timeout → 503).", ("endpoint", "reason"))
+WAIT_SECONDS = REGISTRY.histogram(
+    "harmonium_admission_wait_seconds", "Time admitted requests spent queued.", ("endpoint",))
+
+_controllers = {}
+
+
+def _gauge_values(attr):
+    return lambda: {(name,): getattr(c, attr) for name, c in sorted(_controllers.items())}
+
+
+REGISTRY.gauge("harmonium_admission_active", "Requests currently holding a slot.",
+               ("endpoint",), callback=_gauge_values("active"))
+REGISTRY.gauge("harmonium_admission_queue_depth", "Requests waiting for a slot.",
+               ("endpoint",), callback=_gauge_values("queue_depth"))
+
+
+class Rejected(Exception):
+    """
+    Raised when a request is shed; carries the HTTP status and Retry-After.
+    """
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded FIFO wait queue.
+
+    At most `max_concurrent` requests run at once. Up to `max_queue` more
+    wait (first come, first served) for at most `queue_timeout` seconds;
+    anything beyond that is rejected straight away with 429, and requests
+    that time out in the queue get 503. Slots are handed directly to the
+    oldest waiter, so admitted requests never compete with newcomers.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue=0, queue_timeout=10.0):
+        self.name = name
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self.active = 0
+        self._waiters = collections.deque()     # one Event per queued request
+        self._lock = threading.Lock()
+        self._service_time = None               # EWMA of slot hold times, for Retry-After
+        _controllers[name] = self
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """
+        Seconds a rejected client should wait: roughly how long the current
+        queue takes to drain, at least one second.
+        """
+        per_slot = self._service_time or 1.0
+        backlog = (len(self._waiters) + 1) / self.max_concurrent
+        return max(1, int(round(per_slot * backlog)))
+
+    def acquire(self):
+        """
+        Take a slot, waiting in the queue if needed.
+
+        Returns:
+            Acquisition time, to pass to release().
+        Raises:
+            Rejected: queue full (429) or queue timeout (503).
+        """
+        start = time.monotonic()
+        with self._lock:
+            if self.active < self.max_concurrent and not self._waiters:
+                self.active += 1
+                ADMITTED.inc(endpoint=self.name)
+                WAIT_SECONDS.observe(0.0, endpoint=self.name)
+                return start
+            if len(self._waiters) >= self.max_queue:
+                REJECTED.inc(endpoint=self.name, reason="queue_full")
+                raise Rejected(429, "queue_full", self.retry_after())
+            turn = threading.Event()
+            self._waiters.append(turn)
+
+        if not turn.wait(self.queue_timeout):
+            with self._lock:
+                if not turn.is_set():
+                    self._waiters.remove(turn)
+                    REJECTED.inc(endpoint=self.name, reason="timeout")
+                    raise Rejected(503, "timeout", self.retry_after())
+            # The slot was handed over just as the wait timed out; keep it
+        now = time.monotonic()
+        ADMITTED.inc(endpoint=self.name)
+        WAIT_SECONDS.observe(now - start, endpoint=self.name)
+        return now
+
+    def release(self, acquired_at=None):
+        """
+        Free a slot, handing it to the oldest waiter if there is one.
+        """
+        with self._lock:
+            if acquired_at is not None:
+                held = time.monotonic() - acquired_at
+                self._service_time = held if self._service_time is None \
+                    else 0.8 * self._service_time + 0.2 * held
+            if self._waiters:
+                self._waiters.popleft().set()   # slot passes on; active unchanged
+            else:
+                self.active -= 1
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold a slot for the duration of the block (raises Rejected).
+        """
+        acquired_at = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(acquired_at)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "max_concurrent": self.max_concurrent,
+                "queue_depth": len(self._waiters),
+                "max_queue": self.max_queue,
+                "rejected": {
+                    reason: REJECTED.value(endpoint=self.name, reason=reason)
+                    for reason in ("queue_full", "timeout")
+                }
+            }
+
+
+def rejection_response(e):
+    """
+    Flask JSON response for a Rejected error, with Retry-After.
+    """
+    from flask import jsonify
+    response = jsonify({"error": "Server busy, try again later", "reason": e.reason,
+                        "retry_after": e.retry_after})
+    response.status_code = e.status
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+def limited(controller):
+    """
+    Decorator for Flask views: run the view inside an admission slot and
+    answer 429/503 with Retry-After when it cannot get one.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                acquired_at = controller.acquire()
+            except Rejected as e:
+                return rejection_response(e)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                controller.release(acquired_at)
+        return wrapper
+    return decorator
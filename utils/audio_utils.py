@@ -1,13 +1,22 @@
 # utils/audio_utils.py
 
+import wave
 import numpy as np
 
 def normalize_audio(audio):
     """
     Normalize a NumPy waveform to the 16-bit range.
+
+    Scales straight into the int16 output, so no float temporaries the size
+    of the input are allocated.
     """
-    audio = audio / np.max(np.abs(audio))
-    return np.int16(audio * 32767)
+    out = np.empty(audio.shape, dtype=np.int16)
+    peak = max(float(np.max(audio, initial=0.0)), -float(np.min(audio, initial=0.0)))
+    if peak == 0:
+        out.fill(0)
+        return out
+    np.multiply(audio, 32767 / peak, out=out, casting='unsafe')
+    return out
 
 def apply_fade(audio, fade_in_duration=0.05, fade_out_duration=0.05, sample_rate=44100):
     """
@@ -16,10 +25,134 @@ def apply_fade(audio, fade_in_duration=0.05, fade_out_duration=0.05, sample_rate
     fade_in_samples = int(sample_rate * fade_in_duration)
     fade_out_samples = int(sample_rate * fade_out_duration)
 
-    fade_in = np.linspace(0, 1, fade_in_samples)
-    fade_out = np.linspace(1, 0, fade_out_samples)
+    fade_in = np.linspace(0, 1, fade_in_samples, dtype=audio.dtype)
+    fade_out = np.linspace(1, 0, fade_out_samples, dtype=audio.dtype)
 
     audio[:fade_in_samples] *= fade_in
     audio[-fade_out_samples:] *= fade_out
 
     return audio
+
+# ----------------------------------------
+# Chunked float32 rendering helpers
+# ----------------------------------------
+def pcm_to_float32(raw, sample_width, channels):
+    """
+    Convert interleaved PCM bytes to a float32 array of shape (frames, channels)
+    in the range [-1, 1].
+    """
+    dtype = {1: np.int8, 2: np.int16, 4: np.int32}[sample_width]
+    pcm = np.frombuffer(raw, dtype=dtype)
+    if sample_width == 1:                      # 8-bit WAV is unsigned
+        pcm = pcm.view(np.uint8).astype(np.int16) - 128
+    out = pcm.astype(np.float32)
+    out *= 1.0 / float(2 ** (8 * sample_width - 1))
+    return out.reshape(-1, channels)
+
+def float32_to_pcm16(audio):
+    """
+    Clip a float waveform to [-1, 1] (in place) and return int16 samples.
+    """
+    np.clip(audio, -1.0, 1.0, out=audio)
+    out = np.empty(audio.shape, dtype='<i2')
+    np.multiply(audio, 32767, out=out, casting='unsafe')
+    return out
+
+def float32_to_pcm(audio, sample_width=2):
+    """
+    Clip a float waveform to [-1, 1] (in place) and return PCM samples of
+    `sample_width` bytes, the inverse of pcm_to_float32().
+    """
+    if sample_width == 2:
+        return float32_to_pcm16(audio)
+    np.clip(audio, -1.0, 1.0, out=audio)
+    if sample_width == 1:                      # 8-bit WAV is unsigned
+        return (audio * 127 + 128).astype(np.uint8)
+    return (audio.astype(np.float64) * (2 ** 31 - 1)).astype('<i4')
+
+def soft_limit(audio, threshold=0.9):
+    """
+    Static soft-knee limiter, in place: samples below `threshold` pass
+    unchanged, louder ones are squashed smoothly towards ±1.
+    """
+    mag = np.abs(audio)
+    over = mag > threshold
+    if np.any(over):
+        knee = 1.0 - threshold
+        audio[over] = np.sign(audio[over]) * (threshold + knee * np.tanh((mag[over] - threshold) / knee))
+    return audio
+
+class WavChunkWriter:
+    """
+    Write a 16-bit WAV file incrementally from float32 chunks.
+
+    Usage:
+        with WavChunkWriter(path, 44100, channels=2) as w:
+            w.write(chunk)   # shape (frames,) or (frames, channels)
+    """
+
+    def __init__(self, path, sample_rate, channels=1):
+        self.channels = channels
+        self.frames = 0
+        self._wav = wave.open(path, 'wb')
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(sample_rate)
+
+    def write(self, chunk):
+        if len(chunk) == 0:
+            return
+        pcm = float32_to_pcm16(chunk)
+        self._wav.writeframesraw(pcm.tobytes())
+        self.frames += len(chunk)
+
+    def close(self):
+        if self._wav is not None:
+            self._wav.close()       # patches the header with the final length
+            self._wav = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class StreamingConvolver:
+    """
+    Overlap-add FFT convolution for signals that arrive in chunks.
+
+    process() returns exactly as many frames as it is given, so the result
+    matches fftconvolve(x, ir)[:len(x)] over the whole stream.
+    """
+
+    def __init__(self, ir, channels):
+        from scipy.signal import fftconvolve
+        self._fftconvolve = fftconvolve
+        self.ir = np.asarray(ir, dtype=np.float32)
+        self.tail = np.zeros((max(len(self.ir) - 1, 0), channels), dtype=np.float32)
+
+    def process(self, chunk):
+        """
+        chunk: float32 array of shape (frames, channels).
+        """
+        n = len(chunk)
+        if n == 0:
+            return chunk
+        y = self._fftconvolve(chunk, self.ir[:, np.newaxis], mode='full', axes=0).astype(np.float32, copy=False)
+        y[:len(self.tail)] += self.tail
+        self.tail = y[n:].copy()
+        return y[:n]
+
+    def splice(self, n, tail):
+        """
+        Skip `n` frames convolved elsewhere, whose own tail is `tail`.
+        Returns what the pending tail adds over those frames.
+        """
+        spill = np.zeros((n, self.tail.shape[1]), dtype=np.float32)
+        m = min(n, len(self.tail))
+        spill[:m] = self.tail[:m]
+        rest = self.tail[n:]
+        self.tail = np.zeros((max(len(tail), len(rest)), self.tail.shape[1]), dtype=np.float32)
+        self.tail[:len(tail)] += tail
+        self.tail[:len(rest)] += rest
+        return spill
@@ -0,0 +1,206 @@
+# utils/cost_model.py
+
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Fitted samples kept per (target, reverb) key; older ones are dropped so
+# the model follows changes in hardware and code
+MAX_SAMPLES = 200
+# Starting guesses, as (fixed seconds, seconds per second of audio), used
+# until a key has samples of its own and then blended in with the weight of
+# PRIOR_WEIGHT samples
+PRIORS = {
+    "enhanced": (1.0, 0.15),
+    "normal": (0.3, 0.05),
+    "wavetable": (0.2, 0.02),
+    "midi": (0.02, 0.0),
+}
+DEFAULT_PRIOR = (1.0, 0.15)
+REVERB_PRIOR_FACTOR = 1.5
+PRIOR_WEIGHT = 4.0
+SAVE_INTERVAL = 30.0
+
+
+class RenderCostModel:
+    """
+    Predicts the wall time of a render from its target, requested duration
+    and whether reverb runs, as a + b·duration per (target, reverb),
+    fitted by least squares to the render times recorded with observe().
+
+    With a `path`, samples are merged into that JSON file every
+    SAVE_INTERVAL seconds and re-read when another process changed it, so
+    web processes learn from the timings of separate render workers.
+    """
+
+    def __init__(self, path=None, max_samples=MAX_SAMPLES):
+        self.path = path
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples = {}          # key → [(timestamp, duration, seconds)]
+        self._fits = {}             # key → (a, b)
+        self._mtime = None
+        self._saved = time.time()
+        if path:
+            self._reload()
+
+    @staticmethod
+    def key(target, reverb=False):
+        return f"{target}+reverb" if reverb else target
+
+    # ---------------- samples ----------------
+    def observe(self, target, duration, seconds, reverb=False, at=None):
+        """
+        Record one finished render, finished at `at` (default: now). A
+        sample already recorded with the same time is not added again.
+        """
+        if not duration or seconds <= 0:
+            return
+        key = self.key(target, reverb)
+        sample = (time.time() if at is None else float(at), float(duration), float(seconds))
+        with self._lock:
+            samples = self._samples.setdefault(key, [])
+            if at is not None and sample in samples:
+                return
+            samples.append(sample)
+            samples.sort()
+            del samples[:-self.max_samples]
+            self._fits.pop(key, None)
+            due = self.path and time.time() - self._saved >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def observe_manifest(self, path):
+        """
+        Learn from the per-stage timings of a main.py manifest. Samples are
+        stamped with each entry's finish time, so reading the same manifest
+        again (in any process) adds nothing.
+        """
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+        count = 0
+        for line in lines:
+            try:
+                e = json.loads(line)
+            except ValueError:
+                continue
+            if e.get("status") != "done":
+                continue
+            try:
+                at = time.mktime(time.strptime(e["finished"], "%Y-%m-%dT%H:%M:%S"))
+            except (KeyError, TypeError, ValueError):
+                at = 0.0                    # unknown age: the first to go
+            for stage, seconds in e.get("timings", {}).items():
+                if stage.startswith("render."):
+                    self.observe(stage[len("render."):], e["duration"], seconds,
+                                 reverb="enhanced.reverb" in e["timings"], at=at)
+                    count += 1
+        return count
+
+    # ---------------- predictions ----------------
+    def coefficients(self, target, reverb=False):
+        """
+        (fixed seconds, seconds per second of audio) for a target.
+        """
+        self._reload()
+        key = self.key(target, reverb)
+        with self._lock:
+            fit = self._fits.get(key)
+            if fit is None:
+                fit = self._fits[key] = self._fit(target, reverb, self._samples.get(key, ()))
+            return fit
+
+    def _fit(self, target, reverb, samples):
+        a0, b0 = PRIORS.get(target, DEFAULT_PRIOR)
+        if reverb:
+            a0, b0 = a0 * REVERB_PRIOR_FACTOR, b0 * REVERB_PRIOR_FACTOR
+        if not samples:
+            return a0, b0
+        # The prior enters as pseudo-samples at a short and a long duration,
+        # which keeps the line sane while all samples share one duration
+        d = np.array([s[1] for s in samples] + [15.0, 300.0])
+        y = np.array([s[2] for s in samples] + [a0 + b0 * 15.0, a0 + b0 * 300.0])
+        w = np.array([1.0] * len(samples) + [PRIOR_WEIGHT / 2] * 2)
+        x = np.stack([np.ones_like(d), d], axis=1) * np.sqrt(w)[:, np.newaxis]
+        (a, b), *_ = np.linalg.lstsq(x, y * np.sqrt(w), rcond=None)
+        return max(0.0, float(a)), max(0.0, float(b))
+
+    def predict(self, target, duration, reverb=False):
+        """
+        Expected render time of one target in seconds.
+        """
+        a, b = self.coefficients(target, reverb)
+        return a + b * float(duration)
+
+    def stats(self):
+        self._reload()
+        with self._lock:
+            keys = list(self._samples)
+        out = {}
+        for key in keys:
+            target, _, reverb = key.partition("+")
+            a, b = self.coefficients(target, bool(reverb))
+            out[key] = {"samples": len(self._samples.get(key, ())), "fixed_s": round(a, 3), "per_audio_s": round(b, 4)}
+        return out
+
+    # ---------------- persistence ----------------
+    def _read_file(self):
+        try:
+            with open(self.path) as f:
+                return {k: [tuple(s) for s in v] for k, v in json.load(f).get("samples", {}).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _reload(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        stored = self._read_file()
+        with self._lock:
+            self._merge_locked(stored)
+            self._mtime = mtime
+
+    def _merge_locked(self, stored):
+        for key, samples in stored.items():
+            merged = sorted(set(self._samples.get(key, ())) | set(samples))
+            self._samples[key] = merged[-self.max_samples:]
+            self._fits.pop(key, None)
+
+    def save(self):
+        """
+        Merge this process's samples into the model file.
+        """
+        if not self.path:
+            return
+        stored = self._read_file()
+        with self._lock:
+            self._merge_locked(stored)
+            payload = {"samples": {k: [list(s) for s in v] for k, v in self._samples.items()}}
+            self._saved = time.time()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(payload, f)
+            os.replace(tmp, self.path)
+            self._mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            logger.warning("⚠️ Could not save the render cost model to %s: %s", self.path, e)
+
+
+# Shared by the pipeline (which records every render) and the servers
+COST_MODEL = RenderCostModel(os.environ.get("COST_MODEL_PATH") or None)
@@ -0,0 +1,316 @@
+# utils/job_queue.py
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Journal mode for the queue file. WAL is fastest but needs shared memory,
+# so it only works when every process is on the same host; use DELETE for
+# a queue file on network storage shared between machines.
+JOURNAL_MODE = os.environ.get("JOB_QUEUE_JOURNAL_MODE", "WAL")
+BUSY_TIMEOUT_MS = 10000
+# claim() runs the job with the smallest estimated cost first, less
+# JOB_AGING_RATE seconds of cost for every second a job has waited, so a
+# burst of long renders can't starve short ones and long ones still run
+JOB_AGING_RATE = float(os.environ.get("JOB_AGING_RATE", 0.5))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id       TEXT PRIMARY KEY,
+    meta     TEXT NOT NULL,
+    created  REAL NOT NULL,
+    stopped  REAL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch         TEXT REFERENCES batches(id),
+    kind          TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    status        TEXT NOT NULL DEFAULT 'queued',
+    priority      INTEGER NOT NULL DEFAULT 0,
+    cost          REAL NOT NULL DEFAULT 0,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL DEFAULT 3,
+    lease_owner   TEXT,
+    lease_expires REAL,
+    result        TEXT,
+    error         TEXT,
+    created       REAL NOT NULL,
+    updated       REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, id);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch);
+"""
+
+
+def _job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def _group_filter(group):
+    # substr rather than LIKE, so "_" and "%" in group names match literally
+    if group is None:
+        return "", ()
+    prefix = group + "/"
+    return " AND substr(id, 1, ?) = ?", (len(prefix), prefix)
+
+
+class JobQueue:
+    """
+    Durable job queue in one SQLite file, shared by web and worker processes.
+
+    Workers claim() a job atomically and get a lease on it. While the lease
+    is valid no other worker can take the job; heartbeat() extends it. If a
+    worker dies, the lease runs out and the job is handed to the next
+    claim(), up to `max_attempts` times in total. Jobs can be grouped into
+    batches (e.g. one player session) whose metadata lives in the same file.
+
+    Within a priority, jobs run shortest first by their estimated `cost` in
+    seconds, aged by JOB_AGING_RATE (see claim()).
+    """
+
+    def __init__(self, path, aging_rate=JOB_AGING_RATE):
+        self.path = path
+        self.aging_rate = aging_rate
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            db.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+            db.execute("PRAGMA synchronous = NORMAL")
+            self._local.db = db
+        return db
+
+    def _tx(self):
+        return _Transaction(self._conn())
+
+    # ---------------- producers ----------------
+    def create_batch(self, batch_id, meta, jobs=(), exclusive=False, group=None):
+        """
+        Create a batch and enqueue its jobs, given as (kind, payload) pairs
+        or (kind, payload, cost) triples, in one transaction.
+
+        With exclusive=True nothing is created while another batch is still
+        open (not stopped); returns False in that case. With a `group` (the
+        batch id must then start with "<group>/"), only open batches of the
+        same group count.
+        """
+        if group is not None and not batch_id.startswith(group + "/"):
+            raise ValueError(f"Batch id '{batch_id}' is not in group '{group}'")
+        now = time.time()
+        where, params = _group_filter(group)
+        with self._tx() as db:
+            if exclusive and db.execute("SELECT 1 FROM batches WHERE stopped IS NULL" + where, params).fetchone():
+                return False
+            db.execute("INSERT INTO batches (id, meta, created) VALUES (?, ?, ?)",
+                       (batch_id, json.dumps(meta), now))
+            db.executemany(
+                "INSERT INTO jobs (batch, kind, payload, cost, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                [(batch_id, job[0], json.dumps(job[1]), job[2] if len(job) > 2 else 0.0, now, now)
+                 for job in jobs])
+        return True
+
+    def enqueue(self, kind, payload, batch=None, priority=0, max_attempts=3, cost=0.0):
+        """
+        Add a job and return its id.
+        """
+        now = time.time()
+        with self._tx() as db:
+            cur = db.execute(
+                "INSERT INTO jobs (batch, kind, payload, priority, max_attempts, cost, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (batch, kind, json.dumps(payload), priority, max_attempts, cost, now, now))
+            return cur.lastrowid
+
+    def stop_batch(self, batch_id):
+        """
+        Mark a batch stopped and cancel its jobs that have not started.
+        """
+        now = time.time()
+        with self._tx() as db:
+            db.execute("UPDATE batches SET stopped = ? WHERE id = ? AND stopped IS NULL", (now, batch_id))
+            db.execute("UPDATE jobs SET status = ?, updated = ? WHERE batch = ? AND status = ?",
+                       (CANCELLED, now, batch_id, QUEUED))
+
+    def stopped_batches(self, before):
+        """
+        Ids of batches stopped no later than `before` with no job still running.
+        """
+        rows = self._conn().execute(
+            "SELECT id FROM batches WHERE stopped <= ? AND NOT EXISTS "
+            "(SELECT 1 FROM jobs WHERE jobs.batch = batches.id AND status = ?) ORDER BY stopped",
+            (before, RUNNING))
+        return [r["id"] for r in rows]
+
+    def purge_batch(self, batch_id):
+        """
+        Delete a stopped batch and its jobs, unless one of them is running
+        again; returns whether it was deleted.
+        """
+        with self._tx() as db:
+            if db.execute("SELECT 1 FROM jobs WHERE batch = ? AND status = ?", (batch_id, RUNNING)).fetchone():
+                return False
+            db.execute("DELETE FROM jobs WHERE batch = ?", (batch_id,))
+            cur = db.execute("DELETE FROM batches WHERE id = ? AND stopped IS NOT NULL", (batch_id,))
+            return cur.rowcount == 1
+
+    # ---------------- workers ----------------
+    def claim(self, worker_id, kinds=None, lease_seconds=60.0):
+        """
+        Atomically take the next runnable job: queued, or running with an
+        expired lease. Returns the job dict, or None when there is nothing
+        to do.
+
+        Highest priority first, then shortest job first: the smallest
+        cost − aging_rate × seconds waited, oldest first among equals.
+        """
+        now = time.time()
+        kind_filter, params = "", [QUEUED, RUNNING, now]
+        if kinds:
+            kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})"
+            params += list(kinds)
+        with self._tx() as db:
+            # Jobs whose lease ran out too often are given up on
+            db.execute("UPDATE jobs SET status = ?, error = 'lease expired', updated = ? "
+                       "WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts",
+                       (FAILED, now, RUNNING, now))
+            row = db.execute(
+                "SELECT id FROM jobs WHERE (status = ? OR (status = ? AND lease_expires < ?))"
+                + kind_filter + " ORDER BY priority DESC, cost - ? * (? - created), id LIMIT 1",
+                params + [self.aging_rate, now]).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                (RUNNING, worker_id, now + lease_seconds, now, row["id"]))
+            return _job(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=60.0):
+        """
+        Extend a lease. Returns False if the worker no longer owns the job.
+        """
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = ?",
+                (time.time() + lease_seconds, time.time(), job_id, worker_id, RUNNING))
+            return cur.rowcount == 1
+
+    def complete(self, job_id, worker_id, result=None):
+        """
+        Record a job's result. Returns False if the lease was lost meanwhile.
+        """
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE jobs SET status = ?, result = ?, lease_owner = NULL, lease_expires = NULL, "
+                "updated = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                (DONE, json.dumps(result), time.time(), job_id, worker_id, RUNNING))
+            return cur.rowcount == 1
+
+    def fail(self, job_id, worker_id, error):
+        """
+        Record a failure; the job is retried until it has used max_attempts.
+        """
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END, "
+                "error = ?, lease_owner = NULL, lease_expires = NULL, updated = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = ?",
+                (FAILED, QUEUED, str(error), time.time(), job_id, worker_id, RUNNING))
+            return cur.rowcount == 1
+
+    # ---------------- readers ----------------
+    def get(self, job_id):
+        return _job(self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def batch(self, batch_id):
+        row = self._conn().execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None
+        batch = dict(row)
+        batch["meta"] = json.loads(batch["meta"])
+        return batch
+
+    def latest_batch(self, include_stopped=False, group=None):
+        where, params = _group_filter(group)
+        query = "SELECT id FROM batches WHERE " + ("1" if include_stopped else "stopped IS NULL") + where
+        row = self._conn().execute(query + " ORDER BY created DESC LIMIT 1", params).fetchone()
+        return self.batch(row["id"]) if row else None
+
+    def open_batches(self):
+        rows = self._conn().execute("SELECT id FROM batches WHERE stopped IS NULL ORDER BY created")
+        return [self.batch(r["id"]) for r in rows]
+
+    def batch_jobs(self, batch_id):
+        rows = self._conn().execute("SELECT * FROM jobs WHERE batch = ? ORDER BY id", (batch_id,))
+        return [_job(r) for r in rows]
+
+    def aged_cost(self, job, now=None):
+        """
+        A job's place in the claim order: its cost less the aging credit.
+        """
+        now = time.time() if now is None else now
+        return job["cost"] - self.aging_rate * (now - job["created"])
+
+    def backlog_seconds(self, until=None):
+        """
+        Estimated seconds of running and queued work; with `until`, only the
+        queued jobs claimed no later than a job whose aged_cost() is `until`.
+        """
+        now = time.time()
+        query = "SELECT COALESCE(SUM(cost), 0) AS s FROM jobs WHERE status IN (?, ?)"
+        params = [QUEUED, RUNNING]
+        if until is not None:
+            query += " AND (status = ? OR cost - ? * (? - created) <= ?)"
+            params += [RUNNING, self.aging_rate, now, until]
+        return self._conn().execute(query, params).fetchone()["s"]
+
+    def active_workers(self):
+        """
+        Workers holding a live lease.
+        """
+        row = self._conn().execute(
+            "SELECT COUNT(DISTINCT lease_owner) AS n FROM jobs WHERE status = ? AND lease_expires >= ?",
+            (RUNNING, time.time())).fetchone()
+        return row["n"]
+
+    def counts(self):
+        """
+        Number of jobs in each status.
+        """
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        return {r["status"]: r["n"] for r in rows}
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE … COMMIT, so a read-then-update (claim) cannot interleave
+    with another process's writes.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -0,0 +1,247 @@
+# utils/metrics.py
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("harmonium.metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Requested tune lengths are grouped so histograms stay low-cardinality
+DURATION_CLASSES = (15, 45, 120, 300, 600)
+
+
+def _label_key(labelnames, labels):
+    missing = set(labelnames) - set(labels)
+    if missing or len(labels) != len(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {sorted(labels)}")
+    return tuple(str(labels[n]) for n in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _format_value(v):
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by labels.
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            yield self.name, _format_labels(self.labelnames, key), v
+
+
+class Gauge:
+    """
+    Point-in-time value; either set directly or read from a callback.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback          # callback() -> {label tuple: value} or a number
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, v in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), v
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus style.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}                 # label key → [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """
+        Return {label tuple: (sum, count)} for quick summaries.
+        """
+        with self._lock:
+            return {k: (s[1], s[2]) for k, s in self._series.items()}
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, ([*s[0]], s[1], s[2])) for k, s in self._series.items())
+        for key, (counts, total, count) in items:
+            running = 0
+            for bound, c in zip(self.buckets, counts):
+                running += c
+                yield self.name + "_bucket", _format_labels(self.labelnames, key, [("le", _format_value(bound))]), running
+            yield self.name + "_sum", _format_labels(self.labelnames, key), total
+            yield self.name + "_count", _format_labels(self.labelnames, key), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric '{name}' already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Gauge, name, documentation, labelnames, callback)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format (0.0.4).
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.documentation}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ----------------------------------------
+# Pipeline metrics shared by both servers
+# ----------------------------------------
+STAGE_SECONDS = REGISTRY.histogram(
+    "harmonium_stage_seconds", "Wall time spent in each pipeline stage.", ("stage",))
+RENDER_SECONDS = REGISTRY.histogram(
+    "harmonium_render_seconds", "Wall time of a full render, by target and requested duration class.",
+    ("target", "duration"))
+RENDERS = REGISTRY.counter(
+    "harmonium_renders_total", "Completed renders by target.", ("target",))
+FAILURES = REGISTRY.counter(
+    "harmonium_failures_total", "Failed pipeline runs by stage.", ("stage",))
+CACHE_HITS = REGISTRY.counter(
+    "harmonium_cache_hits_total", "Requests served from an existing render.", ("cache",))
+CACHE_MISSES = REGISTRY.counter(
+    "harmonium_cache_misses_total", "Requests that needed a fresh render.", ("cache",))
+
+
+def duration_class(seconds):
+    """
+    Bucket a requested tune length into a label such as "15" or "300+".
+    """
+    for limit in DURATION_CLASSES:
+        if seconds <= limit:
+            return str(limit)
+    return f"{DURATION_CLASSES[-1]}+"
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a pipeline stage into harmonium_stage_seconds; failures are counted
+    against the stage and re-raised.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        FAILURES.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        logger.debug("⏱️ %s took %.3fs", stage, elapsed)
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics_response():
+    """
+    Flask response for a /metrics endpoint.
+    """
+    from flask import Response
+    return Response(REGISTRY.render(), mimetype=None, content_type=CONTENT_TYPE)
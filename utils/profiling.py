@@ -0,0 +1,268 @@
+# utils/profiling.py
+
+import cProfile
+import collections
+import functools
+import hmac
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+# Admin token that unlocks profiling; profiling is unavailable while unset.
+# Ask for a profile with the X-Profile header (or ?profile=) set to a mode
+# and the token in X-Profile-Token (or ?profile_token=).
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
+# Stack depth tracemalloc records per allocation; deeper is slower
+TRACEMALLOC_FRAMES = 8
+TOP_N = 20
+
+MODES = ("cprofile", "sample")
+FORMATS = {".pstats": "application/octet-stream", ".collapsed": "text/plain", ".json": "application/json"}
+_NAME_RE = re.compile(r"^[0-9a-f-]+\.(pstats|collapsed|json)$")
+
+# tracemalloc is process-wide, so only one profile runs at a time
+_busy = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """
+    Raised when a profile is requested while another one is running.
+    """
+
+
+def is_admin(req):
+    token = req.headers.get("X-Profile-Token") or req.args.get("profile_token") or ""
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def requested_mode(req):
+    """
+    Profiling mode the request asks for, or None. Costs two dict lookups
+    when no profile is asked for.
+
+    Raises:
+        PermissionError: A profile was asked for without the admin token.
+        ValueError: Unknown mode.
+    """
+    mode = req.headers.get("X-Profile") or req.args.get("profile")
+    if not mode:
+        return None
+    if not is_admin(req):
+        raise PermissionError("Profiling needs the admin token")
+    mode = "cprofile" if mode in ("1", "true") else mode
+    if mode not in MODES:
+        raise ValueError(f"Unknown profile mode '{mode}' (use one of: {', '.join(MODES)})")
+    return mode
+
+
+class Profiler:
+    """
+    Profile of one request: cProfile (deterministic, pstats output) or a
+    stack sampler (collapsed stacks for flamegraph tools), plus the
+    tracemalloc peak and top allocation sites, stored under `id` in
+    PROFILE_DIR.
+
+    The slot is reserved on creation (ProfilerBusy if another profile is
+    running), so a request can hand the profiler to the thread that does
+    the work and enter it there. Only the thread that enters it is
+    profiled; phrase renders in worker processes are not.
+    """
+
+    def __init__(self, endpoint, mode):
+        if not _busy.acquire(blocking=False):
+            raise ProfilerBusy("Another profile is running")
+        self.id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:8]
+        self.endpoint = endpoint
+        self.mode = mode
+        self._reserved = True
+        self._profile = None
+        self._samples = collections.Counter()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def discard(self):
+        """
+        Give up the slot of a profiler that was never entered.
+        """
+        if self._reserved:
+            self._reserved = False
+            _busy.release()
+
+    def __enter__(self):
+        self._started = time.time()
+        self._t0 = time.perf_counter()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._t0
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+        try:
+            _, peak = tracemalloc.get_traced_memory()
+            allocations = tracemalloc.take_snapshot().statistics("lineno")[:TOP_N]
+            tracemalloc.stop()
+            self._save(wall, peak, allocations, exc)
+        finally:
+            self.discard()
+
+    # ---------------- sampling ----------------
+    def _sample(self, ident):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self._samples[";".join(reversed(stack))] += 1
+
+    # ---------------- output ----------------
+    def path(self, ext):
+        return os.path.join(PROFILE_DIR, self.id + ext)
+
+    def _save(self, wall, peak, allocations, exc):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        summary = {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "mode": self.mode,
+            "started": self._started,
+            "wall_seconds": round(wall, 4),
+            "error": repr(exc) if exc else None,
+            "peak_memory_bytes": peak,
+            "top_allocations": [
+                {"where": f"{s.traceback[0].filename}:{s.traceback[0].lineno}", "bytes": s.size, "count": s.count}
+                for s in allocations
+            ]
+        }
+        if self._profile is not None:
+            self._profile.dump_stats(self.path(".pstats"))
+            out = io.StringIO()
+            pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(TOP_N)
+            summary["top_functions"] = out.getvalue().splitlines()
+            summary["files"] = [self.id + ".pstats"]
+        else:
+            with open(self.path(".collapsed"), "w") as f:
+                for stack, n in self._samples.most_common():
+                    f.write(f"{stack} {n}\n")
+            summary["samples"] = sum(self._samples.values())
+            summary["files"] = [self.id + ".collapsed"]
+        with open(self.path(".json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        _prune()
+
+
+def _prune():
+    summaries = sorted(n for n in os.listdir(PROFILE_DIR) if n.endswith(".json"))
+    for name in summaries[:-PROFILE_KEEP] if PROFILE_KEEP else []:
+        profile_id = name[:-len(".json")]
+        for ext in FORMATS:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + ext))
+            except FileNotFoundError:
+                pass
+
+
+# ---------------- Flask helpers ----------------
+def _error(message, status):
+    from flask import jsonify
+    response = jsonify({"error": message})
+    response.status_code = status
+    return response
+
+
+def request_profiler(endpoint):
+    """
+    Profiler for the current Flask request, or None when none was asked for.
+
+    Returns:
+        (profiler, None), or (None, error response) for a bad or refused
+        request.
+    """
+    from flask import request
+    try:
+        mode = requested_mode(request)
+        return (Profiler(endpoint, mode) if mode else None), None
+    except PermissionError as e:
+        return None, _error(str(e), 403)
+    except ValueError as e:
+        return None, _error(str(e), 400)
+    except ProfilerBusy as e:
+        return None, _error(str(e), 409)
+
+
+def profiled(view):
+    """
+    Decorator for Flask views: profile the view when an admin asks for it
+    and return the profile ID in the X-Profile-Id header.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        profiler, error = request_profiler(view.__name__)
+        if error is not None:
+            return error
+        if profiler is None:
+            return view(*args, **kwargs)
+        with profiler:
+            response = view(*args, **kwargs)
+        return with_profile_id(response, profiler)
+    return wrapper
+
+
+def with_profile_id(response, profiler):
+    """
+    Add the X-Profile-Id header to a view's return value when profiling.
+    """
+    if profiler is None:
+        return response
+    from flask import make_response
+    response = make_response(response)
+    response.headers["X-Profile-Id"] = profiler.id
+    return response
+
+
+def profiles_response(name=None):
+    """
+    Flask response for /profiles (list of summaries) and
+    /profiles/<id>.<pstats|collapsed|json> (download); admin only.
+    """
+    from flask import request, jsonify, send_file
+    if not is_admin(request):
+        return _error("Profiling needs the admin token", 403)
+    if name is None:
+        if not os.path.isdir(PROFILE_DIR):
+            return jsonify({"profiles": []})
+        profiles = []
+        for n in sorted(os.listdir(PROFILE_DIR), reverse=True):
+            if n.endswith(".json"):
+                with open(os.path.join(PROFILE_DIR, n)) as f:
+                    s = json.load(f)
+                profiles.append({k: s[k] for k in ("id", "endpoint", "mode", "started", "wall_seconds",
+                                                    "peak_memory_bytes", "files")})
+        return jsonify({"profiles": profiles})
+    path = os.path.join(PROFILE_DIR, name)
+    if not _NAME_RE.match(name) or not os.path.exists(path):
+        return _error("No such profile", 404)
+    return send_file(os.path.abspath(path), mimetype=FORMATS[os.path.splitext(name)[1]],
+                     as_attachment=not name.endswith(".json"))
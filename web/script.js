@@ -13,11 +13,20 @@ document.getElementById('upload-form').addEventListener('submit', async function
 
     const normalUrl = data.normal_url + cacheBuster;
     const enhancedUrl = data.enhanced_url + cacheBuster;
+    const wavetableUrl = data.wavetable_url + cacheBuster;
+    const midiUrl = data.midi_url + cacheBuster;
 
     document.getElementById('output').classList.remove('hidden');
     document.getElementById('raga-info').innerText = `🎼 Raga: ${data.raga}`;
     document.getElementById('swaras-info').innerText = `🎵 Swaras: ${data.swaras.join(', ')}`;
 
+    // Resized copy of the upload (immutable URL, so no cache buster)
+    const preview = document.getElementById('image-preview');
+    if (data.image_url) {
+      preview.src = data.image_url;
+      preview.classList.remove('hidden');
+    }
+
     document.getElementById('audio-source').src = normalUrl;
     document.getElementById('audio-player').load();
     document.getElementById('download-link-normal').href = normalUrl;
@@ -25,6 +34,24 @@ document.getElementById('upload-form').addEventListener('submit', async function
     document.getElementById('enhanced-audio-source').src = enhancedUrl;
     document.getElementById('enhanced-audio-player').load();
     document.getElementById('download-link-enhanced').href = enhancedUrl;
+
+    document.getElementById('wavetable-audio-source').src = wavetableUrl;
+    document.getElementById('wavetable-audio-player').load();
+    document.getElementById('download-link-wavetable').href = wavetableUrl;
+
+    // Only offered when the server has FluidSynth and the SoundFont
+    const soundfontSection = document.getElementById('soundfont-section');
+    if (data.soundfont_url) {
+      const soundfontUrl = data.soundfont_url + cacheBuster;
+      document.getElementById('soundfont-audio-source').src = soundfontUrl;
+      document.getElementById('soundfont-audio-player').load();
+      document.getElementById('download-link-soundfont').href = soundfontUrl;
+      soundfontSection.classList.remove('hidden');
+    } else {
+      soundfontSection.classList.add('hidden');
+    }
+
+    document.getElementById('download-link-midi').href = midiUrl;
   } else {
     alert("Error generating music.");
   }
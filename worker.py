@@ -0,0 +1,166 @@
+# worker.py
+"""
+Standalone render worker for the shared SQLite job queue.
+
+Run any number of these, on this machine or on others that mount the same
+storage; each one claims render jobs, writes the tune into the shared tune
+directory and records the result for the web tier:
+
+    JOB_QUEUE_PATH=/shared/jobs.sqlite python worker.py --tune-dir /shared/generated_tunes
+"""
+
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from pipeline import render_image_tune, AUDIO_TARGETS
+from tune_pool import sidecar_path
+from utils.job_queue import JobQueue, DONE, FAILED, FINISHED
+
+logger = logging.getLogger("worker")
+
+RENDER_JOB = "render_tune"
+LEASE_SECONDS = 60.0
+POLL_INTERVAL = 1.0
+# Outputs of a stopped batch are kept this long (for streams still finishing
+# their current tune), then deleted; the sweep runs every SWEEP_INTERVAL seconds
+STOPPED_GRACE_SECONDS = float(os.environ.get("STOPPED_GRACE_SECONDS", 60))
+SWEEP_INTERVAL = 60.0
+
+
+def job_file_name(job):
+    """
+    Output name for a render job; deliberately not in the tune pool's
+    naming scheme, so pools never mistake it for one of their own files.
+    """
+    p = job["payload"]
+    stem = os.path.splitext(p["image"])[0]
+    return f"{stem}__{int(p['duration'])}s__job{job['id']}.wav"
+
+
+def run_render_job(job, image_dir, tune_dir, engine):
+    """
+    Render one job's tune (plus its MIDI sidecar) and return the result
+    recorded in the queue.
+    """
+    p = job["payload"]
+    name = job_file_name(job)
+    path = os.path.join(tune_dir, name)
+    tmp = path + ".part.wav"
+    try:
+        raga, _ = render_image_tune(
+            os.path.join(image_dir, p["image"]),
+            {engine: tmp, "midi": sidecar_path(tmp, ".mid")},
+            p["duration"]
+        )
+    except Exception:
+        _remove(tmp, sidecar_path(tmp, ".mid"))
+        raise
+    os.replace(sidecar_path(tmp, ".mid"), sidecar_path(path, ".mid"))
+    os.replace(tmp, path)
+    return {"file": name, "midi": sidecar_path(name, ".mid"), "raga": raga}
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def end_if_all_failed(queue, batch_id):
+    """
+    Stop a batch once every job in it has failed: nothing will ever play,
+    and /start may then open a new batch for the same session name.
+    """
+    jobs = queue.batch_jobs(batch_id)
+    if jobs and all(j["status"] in FINISHED for j in jobs) and not any(j["status"] == DONE for j in jobs):
+        logger.warning("🛑 Every job of batch %s failed; stopping it", batch_id)
+        queue.stop_batch(batch_id)
+
+
+def sweep_stopped(queue, tune_dir, grace=STOPPED_GRACE_SECONDS):
+    """
+    Delete the outputs of batches stopped more than `grace` seconds ago,
+    then the batches themselves, so the shared tune directory doesn't grow
+    with every session.
+    """
+    for batch_id in queue.stopped_batches(time.time() - grace):
+        outputs = [j["result"] for j in queue.batch_jobs(batch_id) if j["status"] == DONE and j["result"]]
+        _remove(*(os.path.join(tune_dir, r[key]) for r in outputs for key in ("file", "midi")))
+        if queue.purge_batch(batch_id):
+            logger.info("🧹 Removed batch %s and its %d tunes", batch_id, len(outputs))
+
+
+def _keep_lease(queue, job, worker_id, done):
+    while not done.wait(LEASE_SECONDS / 3):
+        if not queue.heartbeat(job["id"], worker_id, LEASE_SECONDS):
+            logger.warning("⚠️ Lost the lease on job %s", job["id"])
+            return
+
+
+def work(queue, worker_id, image_dir, tune_dir, engine, once=False):
+    """
+    Claim and run render jobs until interrupted (or the queue is empty,
+    with once=True).
+    """
+    os.makedirs(tune_dir, exist_ok=True)
+    last_sweep = 0.0
+    while True:
+        if time.time() - last_sweep >= SWEEP_INTERVAL:
+            sweep_stopped(queue, tune_dir)
+            last_sweep = time.time()
+        job = queue.claim(worker_id, kinds=(RENDER_JOB,), lease_seconds=LEASE_SECONDS)
+        if job is None:
+            if once:
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        logger.info("🎛️ Job %s: %s (%ss, attempt %s)", job["id"], job["payload"]["image"],
+                    job["payload"]["duration"], job["attempts"])
+        done = threading.Event()
+        threading.Thread(target=_keep_lease, args=(queue, job, worker_id, done), daemon=True).start()
+        try:
+            result = run_render_job(job, image_dir, tune_dir, engine)
+        except Exception as e:
+            logger.exception("❌ Job %s failed", job["id"])
+            if queue.fail(job["id"], worker_id, e) and job["batch"] and queue.get(job["id"])["status"] == FAILED:
+                end_if_all_failed(queue, job["batch"])
+        else:
+            if not queue.complete(job["id"], worker_id, result):
+                logger.warning("⚠️ Job %s finished after its lease was taken over", job["id"])
+                if queue.get(job["id"]) is None:
+                    # Its batch was stopped and swept meanwhile
+                    _remove(os.path.join(tune_dir, result["file"]), os.path.join(tune_dir, result["midi"]))
+        finally:
+            done.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render worker for the shared job queue")
+    parser.add_argument("--queue", default=os.environ.get("JOB_QUEUE_PATH", "jobs.sqlite"))
+    parser.add_argument("--image-dir", default="random_images")
+    parser.add_argument("--tune-dir", default="generated_tunes")
+    parser.add_argument("--engine", default=os.environ.get("TUNE_ENGINE", "enhanced"))
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = parser.parse_args()
+    if args.engine not in AUDIO_TARGETS:
+        parser.error(f"unknown engine '{args.engine}' (choose from: {', '.join(AUDIO_TARGETS)})")
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    logger.info("👷 Worker %s on %s", worker_id, args.queue)
+    try:
+        work(JobQueue(args.queue), worker_id, args.image_dir, args.tune_dir, args.engine, args.once)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()